@@ -3,7 +3,8 @@ import os
 current_directory = os.path.dirname(os.path.abspath(__file__))
 
 
-# The second file is appended line by one to the first
+# The second file is appended line by line to the first
+# The files are streamed, so they are never fully loaded in memory
 def simple_combine(first_file_name, second_file_name, new_file_name):
     first_file_path = os.path.join(current_directory, first_file_name)
     second_file_path = os.path.join(current_directory, second_file_name)
@@ -14,11 +15,9 @@ def simple_combine(first_file_name, second_file_name, new_file_name):
 
     with open(new_file_path, 'w') as new_file:
         with open(first_file_path, 'r', errors='ignore') as first_file:
-            first_lines = first_file.readlines()
-        new_file.writelines(first_lines)
+            new_file.writelines(first_file)
         with open(second_file_path, 'r', errors='ignore') as second_file:
-            second_lines = second_file.readlines()
-        new_file.writelines(second_lines)
+            new_file.writelines(second_file)
 
     return None
 
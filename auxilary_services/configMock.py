@@ -10,10 +10,27 @@ class ConfigMock:
         self.start_time = datetime.strptime(start, '%m/%d/%Y %H:%M')
         self.end_time = datetime.strptime(end, '%m/%d/%Y %H:%M')
         self.interval = interval
+        self.intervals = [interval]
+        self.interval_sweep = False
         self.clear_data = clear
+        self.filter_sweep_clear = []
+        self.filter_sweep_thresholds = []
+        self.filter_sweep_unc = []
+        self.filter_sweep = False
+        self.batched_averaging = False
+        self.prefix_index = False
+        self.data_engine = 'objects'
         self.value_multipliers = [float(mult) for mult in multipliers]
         self.value_thresholds = [int(thr) for thr in thresholds]
         self.is_custom_interval = False
+        self.sorted_files = False
+        self.read_workers = 1
+        self.plot_workers = 1
+        self.fit_tables = False
+        self.instrumentation = False
+        self.file_cache = False
+        self.cache_size_mb = 1000
+        self.incremental = False
 
         self.compared_detector = detector
         self.compared_file_separator = separator
@@ -0,0 +1,130 @@
+import numpy as np
+
+from configMock import ConfigMock
+from manage_data import services
+from manage_data.datetime_parser import to_epoch
+
+import fit_services
+
+# The code reads the detector files over a long record, averages them over equidistant intervals
+# and finds the episodes where the averaged values decay (e.g. after each ventilation or radon peak)
+# Every episode of every detector is fitted by the exponential a*exp(-bx) + c and the log-linear ax + b
+# of exponential_decrease_fit.py, all episodes are fitted together in one batched call of each fit
+# The effective half-times of all episodes are saved in one table in fit_files
+
+# An episode has at least this many averaged points
+MIN_EPISODE_POINTS = 6
+# The values fall by at least this fraction of the episode start value
+MIN_DROP_FRACTION = 0.3
+# A value less than NOISE_FACTOR combined uncertainties (of the value and the smallest value of the episode so far)
+# above that smallest value does not end the episode, so the rises inside an episode add up to at most this much
+NOISE_FACTOR = 1.0
+# An episode ends at a gap of more than this many intervals (e.g. intervals removed by clear_data)
+MAX_GAP_INTERVALS = 2
+HAS_UNCERTAINTY = True
+
+
+# Finds the decay episodes of the averaged series (times in seconds, ascending)
+# An episode starts at a local maximum (the last point of a rise) and goes on while the values stay within
+# the tolerance of its running minimum, the start is then moved to the largest value of the episode
+# An episode is kept if it has enough points, the values drop enough and the least-squares slope is negative
+# Returns the first and last point index of each episode
+def decay_episodes(times, values, uncertainties, interval_len):
+    starts, ends = [], []
+    max_gap = MAX_GAP_INTERVALS * interval_len * 60
+    i = 0
+    while i < len(values) - 1:
+        if values[i + 1] >= values[i] or times[i + 1] - times[i] > max_gap:
+            i += 1
+            continue
+
+        # i is a local maximum, the episode goes on while the values stay near its running minimum
+        minimum = i + 1
+        end = i + 1
+        while end + 1 < len(values) and times[end + 1] - times[end] <= max_gap:
+            j = end + 1
+            if values[j] > values[minimum] + NOISE_FACTOR * np.hypot(uncertainties[j], uncertainties[minimum]):
+                break
+            if values[j] < values[minimum]:
+                minimum = j
+            end = j
+
+        start = i + int(np.argmax(values[i:end + 1]))
+        if end - start + 1 >= MIN_EPISODE_POINTS and \
+                values[start] - values[minimum] >= MIN_DROP_FRACTION * abs(values[start]) and \
+                np.polyfit(times[start:end + 1] - times[start], values[start:end + 1], 1)[0] < 0:
+            starts.append(start)
+            ends.append(end)
+        i = end
+
+    return np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64)
+
+
+# Exponential and log-linear fit columns of one episode, - for the fits which could not be done
+def episode_columns(exponential_fit, log_linear_fit):
+    columns = ''
+    if exponential_fit is None:
+        columns += '-, -, -, -, -, -, -, -, -, -, -, '
+    else:
+        (a, b, c), (a_unc, b_unc, c_unc), chi_squared, dof, p_val, iterations, converged = exponential_fit
+        t_half = -np.log(2) / b
+        t_half_unc = t_half * b_unc / (-b)
+        fit_line = f'{chi_squared}, {dof}, {p_val}, ' if HAS_UNCERTAINTY else '-, -, -, '
+        columns += f'{t_half}, {t_half_unc}, {a}, {a_unc}, {c}, {c_unc}, {fit_line}{iterations}, {converged}, '
+
+    if log_linear_fit is None:
+        columns += '-, -, -, -, -, -\n'
+    else:
+        ((a, _), (a_unc, _), chi_squared, dof, p_val, _, _), r_squared = log_linear_fit
+        t_half = -np.log(2) / a
+        t_half_unc = t_half * a_unc / (-a)
+        fit_line = f'{chi_squared}, {dof}, {p_val}' if HAS_UNCERTAINTY else '-, -, -'
+        columns += f'{t_half}, {t_half_unc}, {r_squared}, {fit_line}\n'
+    return columns
+
+
+configuration = ConfigMock('activity', 'Bq/m3', '07/01/2021 00:00', '08/01/2021 00:00',
+                           60, [], [1.0, 1.0, 1.0, 1.0], [0, 100000, 0, 100000],
+                           'alphae', ';', [0], [6, 7], '%Y-%m-%d %H:%M:%S', [0, 0], 'UTF16', 60,
+                           'inside', 'stdev')
+
+intervals = services.prepare_intervals(configuration)
+all_raw_data, det_serials = services.read_files('compared', configuration)
+
+if not det_serials:
+    det_serials = [configuration.compared_detector for det in all_raw_data]
+
+# Episodes of each detector - detector serial, episode number and the averaged datapoints of the episode
+episodes = []
+for i in range(0, len(all_raw_data)):
+    av_data, _ = services.ref_average_intervals(intervals, all_raw_data[i], configuration, 'compared')
+    times = np.array([to_epoch(dp.meas_time) for dp in av_data], dtype=np.float64)
+    values = np.array([dp.value for dp in av_data], dtype=np.float64)
+    uncertainties = np.array([dp.value_unc for dp in av_data], dtype=np.float64)
+    starts, ends = decay_episodes(times, values, uncertainties, configuration.interval)
+    for number, (start, end) in enumerate(zip(starts, ends), 1):
+        episodes.append((det_serials[i], number, av_data[start:end + 1]))
+
+unit = configuration.unit
+
+episode_lines = ['Decay episodes - exponential fit a*exp(-bx) + c and log-linear fit ax + b\n',
+                 f'Detector, Episode, Start, End, Points, Start value ({unit}), End value ({unit}), '
+                 f'T - effective time for half (min), T uncertainty (min), a ({unit}), a uncertainty ({unit}), '
+                 f'c ({unit}), c uncertainty ({unit}), chi-squared, degrees of freedom, p-value, '
+                 f'iterations, converged, '
+                 f'Log-linear T (min), Log-linear T uncertainty (min), R-squared, '
+                 f'Log-linear chi-squared, Log-linear degrees of freedom, Log-linear p-value \n']
+
+if episodes:
+    # Each episode is fitted from its own start, all episodes of all detectors at once
+    all_datapoints = [datapoints for _, _, datapoints in episodes]
+    exponential_fits = fit_services.fit_exponential_decreases(all_datapoints, None, HAS_UNCERTAINTY)
+    log_linear_fits = fit_services.fit_log_linears(all_datapoints, None, HAS_UNCERTAINTY)
+
+    for (detector, number, datapoints), exponential_fit, log_linear_fit in \
+            zip(episodes, exponential_fits, log_linear_fits):
+        episode_lines.append(f'{detector}, {number}, {datapoints[0].meas_time}, {datapoints[-1].meas_time}, '
+                             f'{len(datapoints)}, {datapoints[0].value}, {datapoints[-1].value}, '
+                             + episode_columns(exponential_fit, log_linear_fit))
+
+fit_services.save_param_file(episode_lines, 'decay_episodes', configuration.start_time, configuration.end_time)
@@ -15,8 +15,7 @@ configuration = ConfigMock('activity', 'Bq/m3', '07/22/2021 18:00', '07/22/2021
                            'inside', 'stdev')
 
 intervals = services.prepare_intervals(configuration)
-all_raw_data = services.read_files('compared', configuration)
-det_serials = services.search_detector_serial(configuration.compared_detector, 'compared')
+all_raw_data, det_serials = services.read_files('compared', configuration)
 
 if not det_serials:
     det_serials = [configuration.compared_detector for det in all_raw_data]
@@ -33,11 +32,14 @@ unit = configuration.unit
 exponential_param_lines = ['Exponential fit of type a*exp(-bx) + c\n', f'Detector, a ({unit}), a uncertainty ({unit}), '
                                                            f'T - effective time for half (min),  T uncertainty (min), '
                                                            f'c ({unit}), c uncertainty ({unit}), '
-                                                           f'chi-squared, degrees of freedom, p-value \n']
+                                                           f'chi-squared, degrees of freedom, p-value, '
+                                                           f'iterations, converged \n']
+# All detectors are fitted at once
+exponential_fits = fit_services.fit_exponential_decreases(all_raw_data, configuration.start_time, True)
 for i in range(0, len(all_raw_data)):
     params = fit_services.fit_exponential_decrease(all_raw_data[i], configuration.start_time,
                                                    configuration.compared_value,
-                                                   configuration.unit, det_serials[i], True)
+                                                   configuration.unit, det_serials[i], True, exponential_fits[i])
     exponential_param_lines.append(params)
 
 fit_services.save_param_file(exponential_param_lines, 'exponential', configuration.start_time, configuration.end_time)
@@ -7,65 +7,64 @@ from math import sqrt
 from scipy.optimize import curve_fit
 from scipy.stats import chi2
 
-FITSAVE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fit_files')
-
+import nonlinear_fit
 
-def func_exponential(x, a, b, c):
-    return a*np.exp(b*x) + c
+FITSAVE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fit_files')
 
 
 def func_linear(x, a, b):
     return a * x + b
 
 
-def fit_exponential_decrease(datapoints, start_time, value, unit, detector, has_uncertainty):
-
-    # Prepare data
+# Minutes since the start time, values and uncertainties of the datapoints for the fits
+def decrease_fit_data(datapoints, start_time):
     x = [(dp.meas_time - start_time).total_seconds()/60 for dp in datapoints]
-
     y = [dp.value for dp in datapoints]
     y_unc = [dp.value_unc for dp in datapoints]
+    return x, y, y_unc
+
+
+# Exponential decrease fits a*exp(bx) + c of the datapoints of all detectors in one call (nonlinear_fit)
+# With start_time None each series is fitted from the time of its first datapoint
+# Returns the fit of each detector, None if there are less than 3 datapoints
+def fit_exponential_decreases(all_datapoints, start_time, has_uncertainty):
+    xs, ys, y_uncs = zip(*[decrease_fit_data(datapoints, start_time or datapoints[0].meas_time)
+                           for datapoints in all_datapoints])
+    return nonlinear_fit.fit_batch('exponential_offset', xs, ys, y_uncs if has_uncertainty else None)
+
+
+# fit is the result of fit_exponential_decreases for the datapoints if they were already fitted
+def fit_exponential_decrease(datapoints, start_time, value, unit, detector, has_uncertainty, fit=None):
+
+    # Prepare data
+    x, y, y_unc = decrease_fit_data(datapoints, start_time)
 
     title = f'{detector}'
     plt.errorbar(x, y, yerr=y_unc, color='blue', linestyle=None, fmt='.')
 
-    # Chooses function parameters initial guess
-    a_guess = datapoints[0].value
-    b_guess = -0.01
-    c_guess = datapoints[len(datapoints) - 1].value
+    # Fit - the initial parameters are found from a linearised fit
+    if fit is None:
+        fit = nonlinear_fit.fit_batch('exponential_offset', [x], [y], [y_unc] if has_uncertainty else None)[0]
+    if fit is None:
+        raise TypeError(f'Improper input: the exponential fit needs at least 3 points, got {len(x)}')
+    (a, b, c), (a_unc, b_unc, c_unc), chi_squared, dof, p_val, iterations, converged = fit
 
-    # Fit
-    if has_uncertainty:
-        popt, pcov = curve_fit(func_exponential, x, y, p0=(a_guess, b_guess, c_guess), sigma=y_unc)
-    else:
-        popt, pcov = curve_fit(func_exponential, x, y, p0=(a_guess, b_guess, c_guess))
-
-    a, b, c = popt
     t_half = -np.log(2)/b
-    a_unc = sqrt(pcov[0][0])
-    b_unc = sqrt(pcov[1][1])
-    c_unc = sqrt(pcov[2][2])
     t_half_unc = t_half*b_unc/(-b)
     xx = np.arange(np.min(x), np.max(x))
     label = f'fit: a*exp(-ln(2)*x/T_eff)+c\n' \
             f'a = {a:.5e} +/- {a_unc:.5e},\n'\
             f'T_eff = {t_half:.5e} +/- {t_half_unc:.5e}\n'\
             f'c = {c:.5e} +/- {c_unc:.5e}\n'
-    param_line = ''
+    param_line = '-, -, -, '
 
-    # Calculate chi_squared
+    # chi_squared with the uncertainties
     if has_uncertainty:
-        chi_squared = 0.0
-        dof = len(y) - 2
-        for i in range(0, len(y)):
-            residual = y[i] - func_exponential(x[i], a, b, c)
-            chi_squared += (residual / y_unc[i]) ** 2
-        p_val = chi2.sf(chi_squared, dof)
         label += f'chi-squared = {chi_squared:.3e} for {dof} dof, p = {p_val:.7}'
-        param_line = f'{chi_squared}, {dof}, {p_val}\n'
+        param_line = f'{chi_squared}, {dof}, {p_val}, '
 
     # Plot and plot settings
-    plt.plot(xx, func_exponential(xx, a, b, c), 'k--', label=label)
+    plt.plot(xx, nonlinear_fit.model_values('exponential_offset', xx, (a, b, c)), 'k--', label=label)
 
     plt.title(title)
     plt.ylabel(f'{value.capitalize()}, {unit}')
@@ -79,12 +78,45 @@ def fit_exponential_decrease(datapoints, start_time, value, unit, detector, has_
 
     plt.close()
 
-    # Return parameter info for saving
-    fit_param_line = f'{detector}, {a}, {a_unc}, {t_half}, {t_half_unc}, {c}, {c_unc}, {param_line}\n'
+    # Return parameter info for saving, with the convergence of the fit
+    fit_param_line = f'{detector}, {a}, {a_unc}, {t_half}, {t_half_unc}, {c}, {c_unc}, {param_line}' \
+                     f'{iterations}, {converged}\n'
 
     return fit_param_line
 
 
+# Minutes since the start time, ln of the values above the end plateau (the last datapoint) and their uncertainties
+# for the batched fits, the datapoints are not changed
+# Unlike fit_log_linear, ln(value - plateau) is taken, which the uncertainties are computed for
+def log_linear_fit_data(datapoints, start_time):
+    end_plateau = datapoints[-1]
+    raw_values = [dp for dp in datapoints[:-1] if dp.value > end_plateau.value]
+    x = [(dp.meas_time - start_time).total_seconds() / 60 for dp in raw_values]
+    y = [np.log(dp.value - end_plateau.value) for dp in raw_values]
+    y_unc = [sqrt(dp.value_unc**2 + end_plateau.value_unc**2)/(dp.value - end_plateau.value) for dp in raw_values]
+    return x, y, y_unc
+
+
+# Log-linear fits a*x + b of the datapoints of several series in one call (nonlinear_fit), without plots
+# With start_time None each series is fitted from the time of its first datapoint
+# Returns the fit and R-squared of each series, None if there are less than 2 datapoints above the end plateau
+def fit_log_linears(all_datapoints, start_time, has_uncertainty):
+    xs, ys, y_uncs = zip(*[log_linear_fit_data(datapoints, start_time or datapoints[0].meas_time)
+                           for datapoints in all_datapoints])
+    fits = nonlinear_fit.fit_batch('linear', xs, ys, y_uncs if has_uncertainty else None)
+
+    results = []
+    for x, y, fit in zip(xs, ys, fits):
+        if fit is None:
+            results.append(None)
+            continue
+        y = np.asarray(y)
+        ss_res = np.sum((y - nonlinear_fit.model_values('linear', x, fit[0])) ** 2)
+        ss_tot = np.sum((y - np.mean(y)) ** 2)
+        results.append((fit, 1 - ss_res / ss_tot if ss_tot else np.nan))
+    return results
+
+
 def fit_log_linear(datapoints, start_time, value, unit, detector, has_uncertainty):
 
     # Prepare data
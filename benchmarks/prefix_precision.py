@@ -0,0 +1,68 @@
+import os
+import sys
+
+import numpy as np
+
+MAIN_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, MAIN_DIRECTORY)
+
+from manage_data import interval_engine
+from manage_data.prefix_index import PrefixIndex
+
+# Checks the precision of the PrefixIndex estimates on a long series against interval_engine.estimate_values
+# (the direct sums over the points of each interval)
+# The series is a year of one minute readings with a log-normal daily level and a small noise, with some zeros
+# (a small spread in the intervals against the spread of the series is the hard case for cumulative sums)
+# Run from the repository directory: python benchmarks/prefix_precision.py [interval minutes]
+# Exits with 1 if a value or uncertainty differs by more than TOLERANCE relative
+
+MINUTES = 365 * 24 * 60
+DEFAULT_INTERVAL_MIN = 5
+TOLERANCE = 1e-6
+
+
+# Times (seconds since the epoch), values and uncertainties of the synthetic series
+def year_series(seed=1):
+    rng = np.random.default_rng(seed)
+    minutes = np.arange(MINUTES)
+    daily_level = np.exp(rng.normal(np.log(300.0), 1.5, MINUTES // 1440 + 1))[minutes // 1440]
+    level = daily_level * (1 + 0.5 * np.sin(2 * np.pi * minutes / 1440))
+    values = level * (1 + 0.001 * rng.standard_normal(MINUTES))
+    values[::97] = 0.0
+    return 1623196800 + minutes * 60, values, 0.05 * values + 1.0
+
+
+def settings_for(averaging, uncertainty_type, clearing):
+    return {'clearing': clearing, 'background': 0.0, 'background_unc': 0.0, 'uncertainty_type': uncertainty_type,
+            'averaging': averaging, 'min_threshold': 0.0, 'max_threshold': float('inf'), 'interval_len': 1}
+
+
+# Largest relative difference of the estimates of the index and of estimate_values
+def max_difference(times, values, uncertainties, interval_min, settings):
+    starts = np.arange(times[0], times[-1], interval_min * 60)
+    ends = starts + interval_min * 60
+    first, last, _ = interval_engine.bin_intervals(times, starts, ends)
+    expected, expected_unc, expected_keep = interval_engine.estimate_values(
+        times, values, uncertainties, starts, ends, first, last, settings, units_per_minute=60)
+    index = PrefixIndex(times, values, uncertainties, settings, units_per_minute=60)
+    estimated, estimated_unc, keep = index.estimate(starts, ends, first, last, settings)
+    if not np.array_equal(keep, expected_keep):
+        return float('inf')
+
+    def relative(a, b):
+        return np.max(np.abs(a[keep] - b[keep]) / np.maximum(np.abs(b[keep]), 1e-300), initial=0.0)
+    return max(relative(estimated, expected), relative(estimated_unc, expected_unc))
+
+
+if __name__ == '__main__':
+    interval = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_INTERVAL_MIN
+    series = year_series()
+    failed = False
+    for averaging in ('inside', 'weighted'):
+        for uncertainty in ('stdev', 'propagation'):
+            for clearing in ([], ['zeros']):
+                difference = max_difference(*series, interval, settings_for(averaging, uncertainty, clearing))
+                failed |= difference > TOLERANCE
+                print(f'{averaging:>8} {uncertainty:>11} {" ".join(clearing) or "-":>5} '
+                      f'max relative difference {difference:.2e}')
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,209 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+MAIN_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, MAIN_DIRECTORY)
+
+import matplotlib
+import numpy as np
+
+import nonlinear_fit
+import synthetic_data
+from config import Configuration
+from manage_data import services
+
+# Times each stage of the analysis on synthetic detector files (synthetic_data) and reports the wall time,
+# the throughput and the peak memory (tracemalloc, allocations during the stage) as JSON
+# The referent file is an AlphaGuard file, the compared file has the benchmarked layout, both with the given
+# number of lines, the coupled layout times reading saved coupled data
+# Run from the repository directory, e.g.
+# python benchmarks/stage_benchmark.py --lines 10000 100000 --output benchmarks/results.json
+
+# Sizes in lines used without --lines, up to 10 million lines with --lines 10000 100000 1000000 10000000
+DEFAULT_LINES = (10000, 100000)
+LAYOUTS = tuple(synthetic_data.LAYOUTS) + ('coupled',)
+INTERVAL_MIN = 60
+# The AlphaGuard referent values are written in kBq/m3, as the referent multiplier in config.txt
+REFERENT_SCALE = 1000.0
+CONFIG_PATH = os.path.join(MAIN_DIRECTORY, 'config.txt')
+
+
+# Replaces the values of config lines (up to the comment) in the config text
+def replace_options(config_text, options):
+    for name, value in options.items():
+        config_text = re.sub(rf'^{name}\s[^#\n]*', lambda _: f'{name} {value} ', config_text, flags=re.MULTILINE)
+    return config_text
+
+
+# Config file options for the referent AlphaGuard file and the compared file in the layout
+def layout_options(layout, start_time, end_time):
+    settings = synthetic_data.LAYOUTS[layout]
+    referent = synthetic_data.LAYOUTS['alphaguard']
+    return {'input_data': 'separate', 'save_data': 'n', 'custom_intervals': 'n', 'read_workers': '1',
+            'file_cache': 'n', 'incremental': 'n', 'data_engine': 'objects', 'interval_min': INTERVAL_MIN,
+            'start_datetime': start_time.strftime('%m/%d/%Y %H:%M'),
+            'end_datetime': end_time.strftime('%m/%d/%Y %H:%M'),
+            'referent_detector': referent['detector'],
+            'referent_file_datetime_format': referent['datetime_format'],
+            'referent_datetime_index': referent['datetime_index'],
+            'referent_value_index': referent['value_index'],
+            'referent_file_separator': referent['separator'],
+            'referent_file_encoding': referent['encoding'],
+            'compared_detector': settings['detector'],
+            'compared_file_datetime_format': settings['datetime_format'],
+            'compared_datetime_index': settings['datetime_index'],
+            'compared_value_index': settings['value_index'],
+            'compared_file_separator': settings['separator'],
+            'compared_file_encoding': settings['encoding'],
+            'compared_interval_match': settings['match'],
+            'compared_meas_duration': settings['step']}
+
+
+# Runs the stage and returns its result and the measurement, the stage is run again with tracemalloc
+# for the peak memory if measure_memory (tracemalloc slows the stage down, so it is not timed)
+def run_stage(results, layout, lines, stage, items, function, measure_memory):
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    result = function()
+    seconds = time.perf_counter() - start
+    cpu_seconds = time.process_time() - cpu_start
+
+    peak_mb = None
+    if measure_memory:
+        tracemalloc.start()
+        function()
+        peak_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+
+    results.append({'layout': layout, 'lines': lines, 'stage': stage, 'seconds': seconds,
+                    'cpu_seconds': cpu_seconds, 'items': items,
+                    'items_per_second': items / seconds if seconds else None, 'peak_memory_mb': peak_mb})
+    print(f'{layout:>10} {lines:>9} {stage:<24} {seconds:9.3f} s {items:>10} items', file=sys.stderr)
+    return result
+
+
+# Saves the detector couple file and removes it, so the stage can be run again
+def save_and_remove(couples, detector_couple):
+    os.remove(services.save_datacouples_file(couples, detector_couple, 'activity', 'Bq/m3'))
+
+
+# Benchmarks the stages of a separate files run with the compared file in the layout
+def benchmark_layout(results, directory, layout, lines, measure_memory):
+    import fit_engine
+    import plot_services
+
+    for name in ('referent', 'compared', 'saved', 'plots'):
+        os.makedirs(os.path.join(directory, name), exist_ok=True)
+    services.REFERENT_DIRECTORY = os.path.join(directory, 'referent')
+    services.COMPARE_DIRECTORY = os.path.join(directory, 'compared')
+    services.DATASAVE_DIRECTORY = os.path.join(directory, 'saved')
+    plot_services.PLOTSAVE_DIRECTORY = os.path.join(directory, 'plots')
+
+    synthetic_data.write_detector_file(services.REFERENT_DIRECTORY, 'alphaguard', lines, REFERENT_SCALE, seed=1)
+    synthetic_data.write_detector_file(services.COMPARE_DIRECTORY, layout, lines, seed=2)
+
+    start_time = synthetic_data.START_TIME
+    minutes = min(synthetic_data.file_minutes('alphaguard', lines), synthetic_data.file_minutes(layout, lines))
+    end_time = start_time + datetime.timedelta(minutes=minutes)
+    config_path = os.path.join(directory, 'config.txt')
+    with open(CONFIG_PATH, 'r') as config_file:
+        config_text = replace_options(config_file.read(), layout_options(layout, start_time, end_time))
+    with open(config_path, 'w') as config_file:
+        config_file.write(config_text)
+    configuration = Configuration(config_path)
+
+    def stage(name, items, function):
+        return run_stage(results, layout, lines, name, items, function, measure_memory)
+
+    intervals = stage('prepare_intervals', int(minutes / INTERVAL_MIN),
+                      lambda: services.prepare_intervals(configuration))
+    referent_data, referent_serials = stage('read_files_referent', lines,
+                                            lambda: services.read_files('referent', configuration))
+    compared_data, compared_serials = stage('read_files_compared', lines,
+                                            lambda: services.read_files('compared', configuration))
+    services.set_detector_serials(configuration, referent_serials, compared_serials)
+    detector_couple = configuration.compared_det_serials[0]
+
+    referent_av = stage('ref_average_referent', len(referent_data[0]),
+                        lambda: services.ref_average_intervals(intervals, referent_data[0], configuration,
+                                                               'referent')[0])
+    compared_av = stage('ref_average_compared', len(compared_data[0]),
+                        lambda: services.ref_average_intervals(intervals, compared_data[0], configuration,
+                                                               'compared')[0])
+    couples = stage('join_detector_couple', len(referent_av) + len(compared_av),
+                    lambda: services.join_detector_couple(referent_av, compared_av))
+    stage('save_datacouples_file', len(couples), lambda: save_and_remove(couples, detector_couple))
+
+    linear_fit = stage('fit_linear', len(couples), lambda: fit_engine.linear_couple_fits([couples])[0])
+    york_fit = stage('fit_york', len(couples), lambda: fit_engine.york_couple_fits([couples])[0])
+    ratio_fit = stage('fit_ratio', len(couples),
+                      lambda: fit_engine.ratio_couple_fits([couples], 'referent', configuration.fit)[0])
+
+    stage('plot_original', len(referent_data[0]) + len(compared_data[0]),
+          lambda: plot_services.double_time_plot(referent_data[0], compared_data[0], detector_couple, 'activity',
+                                                 'Bq/m3', 'Raw', 'raw', True))
+    stage('plot_value_value', len(couples),
+          lambda: plot_services.compare_plot_fit(couples, 'activity', 'Bq/m3', detector_couple, 'activity', True,
+                                                 linear_fit, york_fit))
+    stage('plot_ratio', len(couples),
+          lambda: plot_services.ratio_value_plot(couples, 'activity', 'Bq/m3', 'referent', detector_couple,
+                                                 'ratio_referent', True, configuration.fit, ratio_fit))
+
+
+# Benchmarks reading saved coupled data (input_data coupled)
+def benchmark_coupled(results, directory, lines, measure_memory):
+    services.SAVED_COUPLES_DIRECTORY = os.path.join(directory, 'coupled')
+    os.makedirs(services.SAVED_COUPLES_DIRECTORY, exist_ok=True)
+    synthetic_data.write_coupled_file(services.SAVED_COUPLES_DIRECTORY, lines, seed=3)
+    run_stage(results, 'coupled', lines, 'read_detector_couple_data', lines, services.read_detector_couple_data,
+              measure_memory)
+
+
+def commit_hash():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=MAIN_DIRECTORY, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Times the analysis stages on synthetic detector files')
+    parser.add_argument('--lines', type=int, nargs='+', default=DEFAULT_LINES, help='file sizes in lines')
+    parser.add_argument('--layouts', nargs='+', choices=LAYOUTS, default=LAYOUTS, help='compared file layouts')
+    parser.add_argument('--no-memory', action='store_true', help='do not measure the peak memory')
+    parser.add_argument('--output', help='JSON file for the results, else the results are printed')
+    arguments = parser.parse_args()
+
+    # Saved plots are drawn without a window, scipy is imported for the fits before the stages are timed
+    # (the import time is measured by startup_benchmark)
+    matplotlib.use('Agg')
+    nonlinear_fit.p_values(0.0, 1)
+
+    results = []
+    for line_count in arguments.lines:
+        for layout_name in arguments.layouts:
+            with tempfile.TemporaryDirectory() as temporary_directory:
+                if layout_name == 'coupled':
+                    benchmark_coupled(results, temporary_directory, line_count, not arguments.no_memory)
+                else:
+                    benchmark_layout(results, temporary_directory, layout_name, line_count,
+                                     not arguments.no_memory)
+
+    report = {'date': datetime.datetime.now().isoformat(timespec='seconds'), 'commit': commit_hash(),
+              'python': platform.python_version(), 'numpy': np.__version__, 'matplotlib': matplotlib.__version__,
+              'platform': platform.platform(), 'interval_min': INTERVAL_MIN, 'results': results}
+    if arguments.output:
+        with open(arguments.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,57 @@
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Measures the startup time of the analysis - the import of run.py in a fresh interpreter, as in each batch job
+# and checks that matplotlib and scipy are not imported when no plot or fit is requested
+# Run from the repository directory: python benchmarks/startup_benchmark.py [repetitions]
+# Exits with 1 if a heavy module is imported at startup
+
+MAIN_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPETITIONS = 20
+# Modules which are imported only for plots and fits
+HEAVY_MODULES = ('matplotlib', 'scipy')
+
+# Imports run.py and the functions a plot-free run calls, then prints the heavy modules which were imported
+STARTUP_CODE = 'import sys\n' \
+               'import run\n' \
+               'from plot_manager import manage_plots\n' \
+               f'print(" ".join(m for m in {HEAVY_MODULES} if m in sys.modules))\n'
+# The heavy modules, for comparison
+HEAVY_CODE = 'import matplotlib.figure, matplotlib.backends.backend_agg, scipy.stats\n'
+
+
+# Wall times in seconds of running the code in a fresh interpreter, and the output of the last run
+def run_times(code, repetitions):
+    times = []
+    output = ''
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, '-c', code], cwd=MAIN_DIRECTORY, capture_output=True, text=True,
+                                check=True)
+        times.append(time.perf_counter() - start)
+        output = result.stdout.strip()
+    return times, output
+
+
+def report_line(name, times):
+    return f'{name}: min {min(times) * 1000:.1f} ms, median {statistics.median(times) * 1000:.1f} ms, ' \
+           f'max {max(times) * 1000:.1f} ms over {len(times)} runs'
+
+
+if __name__ == '__main__':
+    repetitions = int(sys.argv[1]) if len(sys.argv) > 1 else REPETITIONS
+
+    empty_times, _ = run_times('pass', repetitions)
+    startup_times, heavy_imported = run_times(STARTUP_CODE, repetitions)
+    heavy_times, _ = run_times(HEAVY_CODE, repetitions)
+
+    print(report_line('Interpreter', empty_times))
+    print(report_line('Analysis startup', startup_times))
+    print(report_line('matplotlib and scipy', heavy_times))
+
+    if heavy_imported:
+        print(f'Imported at startup: {heavy_imported}')
+        sys.exit(1)
@@ -0,0 +1,123 @@
+import datetime
+import math
+import os
+import random
+
+# Generators of synthetic detector files in the layouts read by the analysis, for the benchmarks
+# The radon concentration has a daily cycle, slow weather changes and counting noise, with some zero readings
+# and lines which are not data, as in real files
+# Each layout gives the config file lines needed to read it (see stage_benchmark.layout_options)
+
+START_TIME = datetime.datetime(2021, 6, 9, 7, 52)
+# Mean concentration (Bq/m3), relative amplitude of the daily cycle and of the slow changes
+MEAN_CONCENTRATION = 400.0
+DAILY_AMPLITUDE = 0.5
+WEATHER_AMPLITUDE = 0.3
+# Every ZERO_EVERY-th reading is zero and every JUNK_EVERY-th line is not data
+ZERO_EVERY = 97
+JUNK_EVERY = 1000
+
+# Layout name: detector, config separator, encoding, datetime format, datetime and value indexes,
+# interval match, minutes between readings and the header lines (with the detector serial)
+LAYOUTS = {
+    'alphaguard': {'detector': 'alphaguard', 'separator': 'tab', 'encoding': 'cp1252',
+                   'datetime_format': '%m/%d/%Y %I:%M:%S %p', 'datetime_index': '0', 'value_index': '1 2',
+                   'match': 'weighted', 'step': 10,
+                   'header': ['AlphaGUARD serial AG1234', 'Time\tRadon\tRadon uncertainty']},
+    'radoneye': {'detector': 'radoneye', 'separator': ',', 'encoding': 'cp1252',
+                 'datetime_format': '%Y-%m-%d %H:%M:%S', 'datetime_index': '1', 'value_index': '2',
+                 'match': 'inside', 'step': 10,
+                 'header': ['Serial PE00000000001', 'mode,auto', 'No,Time,Radon']},
+    'alphae': {'detector': 'alphae', 'separator': ';', 'encoding': 'UTF16',
+               'datetime_format': '%Y-%m-%d %H:%M:%S', 'datetime_index': '0', 'value_index': '6 7',
+               'match': 'weighted', 'step': 10,
+               'header': ['AlphaE AE1234', 'Time;Temperature;Humidity;Pressure;Tilt;Counts;Radon;Uncertainty']},
+    'rad7': {'detector': 'rad7', 'separator': ',', 'encoding': 'cp1252',
+             'datetime_format': '%m/%d/%y %H:%M', 'datetime_index': '1 2', 'value_index': '3 4',
+             'match': 'inside', 'step': 30,
+             'header': ['RAD7 data', 'Record,Date,Time,Radon,Uncertainty']},
+}
+
+# Saved coupled data, as read with input_data coupled (services.read_detector_couple_data)
+COUPLED_STEP = 60
+COUPLED_HEADER = 'Interval middle, Referent activity (Bq/m3), Referent activity uncertainty (Bq/m3), ' \
+                 'Compared activity (Bq/m3), Compared activity uncertainty (Bq/m3), ' \
+                 'Referent/Compared ratio, Ratio uncertainty'
+
+
+# Concentration in Bq/m3 and its uncertainty at the reading time
+def concentration(meas_time, rng):
+    hours = (meas_time - START_TIME).total_seconds() / 3600
+    level = MEAN_CONCENTRATION * (1 + DAILY_AMPLITUDE * math.sin(2 * math.pi * hours / 24)
+                                  + WEATHER_AMPLITUDE * math.sin(2 * math.pi * hours / (24 * 9.3)))
+    uncertainty = 0.05 * level + 10
+    return max(rng.gauss(level, uncertainty), 0.0), uncertainty
+
+
+# Data line of the layout, values are divided by scale (e.g. 1000 for kBq/m3)
+def data_line(layout, number, meas_time, value, uncertainty, scale):
+    value /= scale
+    uncertainty /= scale
+    if layout == 'alphaguard':
+        return f'{meas_time.strftime("%m/%d/%Y %I:%M:%S %p")}\t{value:.4f}\t{uncertainty:.4f}'
+    if layout == 'radoneye':
+        return f'{number},{meas_time.strftime("%Y-%m-%d %H:%M:%S")},{value:.0f}'
+    if layout == 'alphae':
+        return f'{meas_time.strftime("%Y-%m-%d %H:%M:%S")};22.5;45;1013;0;{int(value * 3)};{value:.0f};' \
+               f'{uncertainty:.0f}'
+    return f'{number},{meas_time.strftime("%m/%d/%y")},{meas_time.strftime("%H:%M")},{value:.1f},{uncertainty:.1f}'
+
+
+# Writes a detector file with line_count lines (header and non-data lines included) in the directory
+# Returns the file path
+def write_detector_file(directory, layout, line_count, scale=1.0, seed=0, start_time=START_TIME):
+    settings = LAYOUTS[layout]
+    rng = random.Random(seed)
+    step = datetime.timedelta(minutes=settings['step'])
+    path = os.path.join(directory, f'{layout}_{line_count}_{seed}.txt')
+
+    with open(path, 'w', encoding=settings['encoding']) as current_file:
+        current_file.write('\n'.join(settings['header']) + '\n')
+        meas_time = start_time
+        # Lines are written in blocks, so the memory used does not grow with the file
+        lines = []
+        for number in range(1, line_count - len(settings['header']) + 1):
+            if number % JUNK_EVERY == 0:
+                lines.append('Device status: ok')
+            else:
+                value, uncertainty = concentration(meas_time, rng)
+                if number % ZERO_EVERY == 0:
+                    value = 0.0
+                lines.append(data_line(layout, number, meas_time, value, uncertainty, scale))
+                meas_time += step
+            if len(lines) == 10000:
+                current_file.write('\n'.join(lines) + '\n')
+                lines = []
+        if lines:
+            current_file.write('\n'.join(lines) + '\n')
+    return path
+
+
+# Minutes covered by a detector file of the layout with line_count lines
+def file_minutes(layout, line_count):
+    return line_count * LAYOUTS[layout]['step']
+
+
+# Writes a coupled data file with line_count couples, named as the saved files (referent_compared_...)
+# Returns the file path
+def write_coupled_file(directory, line_count, seed=0, start_time=START_TIME):
+    rng = random.Random(seed)
+    path = os.path.join(directory, f'AG1234_PE00000000001auto_{line_count}_{seed}.csv')
+
+    with open(path, 'w') as current_file:
+        current_file.write(COUPLED_HEADER + '\n')
+        for i in range(line_count):
+            meas_time = start_time + datetime.timedelta(minutes=COUPLED_STEP * i)
+            ref_value, ref_unc = concentration(meas_time, rng)
+            cmp_value, cmp_unc = concentration(meas_time, rng)
+            ratio = ref_value / cmp_value if cmp_value else 0.0
+            ratio_unc = ratio * math.sqrt((ref_unc / ref_value) ** 2 + (cmp_unc / cmp_value) ** 2) \
+                if ref_value and cmp_value else 0.0
+            current_file.write(f'{meas_time.strftime("%m/%d/%Y %H:%M")}, {ref_value}, {ref_unc}, {cmp_value}, '
+                               f'{cmp_unc}, {ratio}, {ratio_unc}\n')
+    return path
@@ -0,0 +1,83 @@
+import os
+import re
+import sys
+import tempfile
+
+MAIN_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, MAIN_DIRECTORY)
+
+import matplotlib
+
+import plot_services
+import stage_benchmark
+import synthetic_data
+import watch
+from config import Configuration
+from manage_data import services
+
+# Checks an update of the watch mode (watch.update) with start_datetime and end_datetime left out of the config
+# file - the start and end time are set from the referent file, and the detector couples are the same as with
+# these start and end time set in the config file
+# Run from the repository directory: python benchmarks/watch_check.py
+# Exits with 1 if an update fails or its couples differ
+
+LINES = 2000
+ENGINES = ('objects', 'arrays')
+
+
+# Writes the config file with the options, without start_datetime and end_datetime if start_time is None
+def write_config(directory, engine, start_time, end_time):
+    options = stage_benchmark.layout_options('radoneye', synthetic_data.START_TIME, synthetic_data.START_TIME)
+    options.update({'data_engine': engine, 'save_plots': 'y', 'fit_tables': 'n'})
+    with open(stage_benchmark.CONFIG_PATH, 'r') as config_file:
+        config_text = stage_benchmark.replace_options(config_file.read(), options)
+    if start_time is None:
+        config_text = re.sub(r'^(start|end)_datetime .*\n', '', config_text, flags=re.MULTILINE)
+    else:
+        config_text = stage_benchmark.replace_options(config_text, {
+            'start_datetime': start_time.strftime('%m/%d/%Y %H:%M'),
+            'end_datetime': end_time.strftime('%m/%d/%Y %H:%M')})
+    config_path = os.path.join(directory, f'config_{engine}.txt')
+    with open(config_path, 'w') as config_file:
+        config_file.write(config_text)
+    return Configuration(config_path)
+
+
+# Times and values of the detector couples of one watch update
+def update_couples(configuration):
+    state = watch.new_state()
+    configured = (configuration.start_time, configuration.end_time, configuration.referent_detector)
+    watch.update(state, configuration, configured, watch.file_signatures())
+    return [[(couple.meas_time, couple.ref_value, couple.cmp_value) for couple in couples]
+            for couples in state['couples'].values()]
+
+
+if __name__ == '__main__':
+    matplotlib.use('Agg')
+    failed = False
+    with tempfile.TemporaryDirectory() as directory:
+        for name in ('referent', 'compared', 'fits', 'plots'):
+            os.makedirs(os.path.join(directory, name))
+        services.REFERENT_DIRECTORY = os.path.join(directory, 'referent')
+        services.COMPARE_DIRECTORY = os.path.join(directory, 'compared')
+        services.PARAMSAVE_DIRECTORY = os.path.join(directory, 'fits')
+        plot_services.PLOTSAVE_DIRECTORY = os.path.join(directory, 'plots')
+        synthetic_data.write_detector_file(services.REFERENT_DIRECTORY, 'alphaguard', LINES,
+                                           stage_benchmark.REFERENT_SCALE, seed=1)
+        synthetic_data.write_detector_file(services.COMPARE_DIRECTORY, 'radoneye', LINES, seed=2)
+
+        for engine in ENGINES:
+            try:
+                configuration = write_config(directory, engine, None, None)
+                couples = update_couples(configuration)
+                # the update sets the start and end time of the referent file in the configuration
+                expected = update_couples(write_config(directory, engine, configuration.start_time,
+                                                       configuration.end_time))
+                failed |= configuration.start_time != synthetic_data.START_TIME or couples != expected \
+                    or not couples[0]
+                print(f'{engine:>8} {len(couples[0])} couples, {len(expected[0])} with the referent start and end '
+                      f'in the config file')
+            except Exception as error:
+                failed = True
+                print(f'{engine:>8} update failed - {error!r}')
+    sys.exit(1 if failed else 0)
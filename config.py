@@ -13,11 +13,25 @@ RE_THRESHOLDS = r'value_thresholds\s+([0-9]+\s[0-9]+\s[0-9]+\s[0-9]+)'
 RE_SHIFTS = r'time_shift_hours\s+(-?[0-9]+)\s+(-?[0-9]+)#'
 RE_UNCERTAINTY = r'unc_type\s+([a-zA-Z]+)'
 RE_CUSTOM = r'custom_intervals\s+([a-zA-Z])'
+RE_SORTED = r'sorted_files\s+([a-zA-Z])'
+RE_WORKERS = r'read_workers\s+([0-9]+)'
+RE_PLOT_WORKERS = r'plot_workers\s+([0-9]+)'
+RE_FIT_TABLES = r'fit_tables\s+([a-zA-Z])'
+RE_INSTRUMENTATION = r'instrumentation\s+([a-zA-Z])'
+RE_BATCHED = r'batched_averaging\s+([a-zA-Z])'
+RE_PREFIX_INDEX = r'prefix_index\s+([a-zA-Z])'
+RE_ENGINE = r'data_engine\s+(objects|arrays)'
+RE_CACHE = r'file_cache\s+([a-zA-Z])'
+RE_CACHE_SIZE = r'cache_size_mb\s+([0-9]+)'
+RE_INCREMENTAL = r'incremental\s+([a-zA-Z])'
 RE_TIME = r'datetime\s+([0-9]+/[0-9]+/[0-9]{4}\s[0-9]{2}:[0-9]{2})'
-RE_INTERVAL = r'interval_min\s+([0-9]+)'
+RE_INTERVAL = r'interval_min\s+([0-9]+(?:[ \t]+[0-9]+)*)'
 RE_MATCH_TYPE = r'interval_match\s+([a-zA-Z]+)'
 RE_DURATION = r'meas_duration\s+([0-9]+)'
 RE_CLEAR = r'clear_data\s+(.+)\#'
+RE_SWEEP_CLEAR = r'filter_sweep_clear\s+(.+)\#'
+RE_SWEEP_THRESHOLDS = r'filter_sweep_thresholds\s+([0-9]+\s+[0-9]+\s+[0-9]+\s+[0-9]+(?:\s*\|\s*[0-9]+\s+[0-9]+\s+[0-9]+\s+[0-9]+)*)'
+RE_SWEEP_UNC = r'filter_sweep_unc\s+([a-zA-Z \t]+)\#'
 RE_DETECTOR = r'detector\s+([\S]+)'
 RE_SEPARATOR = r'file_separator\s+([\S]+)'
 RE_ENCODING = r'file_encoding\s+([a-zA-Z0-9]+)'
@@ -37,6 +51,9 @@ class Configuration:
         self._plots = self._set_plots()
         self._fit = self._set_fit()
         self._save_plots = self._set_save_options('plots')
+        self._plot_workers = self._set_workers(RE_PLOT_WORKERS)
+        self._fit_tables = self._set_yes_no(RE_FIT_TABLES)
+        self._instrumentation = self._set_yes_no(RE_INSTRUMENTATION)
 
         self._compared_value = self._set_compared_value()
         self._unit = self._set_unit()
@@ -50,10 +67,21 @@ class Configuration:
             self._time_shift = self._set_shift()
 
             self._is_custom_interval = self._set_custom_int()
+            self._sorted_files = self._set_yes_no(RE_SORTED)
+            self._read_workers = self._set_workers(RE_WORKERS)
+            self._file_cache = self._set_yes_no(RE_CACHE)
+            self._cache_size_mb = self._set_cache_size()
+            self._incremental = self._set_yes_no(RE_INCREMENTAL)
             self.start_time = self._set_time('start')
             self.end_time = self._set_time('end')
-            self._interval = self._set_interval()
+            self._intervals = self._set_interval()
             self._clear_data = self._set_clear_data()
+            self._filter_sweep_clear = self._set_sweep_clear()
+            self._filter_sweep_thresholds = self._set_sweep_thresholds()
+            self._filter_sweep_unc = self._set_sweep_unc()
+            self._batched_averaging = self._set_yes_no(RE_BATCHED)
+            self._prefix_index = self._set_yes_no(RE_PREFIX_INDEX)
+            self._data_engine = self._set_data_engine()
 
             self.referent_detector = self._set_detector('referent')
             self.compared_detector = self._set_detector('compared')
@@ -98,6 +126,18 @@ class Configuration:
     def save_plots(self):
         return self._save_plots
 
+    @property
+    def plot_workers(self):
+        return self._plot_workers
+
+    @property
+    def fit_tables(self):
+        return self._fit_tables
+
+    @property
+    def instrumentation(self):
+        return self._instrumentation
+
     @property
     def compared_value(self):
         return self._compared_value
@@ -122,14 +162,72 @@ class Configuration:
     def is_custom_interval(self):
         return self._is_custom_interval
 
+    @property
+    def sorted_files(self):
+        return self._sorted_files
+
+    @property
+    def read_workers(self):
+        return self._read_workers
+
+    @property
+    def file_cache(self):
+        return self._file_cache
+
+    @property
+    def cache_size_mb(self):
+        return self._cache_size_mb
+
+    @property
+    def incremental(self):
+        return self._incremental
+
     @property
     def interval(self):
-        return self._interval
+        return self._intervals[0]
+
+    # All interval lengths, with more than one length the interval sweep is done
+    @property
+    def intervals(self):
+        return self._intervals
+
+    @property
+    def interval_sweep(self):
+        return len(self._intervals) > 1
 
     @property
     def clear_data(self):
         return self._clear_data
 
+    # Alternatives of clear_data, value_thresholds and unc_type evaluated in the sweep, empty if not set
+    @property
+    def filter_sweep_clear(self):
+        return self._filter_sweep_clear
+
+    @property
+    def filter_sweep_thresholds(self):
+        return self._filter_sweep_thresholds
+
+    @property
+    def filter_sweep_unc(self):
+        return self._filter_sweep_unc
+
+    @property
+    def filter_sweep(self):
+        return bool(self._filter_sweep_clear or self._filter_sweep_thresholds or self._filter_sweep_unc)
+
+    @property
+    def batched_averaging(self):
+        return self._batched_averaging
+
+    @property
+    def prefix_index(self):
+        return self._prefix_index
+
+    @property
+    def data_engine(self):
+        return self._data_engine
+
     @property
     def referent_file_separator(self):
         return self._referent_file_separator
@@ -280,6 +378,31 @@ class Configuration:
             return True
         return False
 
+    # Options given as y or n, default is n
+    def _set_yes_no(self, option_re):
+        option_match = re.search(option_re, self.config_lines)
+        if option_match and option_match.group(1) == 'y':
+            return True
+        return False
+
+    def _set_workers(self, workers_re):
+        workers_match = re.search(workers_re, self.config_lines)
+        if workers_match and int(workers_match.group(1)) > 0:
+            return int(workers_match.group(1))
+        return 1
+
+    def _set_cache_size(self):
+        size_match = re.search(RE_CACHE_SIZE, self.config_lines)
+        if size_match:
+            return int(size_match.group(1))
+        return 1000
+
+    def _set_data_engine(self):
+        engine_match = re.search(RE_ENGINE, self.config_lines)
+        if engine_match:
+            return engine_match.group(1)
+        return 'objects'
+
     def _set_time(self, label):
         datetime_string = label + '_' + RE_TIME
         time_match = re.search(datetime_string, self.config_lines)
@@ -291,7 +414,7 @@ class Configuration:
         interval_match = re.search(RE_INTERVAL, self.config_lines)
         if not interval_match:
             raise ValueError("Interval line is missing or interval is not a number")
-        return float(interval_match.group(1))
+        return [float(interval) for interval in interval_match.group(1).split()]
 
     def _set_interval_type(self, detector_role):
         interval_type_re = detector_role + '_' + RE_MATCH_TYPE
@@ -310,6 +433,31 @@ class Configuration:
             return clear_data_match.group(1).split()
         return []
 
+    # Alternatives are separated by |, none is the alternative without clearing
+    def _set_sweep_clear(self):
+        sweep_match = re.search(RE_SWEEP_CLEAR, self.config_lines)
+        if not sweep_match:
+            return []
+        return [[option for option in clearing.split() if option != 'none']
+                for clearing in sweep_match.group(1).split('|')]
+
+    def _set_sweep_thresholds(self):
+        sweep_match = re.search(RE_SWEEP_THRESHOLDS, self.config_lines)
+        if not sweep_match:
+            return []
+        return [[int(thr) for thr in thresholds.split()] for thresholds in sweep_match.group(1).split('|')]
+
+    def _set_sweep_unc(self):
+        sweep_match = re.search(RE_SWEEP_UNC, self.config_lines)
+        if not sweep_match:
+            return []
+        unc_types = sweep_match.group(1).split()
+        for unc_type in unc_types:
+            if unc_type not in ['stdevav', 'propagation', 'max', 'stdev']:
+                raise ValueError("Wrong uncertainty type in filter_sweep_unc - should be stdevav, propagation, "
+                                 "max or stdev")
+        return unc_types
+
     def _set_detector(self, detector_role):
         det_string = detector_role + '_' + RE_DETECTOR
         det_match = re.search(det_string, self.config_lines)
@@ -0,0 +1,289 @@
+import numpy as np
+
+import nonlinear_fit
+from manage_data.data_classes import to_couple_series
+
+# Fits of the detector couple data without plotting
+# Used by plot_services for the plotted fits and by the interval sweep, which fits without plots
+
+# York fit stops when the relative change of the slope is below the tolerance or after the maximum iterations
+YORK_TOLERANCE = 1e-12
+YORK_MAX_ITERATIONS = 100
+# Slope angles searched and golden section steps for the data sets where the York iteration does not converge
+YORK_ANGLES = 360
+YORK_SECTION_STEPS = 80
+
+
+def func_linear(x, a, b):
+    return a * x + b
+
+
+def func_parabolic(x, a, c):
+    return a * (x ** 2) + c
+
+
+def func_exponential(x, a, b):
+    return a*np.exp(b*x)
+
+
+# Referent and compared values of a detector couple for the linear fit - couples with both uncertainties
+# Returns x (compared values), y (referent values) and their uncertainties
+def linear_fit_data(det_couple):
+    couples = to_couple_series(det_couple)
+    filtered = (couples.ref_uncertainties != 0) & (couples.cmp_uncertainties != 0)
+    return couples.cmp_values[filtered], couples.ref_values[filtered], \
+        couples.cmp_uncertainties[filtered], couples.ref_uncertainties[filtered]
+
+
+# Ratios of a detector couple for the ratio fit as a function of the referent or compared value
+# Couples without ratio or ratio uncertainty are left out
+def ratio_fit_data(det_couple, detector_type):
+    couples = to_couple_series(det_couple)
+    filtered = np.nan_to_num(couples.ratios) != 0
+    filtered &= np.nan_to_num(couples.ratio_uncertainties) != 0
+    x = couples.ref_values[filtered] if detector_type == 'referent' else couples.cmp_values[filtered]
+    return x, couples.ratios[filtered], couples.ratio_uncertainties[filtered]
+
+
+# Linear fit a*x + b weighted by the y uncertainties
+# Returns a, a uncertainty, b, b uncertainty, chi-squared, degrees of freedom, p-value and r-squared
+def fit_linear(x, y, x_unc, y_unc):
+    fit = fit_linear_batch([x], [y], [x_unc], [y_unc])[0]
+    if fit is None:
+        raise TypeError(f'Improper input: the linear fit needs at least 2 points, got {len(x)}')
+    return fit
+
+
+# Weighted least squares fit a*x + b of several data sets at once (e.g. all detector couples) in closed form
+# The arguments are lists with the x, y and uncertainty arrays of each data set
+# Returns the result of fit_linear for each data set, None for data sets with less than 2 points
+# As with curve_fit a data set with a zero uncertainty is not weighted and its covariance is scaled
+# by the residual variance, otherwise the uncertainties are absolute
+def fit_linear_batch(xs, ys, x_uncs, y_uncs):
+    counts = np.array([len(x) for x in xs], dtype=np.int64)
+    fitted = np.flatnonzero(counts >= 2)
+    fits = [None] * len(xs)
+    if len(fitted) == 0:
+        return fits
+
+    count = counts[fitted]
+    segment = np.repeat(np.arange(len(fitted)), count)
+    x = np.concatenate([np.asarray(xs[i], dtype=np.float64) for i in fitted])
+    y = np.concatenate([np.asarray(ys[i], dtype=np.float64) for i in fitted])
+    x_unc = np.concatenate([np.asarray(x_uncs[i], dtype=np.float64) for i in fitted])
+    y_unc = np.concatenate([np.asarray(y_uncs[i], dtype=np.float64) for i in fitted])
+
+    def sums(items):
+        return np.bincount(segment, weights=items, minlength=len(fitted))
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        weighted = sums((x_unc == 0) | (y_unc == 0)) == 0
+        weights = np.where(weighted[segment], 1 / y_unc ** 2, 1.0)
+
+        # Sums centred on the weighted means
+        weight_sum = sums(weights)
+        x_mean = sums(weights * x) / weight_sum
+        y_mean = sums(weights * y) / weight_sum
+        x_diff = x - x_mean[segment]
+        xx_sum = sums(weights * x_diff ** 2)
+        a = sums(weights * x_diff * (y - y_mean[segment])) / xx_sum
+        b = y_mean - a * x_mean
+
+        residuals = y - a[segment] * x - b[segment]
+        ss_res = sums(residuals ** 2)
+        dof = count - 2
+        scale = np.where(weighted, 1.0, ss_res / dof)
+        a_unc = np.sqrt(scale / xx_sum)
+        b_unc = np.sqrt(scale * (1 / weight_sum + x_mean ** 2 / xx_sum))
+
+        # Calculate R-squared and chi-squared
+        chi_squared = sums((residuals / y_unc) ** 2)
+        p_val = nonlinear_fit.p_values(chi_squared, dof)
+        ss_tot = sums((y - (sums(y) / count)[segment]) ** 2)
+        r_squared = 1 - ss_res / ss_tot
+
+    for i, fit_index in enumerate(fitted):
+        fits[fit_index] = (float(a[i]), float(a_unc[i]), float(b[i]), float(b_unc[i]), float(chi_squared[i]),
+                           int(dof[i]), float(p_val[i]), float(r_squared[i]))
+    return fits
+
+
+# York regression a*x + b with the uncertainties of both x and y (errors not correlated) of several data sets at once
+# (York et al., Am. J. Phys. 72 (2004) 367), the slope is iterated from the linear fit for all data sets together
+# Returns a, a uncertainty, b, b uncertainty, chi-squared, degrees of freedom, p-value and the iterations
+# for each data set, None for data sets with less than 2 points or a zero uncertainty
+# The iteration may not converge for poorly correlated data, the slope of these data sets is found by minimising
+# the York chi-squared directly and they have YORK_MAX_ITERATIONS iterations
+def fit_york_batch(xs, ys, x_uncs, y_uncs):
+    fits = [None] * len(xs)
+    fitted = np.array([i for i in range(len(xs)) if len(xs[i]) >= 2 and np.all(np.asarray(x_uncs[i]) > 0)
+                       and np.all(np.asarray(y_uncs[i]) > 0)], dtype=np.int64)
+    initial_fits = fit_linear_batch([xs[i] for i in fitted], [ys[i] for i in fitted],
+                                    [x_uncs[i] for i in fitted], [y_uncs[i] for i in fitted])
+    if len(fitted) == 0:
+        return fits
+
+    count = np.array([len(xs[i]) for i in fitted], dtype=np.int64)
+    segment = np.repeat(np.arange(len(fitted)), count)
+    x = np.concatenate([np.asarray(xs[i], dtype=np.float64) for i in fitted])
+    y = np.concatenate([np.asarray(ys[i], dtype=np.float64) for i in fitted])
+    x_weights = 1 / np.concatenate([np.asarray(x_uncs[i], dtype=np.float64) for i in fitted]) ** 2
+    y_weights = 1 / np.concatenate([np.asarray(y_uncs[i], dtype=np.float64) for i in fitted]) ** 2
+
+    def sums(items):
+        return np.bincount(segment, weights=items, minlength=len(fitted))
+
+    # Weights of the points, weighted means and the beta terms of the slope for the current slope
+    def york_terms(slope):
+        weights = x_weights * y_weights / (x_weights + slope[segment] ** 2 * y_weights)
+        weight_sum = sums(weights)
+        x_mean = sums(weights * x) / weight_sum
+        y_mean = sums(weights * y) / weight_sum
+        u = x - x_mean[segment]
+        v = y - y_mean[segment]
+        beta = weights * (u / y_weights + slope[segment] * v / x_weights)
+        return weights, weight_sum, x_mean, y_mean, u, v, beta
+
+    def york_chi_squared(slope):
+        weights, _, _, _, u, v, _ = york_terms(slope)
+        return sums(weights * (v - slope[segment] * u) ** 2)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slope = np.array([fit[0] for fit in initial_fits])
+        iterations = np.zeros(len(fitted), dtype=np.int64)
+        active = np.isfinite(slope)
+        while active.any() and iterations.max() < YORK_MAX_ITERATIONS:
+            weights, _, _, _, u, v, beta = york_terms(slope)
+            new_slope = sums(weights * beta * v) / sums(weights * beta * u)
+            iterations += active
+            changed = np.abs(new_slope - slope) > YORK_TOLERANCE * np.abs(new_slope)
+            slope = np.where(active, new_slope, slope)
+            active &= changed & np.isfinite(slope)
+
+        if active.any():
+            slope = np.where(active, york_minimum(york_chi_squared, active), slope)
+            iterations[active] = YORK_MAX_ITERATIONS
+
+        weights, weight_sum, x_mean, y_mean, u, v, beta = york_terms(slope)
+        intercept = y_mean - slope * x_mean
+        # Uncertainties from the least-squares adjusted x values
+        x_adjusted = x_mean[segment] + beta
+        adjusted_mean = sums(weights * x_adjusted) / weight_sum
+        slope_var = 1 / sums(weights * (x_adjusted - adjusted_mean[segment]) ** 2)
+        intercept_var = 1 / weight_sum + adjusted_mean ** 2 * slope_var
+
+        chi_squared = sums(weights * (y - slope[segment] * x - intercept[segment]) ** 2)
+        dof = count - 2
+        p_val = nonlinear_fit.p_values(chi_squared, dof)
+
+    for i, fit_index in enumerate(fitted):
+        if np.isfinite(slope[i]):
+            fits[fit_index] = (float(slope[i]), float(np.sqrt(slope_var[i])), float(intercept[i]),
+                               float(np.sqrt(intercept_var[i])), float(chi_squared[i]), int(dof[i]), float(p_val[i]),
+                               int(iterations[i]))
+    return fits
+
+
+# Slopes of the York chi-squared minimum of the selected data sets (the other slopes are nan)
+# chi_squared gives the York chi-squared of all data sets for their slopes
+# It is evaluated on a grid of slope angles, then the best angle of each data set is refined by golden section search
+def york_minimum(chi_squared, selected):
+    angles = np.linspace(-np.pi / 2, np.pi / 2, YORK_ANGLES + 1)[1:-1]
+    step = angles[1] - angles[0]
+    grid = np.array([chi_squared(np.full(len(selected), np.tan(angle))) for angle in angles])
+    best = angles[np.argmin(np.where(np.isfinite(grid), grid, np.inf), axis=0)]
+
+    ratio = (np.sqrt(5) - 1) / 2
+    low = best - step
+    high = best + step
+    for _ in range(YORK_SECTION_STEPS):
+        left = high - ratio * (high - low)
+        right = low + ratio * (high - low)
+        is_left = chi_squared(np.tan(left)) < chi_squared(np.tan(right))
+        high = np.where(is_left, right, high)
+        low = np.where(is_left, low, left)
+
+    return np.where(selected, np.tan((low + high) / 2), np.nan)
+
+
+# Returns the ratio fit function, its equation and the initial guess of the parameters
+# The initial guess is used only if the linearised guess of nonlinear_fit is not finite
+def ratio_function(fit_type):
+    if fit_type == 'exponential':
+        return func_exponential, 'a*exp(xb)', (0.9, 0.00003)
+    return func_parabolic, 'a*x^2 + b', (0.00000004, 0.9)
+
+
+# Fit of the ratio by the parabolic or exponential function
+# Returns a, a uncertainty, b, b uncertainty, chi-squared, degrees of freedom, p-value,
+# the iterations and whether the fit converged
+def fit_ratio(x, y, y_unc, fit_type):
+    fit = fit_ratio_batch([x], [y], [y_unc], fit_type)[0]
+    if fit is None:
+        raise TypeError(f'Improper input: the ratio fit needs at least 2 points, got {len(x)}')
+    return fit
+
+
+# Ratio fits of several data sets at once by the Levenberg-Marquardt fit of nonlinear_fit
+# The uncertainties are relative (scaled by chi-squared / dof) as in curve_fit, None for data sets with too few points
+def fit_ratio_batch(xs, ys, y_uncs, fit_type):
+    _, _, initial_guess = ratio_function(fit_type)
+    model = 'exponential' if fit_type == 'exponential' else 'parabolic'
+    fits = nonlinear_fit.fit_batch(model, xs, ys, y_uncs, fallback_guess=initial_guess)
+
+    ratio_fits = []
+    for fit in fits:
+        if fit is None:
+            ratio_fits.append(None)
+            continue
+        (a, b), (a_unc, b_unc), chi_squared, dof, p_val, iterations, converged = fit
+        ratio_fits.append((a, a_unc, b, b_unc, chi_squared, dof, p_val, iterations, converged))
+    return ratio_fits
+
+
+def linear_couple_fit(det_couple):
+    return fit_linear(*linear_fit_data(det_couple))
+
+
+# Linear fits of all detector couples as one batched computation, None for couples with too few points
+def linear_couple_fits(det_couples):
+    if not det_couples:
+        return []
+    return fit_linear_batch(*zip(*[linear_fit_data(det_couple) for det_couple in det_couples]))
+
+
+def ratio_couple_fit(det_couple, detector_type, fit_type):
+    return fit_ratio(*ratio_fit_data(det_couple, detector_type), fit_type)
+
+
+# Ratio fits of all detector couples as one batched computation, None for couples with too few points
+def ratio_couple_fits(det_couples, detector_type, fit_type):
+    if not det_couples:
+        return []
+    return fit_ratio_batch(*zip(*[ratio_fit_data(det_couple, detector_type) for det_couple in det_couples]),
+                           fit_type)
+
+
+# York fits of all detector couples as one batched computation, None for couples which are not fitted
+def york_couple_fits(det_couples):
+    if not det_couples:
+        return []
+    return fit_york_batch(*zip(*[linear_fit_data(det_couple) for det_couple in det_couples]))
+
+
+# Line of the fit parameter files (save_param_file) - the detector couple and the first 7 fit parameters
+# The columns of the extra fits (count and fit) are added, e.g. of the York fit
+def fit_param_line(detector_couple, fit, *extra_fits):
+    a, a_unc, b, b_unc, chi_squared, dof, p_val = fit[:7]
+    line = f'{detector_couple[0]}, {detector_couple[1]}, {a}, {a_unc}, {b}, {b_unc},' \
+           f'{chi_squared}, {dof}, {p_val}'
+    for count, extra_fit in extra_fits:
+        line += ', ' + fit_columns(extra_fit, count)
+    return line + '\n'
+
+
+# The first count parameters of the fit separated by commas, - for fits which failed (None)
+def fit_columns(fit, count=7):
+    if fit is None:
+        return ', '.join(['-'] * count)
+    return ', '.join(str(param) for param in fit[:count])
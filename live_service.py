@@ -0,0 +1,153 @@
+import argparse
+import asyncio
+import datetime
+import math
+import os
+import re
+
+from config import Configuration
+from manage_data import services
+from manage_data.live import LiveAverager
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.txt')
+
+# Live ingestion service - detector gateways send their readings over a local TCP or Unix socket instead of
+# exporting files, the readings are averaged as they arrive (manage_data.live) with the settings of the config file
+# Line protocol, one line per reading or command:
+#   <detector> <time> <value> [<uncertainty>] - time in seconds since the epoch or ISO format (2021-06-09T07:52:00)
+#   subscribe - the connection receives the completed intervals:
+#     datapoint <detector> <interval middle>, <value>, <uncertainty>
+#     datacouple <referent> <compared> <line of the coupled data file>
+#   close <detector> - the detector stopped sending readings, its last interval is completed as at the end of a file
+# Readings are not answered, a line which is not accepted is answered by error <reason>
+# The referent detector is given by --referent, all other detectors are compared detectors
+# With save_data the couples of each compared detector are saved in output_files/coupled_data as by run.py
+# e.g. python live_service.py --referent AG1234 --port 8765 or python live_service.py --unix /tmp/radon.sock
+HOST = '127.0.0.1'
+PORT = 8765
+# Subscribers which do not read the events are disconnected when this many bytes are waiting
+MAX_SUBSCRIBER_BUFFER = 2 ** 20
+RE_DETECTOR = r'^[\w.-]+$'
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+# Parses a reading line, returns the detector, time, value and uncertainty (None if not given)
+# Raises ValueError for a line which is not a reading, e.g. with a time out of range or a value which is not finite
+def parse_reading(line):
+    tokens = line.split()
+    if len(tokens) not in (3, 4):
+        raise ValueError('expected <detector> <time> <value> [<uncertainty>]')
+    if not re.match(RE_DETECTOR, tokens[0]):
+        raise ValueError(f'invalid detector name {tokens[0]}')
+    try:
+        seconds = float(tokens[1])
+    except ValueError:
+        meas_time = datetime.datetime.fromisoformat(tokens[1])
+        if meas_time.tzinfo is not None:
+            raise ValueError(f'time with a time zone {tokens[1]}')
+    else:
+        if not math.isfinite(seconds):
+            raise ValueError(f'invalid time {tokens[1]}')
+        try:
+            meas_time = EPOCH + datetime.timedelta(seconds=seconds)
+        except OverflowError:
+            raise ValueError(f'time out of range {tokens[1]}')
+
+    numbers = [float(token) for token in tokens[2:]]
+    if not all(math.isfinite(number) for number in numbers):
+        raise ValueError(f'invalid value {" ".join(tokens[2:])}')
+    value_unc = numbers[1] if len(numbers) == 2 else None
+    return tokens[0], meas_time, numbers[0], value_unc
+
+
+class LiveService:
+    def __init__(self, configuration, referent):
+        self.configuration = configuration
+        self.averager = LiveAverager(configuration, referent)
+        self.subscribers = set()
+        # detector couple: path of its coupled data file
+        self.saved = {}
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                text = line.decode(errors='replace').strip()
+                if not text:
+                    continue
+                if text == 'subscribe':
+                    self.subscribers.add(writer)
+                    continue
+                try:
+                    if text.startswith('close '):
+                        events = self.averager.close_detector(text.split(maxsplit=1)[1].strip())
+                    else:
+                        events = self.averager.add_reading(*parse_reading(text))
+                except (ValueError, OverflowError, TypeError) as error:
+                    writer.write(f'error {error}\n'.encode())
+                    await writer.drain()
+                    continue
+                if events:
+                    self.publish(events)
+        except ConnectionError:
+            pass
+        finally:
+            self.subscribers.discard(writer)
+            writer.close()
+
+    # Saves the couples and sends the events to the subscribers
+    def publish(self, events):
+        lines = []
+        for kind, names, entry in events:
+            if kind == 'datapoint':
+                lines.append(f'datapoint {names} {entry.meas_time}, {entry.value}, {entry.value_unc}\n')
+                continue
+            lines.append(f'datacouple {names[0]} {names[1]} {services.datacouple_line(entry)}\n')
+            if self.configuration.save_files:
+                if names in self.saved:
+                    services.append_datacouples_file([entry], self.saved[names])
+                else:
+                    self.saved[names] = services.save_datacouples_file(
+                        [entry], names, self.configuration.compared_value, self.configuration.unit)
+
+        data = ''.join(lines).encode()
+        for writer in list(self.subscribers):
+            if writer.transport.get_write_buffer_size() > MAX_SUBSCRIBER_BUFFER:
+                self.subscribers.discard(writer)
+                writer.close()
+            else:
+                writer.write(data)
+
+
+async def serve(service, host, port, unix_path):
+    if unix_path:
+        server = await asyncio.start_unix_server(service.handle_connection, unix_path)
+    else:
+        server = await asyncio.start_server(service.handle_connection, host, port)
+    addresses = ', '.join(str(sock.getsockname()) for sock in server.sockets)
+    print(f'{datetime.datetime.now()} Listening on {addresses}', flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+    configuration = Configuration(CONFIG_PATH)
+    parser = argparse.ArgumentParser(description='Averages detector readings received over a local socket')
+    parser.add_argument('--referent', default=configuration.referent_detector, help='referent detector name')
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--unix', help='path of a Unix socket, used instead of host and port')
+    arguments = parser.parse_args()
+    if configuration.is_custom_interval:
+        raise ValueError('The live service works with equidistant intervals')
+
+    try:
+        asyncio.run(serve(LiveService(configuration, arguments.referent), arguments.host, arguments.port,
+                          arguments.unix))
+    except KeyboardInterrupt:
+        print(f'{datetime.datetime.now()} Stopped')
+    finally:
+        if arguments.unix and os.path.exists(arguments.unix):
+            os.remove(arguments.unix)
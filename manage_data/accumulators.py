@@ -0,0 +1,208 @@
+from math import sqrt
+
+from manage_data import instrumentation
+from manage_data.data_classes import Datapoint
+
+# Single pass statistics of the readings of an interval, used by services.estimate_value and the live averaging
+# The readings are added one at a time in time order, no list of the interval readings is kept and the
+# readings are not changed
+# The statistics are updated with Welford's method (weighted for the 'weighted' average), which does not lose
+# precision for large values with a small spread as the sum of squares does
+# The values are shifted by the first value, so equal values give a variance of exactly zero
+
+
+# Count, mean and sum of squared deviations from the mean of the added values
+class RunningStatistics:
+    __slots__ = ('count', 'shift', 'shifted_mean', 'squared_deviations')
+
+    def __init__(self):
+        self.count = 0
+        self.shift = 0.0
+        self.shifted_mean = 0.0
+        self.squared_deviations = 0.0
+
+    def add(self, value):
+        if self.count == 0:
+            self.shift = value
+        self.count += 1
+        value -= self.shift
+        delta = value - self.shifted_mean
+        self.shifted_mean += delta / self.count
+        self.squared_deviations += delta * (value - self.shifted_mean)
+
+    @property
+    def mean(self):
+        return self.shift + self.shifted_mean
+
+    # Sample variance, 0 for less than two values as the stdev used by estimate_value
+    def variance(self):
+        return self.squared_deviations / (self.count - 1) if self.count > 1 else 0.0
+
+
+# Weight sum, weighted mean, weighted sum of squared deviations and sum of squared weighted uncertainties
+class WeightedStatistics:
+    __slots__ = ('count', 'weight_sum', 'shift', 'shifted_mean', 'squared_deviations', 'unc_squared')
+
+    def __init__(self):
+        self.count = 0
+        self.weight_sum = 0.0
+        self.shift = 0.0
+        self.shifted_mean = 0.0
+        self.squared_deviations = 0.0
+        self.unc_squared = 0.0
+
+    # Values with zero weight (e.g. a reading at the interval start) only add to the count
+    def add(self, value, weight, value_unc):
+        self.count += 1
+        self.unc_squared += (weight * value_unc) ** 2
+        if not self.weight_sum:
+            self.shift = value
+        self.weight_sum += weight
+        if weight:
+            value -= self.shift
+            delta = value - self.shifted_mean
+            self.shifted_mean += delta * weight / self.weight_sum
+            self.squared_deviations += weight * delta * (value - self.shifted_mean)
+
+    @property
+    def mean(self):
+        return self.shift + self.shifted_mean
+
+    def copy(self):
+        statistics = WeightedStatistics()
+        statistics.count = self.count
+        statistics.weight_sum = self.weight_sum
+        statistics.shift = self.shift
+        statistics.shifted_mean = self.shifted_mean
+        statistics.squared_deviations = self.squared_deviations
+        statistics.unc_squared = self.unc_squared
+        return statistics
+
+
+# Statistics of the readings of an interval and the closing point (the first reading at or after the interval end)
+# The closing point is only known when the interval is estimated, so the last added reading is kept apart:
+# - 'inside' averages leave out the closing point and the last of the raw values (the values left by the zeros
+#   filter), the raw values of the thresholds and jumps filters include them
+# - 'weighted' averages weight each value by the time since the previous reading (or the interval start),
+#   the closing point by the time from the previous reading to the interval end and replace it by the previous
+#   reading if it is more than interval_len minutes after the end
+# settings are the estimate settings of services.get_estimate_settings
+class IntervalAccumulator:
+    __slots__ = ('interval', 'settings', 'skip_zeros', 'is_weighted', 'count', 'raw', 'raw_last', 'raw_min',
+                 'raw_max', 'unc_squared', 'weighted', 'previous_time', 'previous', 'last')
+
+    def __init__(self, interval, settings):
+        self.interval = interval
+        self.settings = settings
+        self.skip_zeros = 'zeros' in settings['clearing']
+        self.is_weighted = settings['averaging'] != 'inside'
+        self.count = 0
+        # raw values without the last one, which is in raw_last, their minimum and maximum include it
+        self.raw = RunningStatistics()
+        self.raw_last = None
+        self.raw_min = None
+        self.raw_max = None
+        # squared uncertainties and weighted statistics of the readings without the last one
+        self.unc_squared = 0.0
+        self.weighted = WeightedStatistics()
+        self.previous_time = interval.start_time
+        # the last two readings as (meas_time, value, value_unc)
+        self.previous = None
+        self.last = None
+
+    def add(self, meas_time, value, value_unc=0.0):
+        self.count += 1
+        if not self.skip_zeros or value > 0:
+            if self.raw_last is not None:
+                self.raw.add(self.raw_last)
+                self.raw_min = min(self.raw_min, value)
+                self.raw_max = max(self.raw_max, value)
+            else:
+                self.raw_min = self.raw_max = value
+            self.raw_last = value
+
+        if self.last is not None:
+            last_time, last_value, last_unc = self.last
+            self.unc_squared += last_unc ** 2
+            if self.is_weighted:
+                self.weighted.add(last_value, (last_time - self.previous_time).total_seconds() / 60, last_unc)
+                self.previous_time = last_time
+            self.previous = self.last
+        self.last = (meas_time, value, value_unc)
+
+    # Estimates the value of the interval with the last added reading as the closing point, as estimate_value
+    # Returns a Datapoint at the middle of the interval or None if the interval is cleared by the filters or
+    # has no values to average (e.g. only zero values with the zeros filter)
+    def estimate(self):
+        settings = self.settings
+        clearing = settings['clearing']
+        background_unc = settings['background_unc']
+        if self.count < 2 or self.raw_last is None:
+            return None
+
+        if self.is_weighted:
+            averages = self.weighted_averages()
+        else:
+            averages = self.inside_averages()
+        if averages is None:
+            return None
+        value, unc_propagation, stdev_av, stdev_single = averages
+
+        # Applying filters - thresholds, jumps (intervals with sharp changes in value)
+        raw_average = self.raw.mean + (self.raw_last - self.raw.mean) / (self.raw.count + 1)
+        if raw_average < settings['min_threshold'] or raw_average > settings['max_threshold']:
+            instrumentation.count('intervals_dropped_thresholds')
+            return None
+
+        if 'jumps' in clearing and self.raw_max - self.raw_min > raw_average:
+            instrumentation.count('intervals_dropped_jumps')
+            return None
+
+        # Removing negative values and applying background filter
+        value -= settings['background']
+        if value < 0:
+            value = 0.0
+
+        if 'bgn' in clearing and value < 3 * background_unc:
+            instrumentation.count('intervals_dropped_bgn')
+            return None
+
+        estimated_value = Datapoint(self.interval.meas_time, value)
+
+        # Chooses the specified uncertainty
+        uncertainty_type = settings['uncertainty_type']
+        if uncertainty_type == 'stdevav':
+            estimated_value.value_unc = sqrt((stdev_av ** 2) + (background_unc ** 2))
+        elif uncertainty_type == 'stdev':
+            estimated_value.value_unc = sqrt((stdev_single ** 2) + (background_unc ** 2))
+        elif uncertainty_type == 'propagation':
+            estimated_value.value_unc = sqrt((unc_propagation ** 2) + (background_unc ** 2))
+        elif uncertainty_type == 'max':
+            estimated_value.value_unc = sqrt((max(stdev_av, unc_propagation) ** 2) + (background_unc ** 2))
+
+        return estimated_value
+
+    # 'inside' average and its uncertainties without the closing point and the last raw value
+    def inside_averages(self):
+        count = self.raw.count
+        if count == 0:
+            return None
+        stdev_single = sqrt(self.raw.variance())
+        return self.raw.mean, sqrt(self.unc_squared) / count, stdev_single / sqrt(count), stdev_single
+
+    # 'weighted' average and its uncertainties with the closing point
+    def weighted_averages(self):
+        closing_time, value, value_unc = self.last
+        end = self.interval.end_time
+        if (closing_time - end).total_seconds() / 60 > self.settings['interval_len']:
+            _, value, value_unc = self.previous
+        weighted = self.weighted.copy()
+        weighted.add(value, (end - self.previous_time).total_seconds() / 60, value_unc)
+        if weighted.weight_sum == 0:
+            return None
+
+        # the sum of squared deviations of nearly equal values can be rounded below zero
+        squared_deviations = max(weighted.squared_deviations, 0.0)
+        stdev_av = sqrt(squared_deviations / ((weighted.count - 1) * weighted.weight_sum))
+        return weighted.mean, sqrt(weighted.unc_squared) / weighted.weight_sum, stdev_av, \
+            stdev_av * sqrt(weighted.count)
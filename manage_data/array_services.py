@@ -0,0 +1,164 @@
+import numpy as np
+
+from manage_data import file_cache, instrumentation, interval_engine, services
+from manage_data.data_classes import CoupleSeries, TimeSeries
+from manage_data.detector_serials import SerialScanner
+from manage_data.prefix_index import PrefixIndex
+
+
+# Reads one detector file into a TimeSeries - int64 epoch seconds, float64 values and float64 value uncertainties
+# Uses the streaming reader of services.read_files, every chunk is converted to arrays as it is read
+# The arrays are sorted by time, keeping the file order for equal times as the object reader does
+# Returns the TimeSeries and the detector serial found in the file
+def read_file_arrays(file_path, settings, start_time=None, end_time=None, is_sorted=False):
+    scanner = SerialScanner(settings['detector'], file_path)
+    time_chunks = []
+    value_chunks = []
+    unc_chunks = []
+
+    for chunk in services.iter_file_records(file_path, settings, start_time, end_time, is_sorted, epoch=True,
+                                            scanner=scanner):
+        times, values, uncertainties = zip(*chunk)
+        time_chunks.append(np.array(times, dtype=np.int64))
+        value_chunks.append(np.array(values, dtype=np.float64))
+        unc_chunks.append(np.array(uncertainties, dtype=np.float64))
+
+    if not time_chunks:
+        return TimeSeries(np.empty(0, dtype=np.int64), np.empty(0), np.empty(0)), scanner.serial
+
+    times = np.concatenate(time_chunks)
+    values = np.concatenate(value_chunks)
+    uncertainties = np.concatenate(unc_chunks)
+    order = np.argsort(times, kind='stable')
+
+    return TimeSeries(times[order], values[order], uncertainties[order]), scanner.serial
+
+
+# Reads the whole file through the parsed-file cache and applies the start/end window to the cached series
+# The cache keeps at most cache_megabytes, evicting the least recently used files
+# The readings outside the window are counted as lines_outside_start_end, as by the reader with a window
+def read_file_cached(file_path, settings, start_time=None, end_time=None, cache_megabytes=1000):
+    cached = file_cache.load(file_path, settings)
+    if cached is None:
+        series, serial = read_file_arrays(file_path, settings)
+        file_cache.store(file_path, settings, (series.times, series.values, series.uncertainties), serial,
+                         cache_megabytes)
+    else:
+        instrumentation.count('cache_hits')
+        columns, serial = cached
+        series = TimeSeries(*columns)
+
+    window = series.between(start_time, end_time)
+    instrumentation.count('lines_outside_start_end', len(series) - len(window))
+    return window, serial
+
+
+# Columnar alternative of services.read_files
+# Returns a TimeSeries for each file in the referent or compared directory and the serials found in the files
+# With file_cache in the config file the parsed files are cached in output_files/cache
+def read_files_arrays(file_type, configuration):
+    settings = services.get_read_settings(file_type, configuration)
+    file_paths = services.list_data_files(settings['directory'])
+
+    if configuration.file_cache:
+        return services.split_serials(
+            services.map_files(read_file_cached, file_paths, configuration.read_workers, settings,
+                               configuration.start_time, configuration.end_time, configuration.cache_size_mb))
+
+    return services.split_serials(
+        services.map_files(read_file_arrays, file_paths, configuration.read_workers, settings,
+                           configuration.start_time, configuration.end_time, configuration.sorted_files))
+
+
+# Same result as services.read_files, but the files are read by the array reader and converted to datapoints
+# Used with the object data engine when the parsed files are cached
+def read_files_objects(file_type, configuration):
+    all_series, serials = read_files_arrays(file_type, configuration)
+    return [list(series) for series in all_series], serials
+
+
+# Averages a TimeSeries over the intervals given by arrays of start and end epoch seconds
+# Returns a TimeSeries with the interval middles as times, only for the intervals which were not cleared
+# A PrefixIndex of the series built for the same detector settings can be given to average many interval sets,
+# with prefix_index in the config file an index is built if none is given
+def average_series(starts, ends, series, configuration, det_type, index=None):
+    settings = services.get_estimate_settings(configuration, det_type)
+    first, last, non_empty = interval_engine.bin_intervals(series.times, starts, ends)
+    instrumentation.count('intervals_empty', len(starts) - np.count_nonzero(non_empty))
+    if index is None and configuration.prefix_index:
+        index = PrefixIndex.from_series(series, settings)
+    if index is not None:
+        values, uncertainties, keep = index.estimate(starts, ends, first, last, settings)
+    else:
+        values, uncertainties, keep = \
+            interval_engine.estimate_values(series.times, series.values, series.uncertainties, starts, ends,
+                                            first, last, settings)
+    return kept_series(starts, ends, values, uncertainties, keep)
+
+
+# Averaged series of the kept intervals, with the times at the middle of the intervals
+def kept_series(starts, ends, values, uncertainties, keep):
+    starts = starts[keep]
+    ends = ends[keep]
+
+    return TimeSeries(starts + (ends - starts) // 2, values[keep], uncertainties[keep], starts, ends)
+
+
+# Array version of services.average_over_intervals
+# The compared data is averaged only over the intervals kept for the referent data
+def average_over_intervals_arrays(intervals, referent_data, compared_data, configuration):
+    starts, ends = interval_engine.interval_bounds(intervals)
+    ref_av_series = average_series(starts, ends, referent_data[0], configuration, 'referent')
+    cmp_av_series = [average_series(ref_av_series.starts, ref_av_series.ends, data, configuration, 'compared')
+                     for data in compared_data]
+
+    return ref_av_series, cmp_av_series
+
+
+# Array version of services.join_detector_couple for the referent and all compared series in one call
+# All compared times are matched to the referent times with a single binary search (sorted intersection)
+# and ratios and ratio uncertainties are computed for all matched intervals at once
+# Returns a CoupleSeries for each compared series
+def join_detector_couples_arrays(ref_series, cmp_series_list):
+    if not cmp_series_list:
+        return []
+
+    cmp_times = np.concatenate([series.times for series in cmp_series_list])
+    cmp_values = np.concatenate([series.values for series in cmp_series_list])
+    cmp_uncertainties = np.concatenate([series.uncertainties for series in cmp_series_list])
+    series_ends = np.cumsum([len(series) for series in cmp_series_list], dtype=np.int64)
+
+    ref_index = np.minimum(np.searchsorted(ref_series.times, cmp_times), max(len(ref_series) - 1, 0))
+    if len(ref_series):
+        matched = ref_series.times[ref_index] == cmp_times
+    else:
+        matched = np.zeros(len(cmp_times), dtype=bool)
+
+    ref_values = ref_series.values[ref_index[matched]]
+    ref_uncertainties = ref_series.uncertainties[ref_index[matched]]
+    cmp_values = cmp_values[matched]
+    cmp_uncertainties = cmp_uncertainties[matched]
+
+    # A ratio is found only if both values are non-zero, its relative uncertainty includes the non-zero uncertainties
+    with np.errstate(invalid='ignore', divide='ignore'):
+        has_ratio = (ref_values != 0) & (cmp_values != 0)
+        ratios = np.where(has_ratio, ref_values / cmp_values, np.nan)
+        ref_relative = np.where(ref_uncertainties != 0, ref_uncertainties / ref_values, 0.0)
+        cmp_relative = np.where(cmp_uncertainties != 0, cmp_uncertainties / cmp_values, 0.0)
+        ratio_relative = np.where(cmp_uncertainties != 0, np.sqrt(ref_relative ** 2 + cmp_relative ** 2),
+                                  ref_relative)
+        ratio_uncertainties = ratios * ratio_relative
+
+    # Splits the matched couples back to the compared series
+    matched_before = np.concatenate(([0], np.cumsum(matched)))
+    bounds = matched_before[np.concatenate(([0], series_ends))]
+    times = cmp_times[matched]
+
+    return [CoupleSeries(times[start:end], ref_values[start:end], ref_uncertainties[start:end],
+                         cmp_values[start:end], cmp_uncertainties[start:end],
+                         ratios[start:end], ratio_uncertainties[start:end])
+            for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def join_detector_couple_arrays(ref_series, cmp_series):
+    return join_detector_couples_arrays(ref_series, [cmp_series])[0]
@@ -1,5 +1,12 @@
+import numpy as np
 
+from manage_data.datetime_parser import from_epoch
+
+
+# The object classes use __slots__ so a list of many readings does not keep a dict per instance
 class Datapoint:
+    __slots__ = ('meas_time', 'value', 'value_unc')
+
     def __init__(self, datetime_value, value):
         self.meas_time = datetime_value
         self.value = value
@@ -7,6 +14,8 @@ class Datapoint:
 
 
 class Datacouple:
+    __slots__ = ('meas_time', 'ref_value', 'cmp_value', 'ratio_ref_cmp', 'ref_value_unc', 'cmp_value_unc', 'ratio_unc')
+
     def __init__(self, datetime_value, ref_value, cmp_value):
         self.meas_time = datetime_value
         self.ref_value = ref_value
@@ -19,8 +28,127 @@ class Datacouple:
 
 
 class Interval:
+    __slots__ = ('start_time', 'end_time', 'meas_time')
+
     def __init__(self, start_time, end_time):
         self.start_time = start_time
         self.end_time = end_time
         self.meas_time = self.start_time + (self.end_time - self.start_time) / 2
 
+
+# Array-backed series of datapoints - times are int64 seconds since the epoch
+# For averaged data starts and ends are the interval start and end times, else they are None
+# Indexing with an int gives a Datapoint, slicing gives a TimeSeries sharing the arrays
+class TimeSeries:
+    __slots__ = ('times', 'values', 'uncertainties', 'starts', 'ends')
+
+    def __init__(self, times, values, uncertainties=None, starts=None, ends=None):
+        self.times = np.asarray(times, dtype=np.int64)
+        self.values = np.asarray(values, dtype=np.float64)
+        if uncertainties is None:
+            uncertainties = np.zeros(len(self.times))
+        self.uncertainties = np.asarray(uncertainties, dtype=np.float64)
+        self.starts = None if starts is None else np.asarray(starts, dtype=np.int64)
+        self.ends = None if ends is None else np.asarray(ends, dtype=np.int64)
+
+    @classmethod
+    def from_datapoints(cls, datapoints):
+        return cls(np.array([dp.meas_time for dp in datapoints], dtype='datetime64[s]').astype(np.int64),
+                   [dp.value for dp in datapoints], [dp.value_unc for dp in datapoints])
+
+    # The times as numpy datetime64, which can be plotted directly
+    @property
+    def meas_times(self):
+        return self.times.astype('datetime64[s]')
+
+    def __len__(self):
+        return len(self.times)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return TimeSeries(self.times[index], self.values[index], self.uncertainties[index],
+                              None if self.starts is None else self.starts[index],
+                              None if self.ends is None else self.ends[index])
+        datapoint = Datapoint(from_epoch(self.times[index]), float(self.values[index]))
+        datapoint.value_unc = float(self.uncertainties[index])
+        return datapoint
+
+    def __iter__(self):
+        for i in range(len(self.times)):
+            yield self[i]
+
+    # The part of the series with times between start and end time (datetime), both included
+    # A start or end time of None does not limit the series
+    def between(self, start_time, end_time):
+        first = 0
+        last = len(self.times)
+        if start_time:
+            first = np.searchsorted(self.times, np.datetime64(start_time, 's').astype(np.int64), side='left')
+        if end_time:
+            last = np.searchsorted(self.times, np.datetime64(end_time, 's').astype(np.int64), side='right')
+        return self[first:last]
+
+
+# Array-backed series of detector couples, missing ratios and ratio uncertainties are NaN
+# Indexing with an int gives a Datacouple, slicing gives a CoupleSeries sharing the arrays
+class CoupleSeries:
+    __slots__ = ('times', 'ref_values', 'ref_uncertainties', 'cmp_values', 'cmp_uncertainties',
+                 'ratios', 'ratio_uncertainties')
+
+    def __init__(self, times, ref_values, ref_uncertainties, cmp_values, cmp_uncertainties,
+                 ratios, ratio_uncertainties):
+        self.times = np.asarray(times, dtype=np.int64)
+        self.ref_values = np.asarray(ref_values, dtype=np.float64)
+        self.ref_uncertainties = np.asarray(ref_uncertainties, dtype=np.float64)
+        self.cmp_values = np.asarray(cmp_values, dtype=np.float64)
+        self.cmp_uncertainties = np.asarray(cmp_uncertainties, dtype=np.float64)
+        self.ratios = np.asarray(ratios, dtype=np.float64)
+        self.ratio_uncertainties = np.asarray(ratio_uncertainties, dtype=np.float64)
+
+    @classmethod
+    def from_datacouples(cls, datacouples):
+        return cls(np.array([dc.meas_time for dc in datacouples], dtype='datetime64[s]').astype(np.int64),
+                   [dc.ref_value for dc in datacouples], [dc.ref_value_unc for dc in datacouples],
+                   [dc.cmp_value for dc in datacouples], [dc.cmp_value_unc for dc in datacouples],
+                   [np.nan if dc.ratio_ref_cmp is None else dc.ratio_ref_cmp for dc in datacouples],
+                   [np.nan if dc.ratio_unc is None else dc.ratio_unc for dc in datacouples])
+
+    @property
+    def meas_times(self):
+        return self.times.astype('datetime64[s]')
+
+    def __len__(self):
+        return len(self.times)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return CoupleSeries(self.times[index], self.ref_values[index], self.ref_uncertainties[index],
+                                self.cmp_values[index], self.cmp_uncertainties[index],
+                                self.ratios[index], self.ratio_uncertainties[index])
+        datacouple = Datacouple(from_epoch(self.times[index]), float(self.ref_values[index]),
+                                float(self.cmp_values[index]))
+        datacouple.ref_value_unc = float(self.ref_uncertainties[index])
+        datacouple.cmp_value_unc = float(self.cmp_uncertainties[index])
+        ratio = self.ratios[index]
+        datacouple.ratio_ref_cmp = None if np.isnan(ratio) else float(ratio)
+        ratio_unc = self.ratio_uncertainties[index]
+        datacouple.ratio_unc = None if np.isnan(ratio_unc) else float(ratio_unc)
+        return datacouple
+
+    def __iter__(self):
+        for i in range(len(self.times)):
+            yield self[i]
+
+
+# Columns of a TimeSeries or a list of Datapoint objects - times, values and value uncertainties
+def series_columns(data):
+    if isinstance(data, TimeSeries):
+        return data.meas_times, data.values, data.uncertainties
+    return [dp.meas_time for dp in data], [dp.value for dp in data], [dp.value_unc for dp in data]
+
+
+# Converts a list of Datacouple objects to a CoupleSeries, a CoupleSeries is returned as it is
+def to_couple_series(det_couple):
+    if isinstance(det_couple, CoupleSeries):
+        return det_couple
+    return CoupleSeries.from_datacouples(det_couple)
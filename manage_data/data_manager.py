@@ -1,8 +1,11 @@
-from manage_data import services
+from manage_data import array_services, incremental, instrumentation, interval_sweep, services
 
 
+# With the instrumentation each stage is recorded with the number of items it produced or processed
 def get_data_separate_files(configuration):
-    intervals = services.prepare_intervals(configuration)
+    with instrumentation.stage('prepare_intervals') as record:
+        intervals = services.prepare_intervals(configuration)
+        record['items'] = len(intervals)
 
     # For custom intervals start and end time are set as the start and end the union of all intervals
     # In read_files data is saved only for datetime between the start and end time
@@ -10,9 +13,20 @@ def get_data_separate_files(configuration):
         configuration.start_time = intervals[0].start_time
         configuration.end_time = intervals[len(intervals) - 1].end_time
 
+    # With data_engine arrays in the config file, each file is read and averaged as a TimeSeries
+    if configuration.data_engine == 'arrays':
+        read_files = array_services.read_files_arrays
+        average_over_intervals = array_services.average_over_intervals_arrays
+    else:
+        read_files = array_services.read_files_objects if configuration.file_cache else services.read_files
+        average_over_intervals = services.average_over_intervals
+
     # A list of data for each file as a list of data points in each line is returned
     # Each data point is in format object with datetime, compared value and value uncertainty if provided
-    referent_data = services.read_files('referent', configuration)
+    # The serials found in the files are returned with the data
+    with instrumentation.stage('read_files_referent') as record:
+        referent_data, referent_serials = read_files('referent', configuration)
+        record['items'] = sum(len(data) for data in referent_data)
     if len(referent_data[0]) == 0:
         raise Exception('Check referent detector configuration - indexes, separator or encoding')
 
@@ -22,41 +36,42 @@ def get_data_separate_files(configuration):
     if not configuration.end_time:
         configuration.end_time = referent_data[0][len(referent_data) - 1].meas_time
 
-    compared_data = services.read_files('compared', configuration)
+    with instrumentation.stage('read_files_compared') as record:
+        compared_data, compared_serials = read_files('compared', configuration)
+        record['items'] = sum(len(data) for data in compared_data)
     if len(compared_data[0]) == 0:
         raise Exception('Check compared detector configuration - indexes, separator or encoding')
 
-    # Attempts to find the detectors' serials in the files and includes them in the configuration object
-    # Currently works for AlphaGuard, RadonEYE and AlphaE
-    referent_serials = services.search_detector_serial(configuration.referent_detector, 'referent')
-    if referent_serials:
-        configuration.referent_detector += referent_serials[0]
-    compared_det_serials = services.search_detector_serial(configuration.compared_detector, 'compared')
-    if compared_det_serials:
-        configuration.compared_det_serials = \
-            [(configuration.referent_detector, cmp)
-             if cmp
-             else (configuration.referent_detector, configuration.compared_detector)
-             for cmp in compared_det_serials]
+    # Includes the detectors' serials found in the files while reading in the configuration object
+    # Currently works for AlphaGuard, RadonEYE, AlphaE and RAD7
+    services.set_detector_serials(configuration, referent_serials, compared_serials)
 
     # Averages over the intervals
     # Returns a list of datapoints for the referent and each compared file
-    ref_data_av_intervals, cmp_data_av_intervals = \
-        services.average_over_intervals(intervals, referent_data, compared_data, configuration)
+    with instrumentation.stage('average_over_intervals') as record:
+        ref_data_av_intervals, cmp_data_av_intervals = \
+            average_over_intervals(intervals, referent_data, compared_data, configuration)
+        record['items'] = len(ref_data_av_intervals) + sum(len(data) for data in cmp_data_av_intervals)
 
     # In each interval makes an object for each couple - time, referent and compared detector values, ratio,
     # uncertainties
     # Returns a list of datacouples for each ref-cmp detector couple
-    det_couples = []
-    for cmp_data in cmp_data_av_intervals:
-        det_couple = services.join_detector_couple(ref_data_av_intervals, cmp_data)
-        det_couples.append(det_couple)
+    with instrumentation.stage('join_detector_couples') as record:
+        if configuration.data_engine == 'arrays':
+            det_couples = array_services.join_detector_couples_arrays(ref_data_av_intervals, cmp_data_av_intervals)
+        else:
+            det_couples = []
+            for cmp_data in cmp_data_av_intervals:
+                det_couple = services.join_detector_couple(ref_data_av_intervals, cmp_data)
+                det_couples.append(det_couple)
+        record['items'] = sum(len(det_couple) for det_couple in det_couples)
 
     # Files cannot be overwritten, so an error might arise if the same detector file is written at the same time
     if configuration.save_files:
-        for i in range(0, len(det_couples)):
-            services.save_datacouples_file(det_couples[i], configuration.compared_det_serials[i],
-                                           configuration.compared_value, configuration.unit)
+        with instrumentation.stage('save_datacouples_files', sum(len(det_couple) for det_couple in det_couples)):
+            for i in range(0, len(det_couples)):
+                services.save_datacouples_file(det_couples[i], configuration.compared_det_serials[i],
+                                               configuration.compared_value, configuration.unit)
 
     return referent_data[0], compared_data, ref_data_av_intervals, cmp_data_av_intervals, det_couples
 
@@ -64,6 +79,15 @@ def get_data_separate_files(configuration):
 def manage_data(configuration):
     # If referent and compared data are in separate files, all data is read and filtered and returned for plotting
     if configuration.input_data == 'separate':
+        # With several interval lengths or filter alternatives the files are read once and averaged and fitted
+        # for each length, the filter alternatives are applied to the interval statistics of the length
+        if configuration.interval_sweep or configuration.filter_sweep:
+            return interval_sweep.run_interval_sweep(configuration)
+        # In incremental mode only the data appended to the files since the last run is processed
+        if configuration.incremental:
+            if 'original' in configuration.plots:
+                configuration.plots.remove('original')
+            return incremental.run_incremental(configuration)
         return get_data_separate_files(configuration)
 
     # If pre-saved files for detector couples is used, only the coupled data is read and returned for plotting
@@ -0,0 +1,250 @@
+import datetime
+import re
+
+# Fast replacement of datetime.strptime for the datetime formats used in the detector files
+# Each format is compiled once into a parser - fixed position slicing when all fields are zero padded,
+# else a regex with the same field patterns as strptime
+# Formats with directives not listed below fall back to strptime
+
+# Field patterns as in the strptime implementation (C locale for AM/PM)
+DIRECTIVE_PATTERNS = {
+    'd': r'3[0-1]|[1-2]\d|0[1-9]|[1-9]| [1-9]',
+    'm': r'1[0-2]|0[1-9]|[1-9]',
+    'Y': r'\d\d\d\d',
+    'y': r'\d\d',
+    'H': r'2[0-3]|[0-1]\d|\d',
+    'I': r'1[0-2]|0[1-9]|[1-9]',
+    'M': r'[0-5]\d|\d',
+    'S': r'6[0-1]|[0-5]\d|\d',
+    'p': r'am|pm',
+}
+DIRECTIVE_WIDTHS = {'d': 2, 'm': 2, 'Y': 4, 'y': 2, 'H': 2, 'I': 2, 'M': 2, 'S': 2, 'p': 2}
+DATE_DIRECTIVES = 'dmYy'
+
+SECONDS_PER_DAY = 86400
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+# Epoch timestamps are naive datetimes as int seconds since 1970-01-01
+EPOCH = datetime.datetime(1970, 1, 1)
+SECOND = datetime.timedelta(seconds=1)
+
+_compiled_parsers = {}
+
+
+class DatetimeParser:
+    def __init__(self, datetime_format):
+        self.datetime_format = datetime_format
+        self.directives = []
+        self.fixed_fields = []
+        self.fixed_literals = []
+        self.fixed_length = 0
+        self.regex = None
+        self.date_span = None
+        self.time_fields = []
+        self.time_literals = []
+        # date string -> days since the epoch, shared by all lines of the same day
+        self.date_cache = {}
+
+        tokens = _tokenize(datetime_format)
+        if tokens is None:
+            return
+
+        self.directives = [token[1] for token in tokens if token[0] == 'directive']
+        if len(set(self.directives)) != len(self.directives):
+            self.directives = []
+            return
+
+        pattern = ''
+        position = 0
+        for kind, token in tokens:
+            if kind == 'directive':
+                pattern += f'(?P<{token}>{DIRECTIVE_PATTERNS[token]})'
+                self.fixed_fields.append((token, position, position + DIRECTIVE_WIDTHS[token]))
+                position += DIRECTIVE_WIDTHS[token]
+            else:
+                # whitespace matches any whitespace in the regex, but only itself in the fixed layout
+                pattern += r'\s+' if token.isspace() else re.escape(token)
+                self.fixed_literals.append((position, token))
+                position += len(token)
+        self.regex = re.compile(pattern, re.IGNORECASE)
+
+        self.fixed_length = position
+
+        date_fields = [field for field in self.fixed_fields if field[0] in DATE_DIRECTIVES]
+        if self.fixed_fields and date_fields:
+            self.date_span = (min(field[1] for field in date_fields), max(field[2] for field in date_fields))
+            # fields and literals still checked when the date part is found in the cache
+            self.time_fields = [field for field in self.fixed_fields if field[0] not in DATE_DIRECTIVES]
+            self.time_literals = [literal for literal in self.fixed_literals
+                                  if literal[0] + len(literal[1]) <= self.date_span[0]
+                                  or literal[0] >= self.date_span[1]]
+
+    @property
+    def is_compiled(self):
+        return bool(self.directives)
+
+    def parse(self, date_string):
+        if not self.is_compiled:
+            return datetime.datetime.strptime(date_string, self.datetime_format)
+        year, month, day, hour, minute, second = self._fields(date_string)
+        return datetime.datetime(year, month, day, hour, minute, second)
+
+    # Returns the datetime as int seconds since the epoch, without making a datetime object
+    # The days since the epoch of already seen dates are taken from the cache
+    def parse_epoch(self, date_string):
+        if not self.is_compiled:
+            parsed = datetime.datetime.strptime(date_string, self.datetime_format)
+            return (parsed.toordinal() - EPOCH_ORDINAL) * SECONDS_PER_DAY \
+                + parsed.hour * 3600 + parsed.minute * 60 + parsed.second
+
+        found = None
+        if self.fixed_fields and len(date_string) == self.fixed_length:
+            if self.date_span:
+                days = self.date_cache.get(date_string[self.date_span[0]:self.date_span[1]])
+                if days is not None:
+                    found = self._fixed_match(date_string, self.time_fields, self.time_literals)
+                    if found is not None:
+                        _, _, _, hour, minute, second = _to_fields(found)
+                        return _epoch_seconds(date_string, days, hour, minute, second)
+            found = self._fixed_match(date_string, self.fixed_fields, self.fixed_literals)
+            if found is not None and self.date_span:
+                date_key = date_string[self.date_span[0]:self.date_span[1]]
+                year, month, day, hour, minute, second = _to_fields(found)
+                days = datetime.date(year, month, day).toordinal() - EPOCH_ORDINAL
+                self.date_cache[date_key] = days
+                return _epoch_seconds(date_string, days, hour, minute, second)
+
+        if found is None:
+            match = self.regex.fullmatch(date_string)
+            if not match:
+                raise ValueError(f'time data {date_string!r} does not match format {self.datetime_format!r}')
+            found = match.groupdict()
+
+        year, month, day, hour, minute, second = _to_fields(found)
+        date_key = (found.get('Y'), found.get('y'), found.get('m'), found.get('d'))
+        days = self.date_cache.get(date_key)
+        if days is None:
+            days = datetime.date(year, month, day).toordinal() - EPOCH_ORDINAL
+            self.date_cache[date_key] = days
+
+        return _epoch_seconds(date_string, days, hour, minute, second)
+
+    def _fields(self, date_string):
+        found = None
+        if self.fixed_fields and len(date_string) == self.fixed_length:
+            found = self._fixed_match(date_string, self.fixed_fields, self.fixed_literals)
+        if found is None:
+            match = self.regex.fullmatch(date_string)
+            if not match:
+                raise ValueError(f'time data {date_string!r} does not match format {self.datetime_format!r}')
+            found = match.groupdict()
+
+        return _to_fields(found)
+
+    # Reads the fields at their fixed positions, returns None if the string does not fit the fixed layout
+    @staticmethod
+    def _fixed_match(date_string, fields, literals):
+        for position, literal in literals:
+            if not date_string.startswith(literal, position):
+                return None
+        found = {}
+        for directive, start, end in fields:
+            field = date_string[start:end]
+            if directive == 'p':
+                if field.lower() not in ('am', 'pm'):
+                    return None
+            elif not field.isdigit():
+                return None
+            found[directive] = field
+        if 'I' in found and not 1 <= int(found['I']) <= 12:
+            return None
+        if 'm' in found and not 1 <= int(found['m']) <= 12:
+            return None
+
+        return found
+
+
+def _epoch_seconds(date_string, days, hour, minute, second):
+    if hour > 23 or minute > 59 or second > 59:
+        raise ValueError(f'time data {date_string!r} is out of range')
+    return days * SECONDS_PER_DAY + hour * 3600 + minute * 60 + second
+
+
+# Splits the format into directives and literal text, returns None if a directive is not supported
+def _tokenize(datetime_format):
+    tokens = []
+    literal = ''
+    i = 0
+    while i < len(datetime_format):
+        char = datetime_format[i]
+        if char == '%':
+            if i + 1 >= len(datetime_format):
+                return None
+            directive = datetime_format[i + 1]
+            if directive == '%':
+                literal += '%'
+            elif directive in DIRECTIVE_PATTERNS:
+                if literal:
+                    tokens.extend(_split_whitespace(literal))
+                    literal = ''
+                tokens.append(('directive', directive))
+            else:
+                return None
+            i += 2
+            continue
+        literal += char
+        i += 1
+    if literal:
+        tokens.extend(_split_whitespace(literal))
+
+    return tokens
+
+
+def _split_whitespace(literal):
+    return [('literal', part) for part in re.split(r'(\s+)', literal) if part]
+
+
+# Converts the found fields to year, month, day, hour, minute, second as strptime does
+def _to_fields(found):
+    if 'Y' in found:
+        year = int(found['Y'])
+    elif 'y' in found:
+        year = int(found['y'])
+        year += 2000 if year <= 68 else 1900
+    else:
+        year = 1900
+    month = int(found.get('m', 1))
+    day = int(found.get('d', 1))
+
+    hour = int(found.get('H', 0))
+    if 'I' in found:
+        hour = int(found['I'])
+        ampm = found.get('p', '').lower()
+        if ampm in ('', 'am'):
+            if hour == 12:
+                hour = 0
+        elif hour != 12:
+            hour += 12
+
+    return year, month, day, hour, int(found.get('M', 0)), int(found.get('S', 0))
+
+
+# Returns the compiled parser for the format, formats are compiled once per process
+def get_parser(datetime_format):
+    parser = _compiled_parsers.get(datetime_format)
+    if parser is None:
+        parser = DatetimeParser(datetime_format)
+        _compiled_parsers[datetime_format] = parser
+    return parser
+
+
+def parse_datetime(date_string, datetime_format):
+    return get_parser(datetime_format).parse(date_string)
+
+
+def to_epoch(datetime_value):
+    return (datetime_value - EPOCH) // SECOND
+
+
+def from_epoch(seconds):
+    return EPOCH + datetime.timedelta(seconds=int(seconds))
@@ -0,0 +1,61 @@
+import os
+import re
+
+# Detection of the detector serial numbers while the detector files are parsed
+# The serial is taken from the file name or else from the first lines of the file (header) and the lines
+# which are not data lines, so the files are not read again only to find the serials
+
+# detector serial number format for regex
+RADONEYE_SERIAL = r'PE[0-9]{11}'
+RADONEYE_DATA = r'manual|auto'
+ALPHAGUARD_SERIAL = r'AG[0-9]{4}'
+ALPHAE_SERIAL = r'AE[0-9]{4}'
+RAD7_SERIAL = r'RAD7'
+
+# first lines of a file searched for the serial even if they are data lines
+HEADER_LINES = 50
+
+# Patterns searched for each detector type, the found parts are joined to the serial
+# e.g. for RadonEYE the serial number and the type of data generation (manual or auto)
+DETECTOR_PATTERNS = {
+    'alphaguard': (ALPHAGUARD_SERIAL,),
+    'radoneye': (RADONEYE_SERIAL, RADONEYE_DATA),
+    'alphae': (ALPHAE_SERIAL,),
+    'rad7': (RAD7_SERIAL,),
+}
+
+
+# Adds a new detector type or replaces the patterns of a known type
+def register_detector(detector, *patterns):
+    DETECTOR_PATTERNS[detector.lower()] = tuple(patterns)
+
+
+# Searches the serial patterns of the detector in the file name and in the lines it is fed
+# serial is None for detector types without patterns, else the found parts joined ('' if nothing was found)
+class SerialScanner:
+    def __init__(self, detector, file_path):
+        self.regexes = [re.compile(pattern) for pattern in DETECTOR_PATTERNS.get(detector.lower(), ())]
+        self.found = [None] * len(self.regexes)
+        self.feed(os.path.basename(file_path))
+
+    @property
+    def done(self):
+        return None not in self.found
+
+    def feed(self, line):
+        for i, regex in enumerate(self.regexes):
+            if self.found[i] is None:
+                serial_match = regex.search(line)
+                if serial_match:
+                    self.found[i] = serial_match.group(0)
+
+    @property
+    def serial(self):
+        if not self.regexes:
+            return None
+        return ''.join(found for found in self.found if found)
+
+
+# Serials of the files in the order of the files, an empty list for detector types without patterns
+def file_serials(serials):
+    return [serial for serial in serials if serial is not None]
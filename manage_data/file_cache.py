@@ -0,0 +1,107 @@
+import hashlib
+import os
+import shutil
+
+import numpy as np
+
+# On-disk cache of the parsed detector files
+# Each entry is a folder with the time, value and uncertainty arrays of a whole file as .npy files,
+# loaded by memory-mapping, and the detector serial found in the file
+# The entry name is a hash of the file fingerprint (path, size, modification time and a hash of the first
+# and last bytes) and of the settings used to parse the file, so entries of changed files or settings
+# are never found again and are removed by the LRU eviction
+main_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE_DIRECTORY = os.path.join(main_directory, 'output_files/cache')
+
+# increase when the parsed format changes, so old entries are not used
+CACHE_VERSION = 2
+PARSE_SETTINGS = ('separator', 'encoding', 'datetime_format', 'datetime_index', 'value_index',
+                  'multiplier', 'unc_multiplier', 'shift', 'detector')
+SAMPLE_BYTES = 65536
+COLUMNS = ('times', 'values', 'uncertainties')
+SERIAL_FILE = 'serial.txt'
+
+
+def cache_key(file_path, settings):
+    file_stat = os.stat(file_path)
+    sample_hash = hashlib.sha1()
+    with open(file_path, 'rb') as current_file:
+        sample_hash.update(current_file.read(SAMPLE_BYTES))
+        if file_stat.st_size > SAMPLE_BYTES:
+            current_file.seek(max(file_stat.st_size - SAMPLE_BYTES, SAMPLE_BYTES))
+            sample_hash.update(current_file.read())
+
+    fingerprint = (CACHE_VERSION, os.path.abspath(file_path), file_stat.st_size, file_stat.st_mtime_ns,
+                   sample_hash.hexdigest(), [(name, settings[name]) for name in PARSE_SETTINGS])
+
+    return hashlib.sha1(repr(fingerprint).encode('utf-8')).hexdigest()
+
+
+# Returns the cached (times, values, uncertainties) arrays of the file and its serial or None if it is not cached
+def load(file_path, settings, directory=CACHE_DIRECTORY):
+    entry_path = os.path.join(directory, cache_key(file_path, settings))
+    if not os.path.isdir(entry_path):
+        return None
+    try:
+        columns = tuple(np.load(os.path.join(entry_path, f'{name}.npy'), mmap_mode='r') for name in COLUMNS)
+        serial = None
+        if os.path.exists(os.path.join(entry_path, SERIAL_FILE)):
+            with open(os.path.join(entry_path, SERIAL_FILE), 'r') as serial_file:
+                serial = serial_file.read()
+    except (OSError, ValueError):
+        return None
+
+    # The modification time of the entry is its last use for the LRU eviction
+    os.utime(entry_path)
+    return columns, serial
+
+
+# Saves the arrays and the serial (None if the detector has no serial patterns) of the file
+# and evicts the least recently used entries above max_megabytes
+def store(file_path, settings, columns, serial, max_megabytes, directory=CACHE_DIRECTORY):
+    os.makedirs(directory, exist_ok=True)
+    entry_path = os.path.join(directory, cache_key(file_path, settings))
+
+    # The entry is written to a temporary folder and renamed, so a partly written entry is never loaded
+    temp_path = f'{entry_path}.{os.getpid()}.tmp'
+    os.makedirs(temp_path, exist_ok=True)
+    for name, column in zip(COLUMNS, columns):
+        np.save(os.path.join(temp_path, f'{name}.npy'), np.ascontiguousarray(column))
+    if serial is not None:
+        with open(os.path.join(temp_path, SERIAL_FILE), 'w') as serial_file:
+            serial_file.write(serial)
+    try:
+        os.rename(temp_path, entry_path)
+    except OSError:
+        # the same entry was written meanwhile, e.g. by another worker process
+        shutil.rmtree(temp_path, ignore_errors=True)
+
+    evict(max_megabytes, directory)
+
+
+def evict(max_megabytes, directory=CACHE_DIRECTORY):
+    entries = []
+    for name in os.listdir(directory):
+        entry_path = os.path.join(directory, name)
+        if not os.path.isdir(entry_path) or name.endswith('.tmp'):
+            continue
+        # the entry can be removed meanwhile by the eviction of another worker process
+        try:
+            size = sum(os.path.getsize(os.path.join(entry_path, file_name)) for file_name in os.listdir(entry_path))
+            entries.append((os.path.getmtime(entry_path), size, entry_path))
+        except FileNotFoundError:
+            continue
+
+    total_size = sum(entry[1] for entry in entries)
+    max_size = max_megabytes * 1024 * 1024
+    for _, size, entry_path in sorted(entries):
+        if total_size <= max_size:
+            break
+        shutil.rmtree(entry_path, ignore_errors=True)
+        total_size -= size
+
+
+def clear(directory=CACHE_DIRECTORY):
+    if os.path.isdir(directory):
+        shutil.rmtree(directory, ignore_errors=True)
+
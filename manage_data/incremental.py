@@ -0,0 +1,284 @@
+import codecs
+import hashlib
+import io
+import json
+import math
+import os
+
+import numpy as np
+
+from manage_data import array_services, file_cache, services
+from manage_data.data_classes import TimeSeries
+from manage_data.detector_serials import SerialScanner, file_serials
+from manage_data.datetime_parser import from_epoch, to_epoch
+
+# Incremental processing of detector files which keep growing during a measurement campaign
+# The state of the last run is kept in output_files/cache/incremental - the byte offset and the last time of each
+# file, the points read after the last completed interval, the averaged data and the saved coupled data files
+# Only the bytes appended after the offset are parsed and only the intervals completed by the new data are averaged,
+# the new detector couples are appended to the saved files
+# An interval is completed in a file when the file has a point at or after its end (the closing point of the interval)
+# or data after end_datetime, so it will not change with more data
+# Each file keeps its own next interval - the referent intervals are averaged when the referent file completes them
+# and the intervals of a compared file when both the referent and the compared file complete them, so a compared
+# file which lags or stops does not hold back the couples of the other files
+STATE_DIRECTORY = os.path.join(file_cache.CACHE_DIRECTORY, 'incremental')
+STATE_FILE = 'state.json'
+ARRAYS_FILE = 'arrays.npz'
+
+# increase when the state format changes, so an old state is not used
+STATE_VERSION = 3
+READ_BLOCK_BYTES = 1024 * 1024
+# bytes before the offset checked to find files which were rewritten and not appended to
+CHECK_BYTES = 4096
+SERIES_COLUMNS = ('times', 'values', 'uncertainties')
+AVERAGED_COLUMNS = ('times', 'values', 'uncertainties', 'starts', 'ends')
+
+
+def run_incremental(configuration):
+    if configuration.is_custom_interval:
+        raise ValueError('Incremental mode works only with equidistant intervals - set custom_intervals n')
+    if not configuration.start_time:
+        raise ValueError('Incremental mode needs start_datetime in the config file')
+
+    ref_settings = services.get_read_settings('referent', configuration)
+    cmp_settings = services.get_read_settings('compared', configuration)
+    # as in get_data_separate_files only the first referent file is used
+    ref_path = services.list_data_files(ref_settings['directory'])[0]
+    cmp_paths = services.list_data_files(cmp_settings['directory'])
+    file_settings = [(ref_path, ref_settings)] + [(path, cmp_settings) for path in cmp_paths]
+
+    start = to_epoch(configuration.start_time)
+    interval_len = configuration.interval * 60
+    end = to_epoch(configuration.end_time) if configuration.end_time else None
+
+    state, arrays = load_state(state_fingerprint(configuration, file_settings))
+    if not all(file_unchanged(path, state['files'].get(path)) for path, _ in file_settings):
+        state, arrays = new_state(state['fingerprint'])
+
+    series = []
+    for i, (path, settings) in enumerate(file_settings):
+        file_state = state['files'].setdefault(path, {'offset': 0, 'last_time': None, 'past_end': False,
+                                                      'serial': None, 'next_interval': 0})
+        pending = TimeSeries(*[arrays.get(f'pending_{i}_{name}', []) for name in SERIES_COLUMNS])
+        resume_time = start + file_state['next_interval'] * interval_len
+        series.append(read_appended(path, settings, file_state, pending, resume_time, end))
+
+    # Referent intervals completed since the last run
+    interval_count = max(math.ceil((end - start) / interval_len), 0) if end is not None else None
+    ref_state = state['files'][ref_path]
+    ref_completed = max(completed_intervals(ref_state, start, interval_len, interval_count),
+                        ref_state['next_interval'])
+    starts = start + np.arange(ref_state['next_interval'], ref_completed) * interval_len
+    ref_av = array_services.average_series(starts, starts + interval_len, series[0], configuration, 'referent')
+    ref_av_all = join_series(averaged_series(arrays, 'ref_av'), ref_av)
+    ref_state['next_interval'] = ref_completed
+
+    # Intervals of each compared file completed since its last run, averaged over the kept referent intervals
+    cmp_av = []
+    new_couples = []
+    for i, path in enumerate(cmp_paths):
+        file_state = state['files'][path]
+        completed = max(min(completed_intervals(file_state, start, interval_len, interval_count), ref_completed),
+                        file_state['next_interval'])
+        first, last = np.searchsorted(ref_av_all.starts, start + np.array([file_state['next_interval'], completed])
+                                      * interval_len)
+        ref_intervals = ref_av_all[first:last]
+        cmp_av.append(array_services.average_series(ref_intervals.starts, ref_intervals.ends, series[i + 1],
+                                                    configuration, 'compared'))
+        new_couples.append(array_services.join_detector_couples_arrays(ref_intervals, [cmp_av[i]])[0])
+        file_state['next_interval'] = completed
+
+    # Averaged data of all runs, returned for plotting
+    cmp_av_all = [join_series(averaged_series(arrays, f'cmp_av_{i}'), data) for i, data in enumerate(cmp_av)]
+    det_couples = array_services.join_detector_couples_arrays(ref_av_all, cmp_av_all)
+
+    # The serials are found when the files are read from the start and kept in the state
+    serials = [state['files'][path]['serial'] for path, _ in file_settings]
+    services.set_detector_serials(configuration, file_serials(serials[:1]), file_serials(serials[1:]))
+
+    # The couples are appended to the saved file of each couple, if the file is missing it is saved again
+    if configuration.save_files:
+        for i, path in enumerate(cmp_paths):
+            output_path = state['outputs'].get(path)
+            if output_path and os.path.exists(output_path):
+                services.append_datacouples_file(new_couples[i], output_path)
+            else:
+                state['outputs'][path] = \
+                    services.save_datacouples_file(det_couples[i], configuration.compared_det_serials[i],
+                                                   configuration.compared_value, configuration.unit)
+
+    # Points from the first not completed interval of each file on are kept for the next run
+    new_arrays = {}
+    for i, (data, (path, _)) in enumerate(zip(series, file_settings)):
+        resume_time = start + state['files'][path]['next_interval'] * interval_len
+        kept = data[np.searchsorted(data.times, resume_time, side='left'):]
+        for name in SERIES_COLUMNS:
+            new_arrays[f'pending_{i}_{name}'] = getattr(kept, name)
+    for prefix, data in [('ref_av', ref_av_all)] + [(f'cmp_av_{i}', cmp) for i, cmp in enumerate(cmp_av_all)]:
+        for name in AVERAGED_COLUMNS:
+            new_arrays[f'{prefix}_{name}'] = getattr(data, name)
+    for path, _ in file_settings:
+        state['files'][path]['check'] = check_hash(path, state['files'][path]['offset'])
+    save_state(state, new_arrays)
+
+    return [], [], ref_av_all, cmp_av_all, det_couples
+
+
+# Reads the lines appended to the file after the offset in the file state and adds them to the pending points
+# Returns the points at or after resume_time sorted by time, the file state gets the new offset and last time
+# and the detector serial if the file is read from the start
+def read_appended(file_path, settings, file_state, pending, resume_time, end_time):
+    scanner = SerialScanner(settings['detector'], file_path) if file_state['offset'] == 0 else None
+    time_chunks = [pending.times]
+    value_chunks = [pending.values]
+    unc_chunks = [pending.uncertainties]
+
+    for text, offset in iter_appended_text(file_path, file_state['offset'], settings['encoding']):
+        lines = io.StringIO(text, newline=None)
+        for chunk in services.iter_line_records(lines, settings, from_epoch(resume_time), epoch=True,
+                                                scanner=scanner):
+            times, values, uncertainties = zip(*chunk)
+            time_chunks.append(np.array(times, dtype=np.int64))
+            value_chunks.append(np.array(values, dtype=np.float64))
+            unc_chunks.append(np.array(uncertainties, dtype=np.float64))
+        file_state['offset'] = offset
+    if scanner:
+        file_state['serial'] = scanner.serial
+
+    times = np.concatenate(time_chunks).astype(np.int64)
+    values = np.concatenate(value_chunks)
+    uncertainties = np.concatenate(unc_chunks)
+
+    # Data after end time is not used, but it shows that the file has all data up to the end time
+    if end_time is not None:
+        before_end = times <= end_time
+        file_state['past_end'] = file_state['past_end'] or not before_end.all()
+        times, values, uncertainties = times[before_end], values[before_end], uncertainties[before_end]
+    if len(times) and (file_state['last_time'] is None or times.max() > file_state['last_time']):
+        file_state['last_time'] = int(times.max())
+
+    order = np.argsort(times, kind='stable')
+    return TimeSeries(times[order], values[order], uncertainties[order])
+
+
+# Yields the text of the complete lines after the offset in blocks, with the file offset after each block
+# A line which is still being written (no line end yet) is left for the next run
+def iter_appended_text(file_path, offset, encoding):
+    continuation = continuation_encoding(file_path, encoding)
+    decoder = codecs.getincrementaldecoder(encoding if offset == 0 else continuation)(errors='ignore')
+    line_end = '\n'.encode(continuation)
+
+    remainder = b''
+    with open(file_path, 'rb') as current_file:
+        current_file.seek(offset)
+        for block in iter(lambda: current_file.read(READ_BLOCK_BYTES), b''):
+            data = remainder + block
+            complete = last_line_end(data, line_end)
+            remainder = data[complete:]
+            if complete:
+                offset += complete
+                yield decoder.decode(data[:complete]), offset
+
+
+# Position after the last line end in the data, line ends of multi-byte encodings must start at a character
+def last_line_end(data, line_end):
+    position = data.rfind(line_end)
+    while position > 0 and position % len(line_end):
+        position = data.rfind(line_end, 0, position + len(line_end) - 1)
+    return position + len(line_end) if position >= 0 else 0
+
+
+# Encoding used to decode a file from the middle, without the byte order mark at the file start
+def continuation_encoding(file_path, encoding):
+    name = codecs.lookup(encoding).name
+    if name == 'utf-8-sig':
+        return 'utf-8'
+    if name == 'utf-16':
+        with open(file_path, 'rb') as current_file:
+            byte_order_mark = current_file.read(2)
+        return 'utf-16-be' if byte_order_mark == codecs.BOM_UTF16_BE else 'utf-16-le'
+    return name
+
+
+# Number of intervals from the start which are completed in the file
+def completed_intervals(file_state, start, interval_len, interval_count):
+    if file_state['past_end'] and interval_count is not None:
+        return interval_count
+    if file_state['last_time'] is None:
+        return 0
+    completed = max((file_state['last_time'] - start) // interval_len, 0)
+    return completed if interval_count is None else min(completed, interval_count)
+
+
+def averaged_series(arrays, prefix):
+    columns = [arrays.get(f'{prefix}_{name}', []) for name in AVERAGED_COLUMNS]
+    return TimeSeries(*columns[:3], starts=columns[3], ends=columns[4])
+
+
+def join_series(first, second):
+    return TimeSeries(*[np.concatenate((getattr(first, name), getattr(second, name))) for name in AVERAGED_COLUMNS])
+
+
+# The state is used only with the same files, start and end time, interval and settings as in the last run
+def state_fingerprint(configuration, file_settings):
+    fingerprint = (STATE_VERSION, configuration.start_time, configuration.end_time, configuration.interval,
+                   [(path, [(name, settings[name]) for name in file_cache.PARSE_SETTINGS])
+                    for path, settings in file_settings],
+                   services.get_estimate_settings(configuration, 'referent'),
+                   services.get_estimate_settings(configuration, 'compared'))
+    return hashlib.sha1(repr(fingerprint).encode('utf-8')).hexdigest()
+
+
+# A file is processed again from the start if it is shorter than the offset or its content before the offset changed
+def file_unchanged(file_path, file_state):
+    if file_state is None:
+        return True
+    if os.path.getsize(file_path) < file_state['offset']:
+        return False
+    return check_hash(file_path, file_state['offset']) == file_state.get('check')
+
+
+def check_hash(file_path, offset):
+    with open(file_path, 'rb') as current_file:
+        current_file.seek(max(offset - CHECK_BYTES, 0))
+        return hashlib.sha1(current_file.read(min(offset, CHECK_BYTES))).hexdigest()
+
+
+def new_state(fingerprint):
+    return {'fingerprint': fingerprint, 'files': {}, 'outputs': {}}, {}
+
+
+# Returns the state and arrays of the last run, or a new state if there is none or it has another fingerprint
+def load_state(fingerprint, directory=STATE_DIRECTORY):
+    try:
+        with open(os.path.join(directory, STATE_FILE), 'r') as state_file:
+            state = json.load(state_file)
+        with np.load(os.path.join(directory, ARRAYS_FILE)) as arrays_file:
+            arrays = {name: arrays_file[name] for name in arrays_file.files}
+    except (OSError, ValueError):
+        return new_state(fingerprint)
+
+    if state.get('fingerprint') != fingerprint:
+        return new_state(fingerprint)
+    return state, arrays
+
+
+# The files are written under temporary names and renamed, so an interrupted run leaves the last complete state
+def save_state(state, arrays, directory=STATE_DIRECTORY):
+    os.makedirs(directory, exist_ok=True)
+    arrays_path = os.path.join(directory, ARRAYS_FILE)
+    state_path = os.path.join(directory, STATE_FILE)
+
+    np.savez(f'{arrays_path}.tmp.npz', **arrays)
+    with open(f'{state_path}.tmp', 'w') as state_file:
+        json.dump(state, state_file)
+    os.replace(f'{arrays_path}.tmp.npz', arrays_path)
+    os.replace(f'{state_path}.tmp', state_path)
+
+
+def clear(directory=STATE_DIRECTORY):
+    for name in (STATE_FILE, ARRAYS_FILE):
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,122 @@
+import datetime
+import os
+import sys
+import time
+
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Optional instrumentation of a run - wall time, CPU time, peak memory and item counts of each stage
+# and counters (e.g. lines read and rejected, intervals dropped by each filter)
+# Enabled by instrumentation in the config file or the environment variable RADON_INSTRUMENTATION=1
+# The report is saved in output_files/plots next to exception.log
+# Without instrumentation the stages and counters are not recorded, so the run is not slowed down
+
+ENVIRONMENT_VARIABLE = 'RADON_INSTRUMENTATION'
+main_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPORT_DIRECTORY = os.path.join(main_directory, 'output_files/plots')
+
+_enabled = False
+_stages = []
+_counters = {}
+
+
+# Enables the instrumentation if enabled (config file) or the environment variable is set
+def enable(enabled=True):
+    global _enabled
+    _enabled = enabled or os.environ.get(ENVIRONMENT_VARIABLE, '').lower() in ('1', 'y', 'yes', 'true')
+
+
+def is_enabled():
+    return _enabled
+
+
+# Peak resident memory of the process so far in MB, None if not available (e.g. on Windows)
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+# CPU time of the process and of its finished child processes (e.g. the file reading workers)
+def cpu_time():
+    if resource is None:
+        return time.process_time()
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.process_time() + children.ru_utime + children.ru_stime
+
+
+# Records a stage of the run, the items (e.g. lines or intervals) can be set in the yielded record
+# e.g. with instrumentation.stage('read_files') as record: ... record['items'] = len(data)
+@contextmanager
+def stage(name, items=None):
+    record = {'stage': name, 'items': items}
+    if not _enabled:
+        yield record
+        return
+
+    start = time.perf_counter()
+    cpu_start = cpu_time()
+    yield record
+    add_stage(name, time.perf_counter() - start, cpu_time() - cpu_start, record['items'])
+
+
+# Adds a stage measured elsewhere (e.g. the plots rendered in worker processes)
+def add_stage(name, wall_time, cpu, items=None):
+    if _enabled:
+        _stages.append({'stage': name, 'wall_time': wall_time, 'cpu_time': cpu, 'peak_rss_mb': peak_rss_mb(),
+                        'items': items})
+
+
+def count(name, amount=1):
+    if _enabled:
+        _counters[name] = _counters.get(name, 0) + int(amount)
+
+
+# Calls the function in a worker process with the instrumentation enabled
+# Returns its result and the counters of the call, which are added in the main process by add_counters
+def counted_call(function, *args):
+    global _counters
+    enable()
+    counters = _counters
+    _counters = {}
+    try:
+        return function(*args), _counters
+    finally:
+        _counters = counters
+
+
+def add_counters(counters):
+    for name, amount in counters.items():
+        count(name, amount)
+
+
+# Saves the stages and counters of the run in output_files/plots and clears them
+# Returns the path of the report, None if the instrumentation is not enabled
+def save_report():
+    if not _enabled:
+        return None
+
+    file_name = f'instrumentation_{datetime.datetime.now().strftime("%y%m%d%H%M%S")}.csv'
+    path = os.path.join(REPORT_DIRECTORY, file_name)
+
+    with open(path, 'w') as current_file:
+        current_file.write('Stage, Wall time (s), CPU time (s), Peak RSS (MB), Items\n')
+        for record in _stages:
+            peak = f'{record["peak_rss_mb"]:.1f}' if record['peak_rss_mb'] is not None else '-'
+            items = record['items'] if record['items'] is not None else '-'
+            current_file.write(f'{record["stage"]}, {record["wall_time"]:.6f}, {record["cpu_time"]:.6f}, '
+                               f'{peak}, {items}\n')
+        current_file.write('\nCounter, Value\n')
+        for name, amount in _counters.items():
+            current_file.write(f'{name}, {amount}\n')
+
+    _stages.clear()
+    _counters.clear()
+    return path
@@ -0,0 +1,230 @@
+import numpy as np
+
+from manage_data import instrumentation
+from manage_data.datetime_parser import to_epoch
+
+
+# Converts a list of Interval objects to arrays of start and end times in epoch seconds
+def interval_bounds(intervals):
+    starts = np.array([to_epoch(interval.start_time) for interval in intervals], dtype=np.int64)
+    ends = np.array([to_epoch(interval.end_time) for interval in intervals], dtype=np.int64)
+    return starts, ends
+
+
+# Converts datetime objects to an int64 array of microseconds since the epoch
+def to_microseconds(datetime_values):
+    return np.array(list(datetime_values), dtype='datetime64[us]').astype(np.int64)
+
+
+# Assigns the sorted times to the intervals with binary search over the interval boundaries
+# Returns the first and last index of the points of each interval and a mask of the non-empty intervals
+# The last point of an interval is the first point at or after its end (or the last point of the data),
+# the same point starts the search for the next interval - as in services.ref_average_intervals
+def bin_intervals(times, starts, ends):
+    starts = np.asarray(starts)
+    ends = np.asarray(ends)
+    count = len(times)
+    if count == 0:
+        empty = np.zeros(len(starts), dtype=np.int64)
+        return empty, empty, np.zeros(len(starts), dtype=bool)
+
+    first_raw = np.searchsorted(times, starts, side='left')
+    last_raw = np.minimum(np.searchsorted(times, ends, side='left'), count - 1)
+
+    # Intervals starting after the last point do not move the search
+    # The search start of each interval is the last point of the previous intervals
+    has_points = first_raw < count
+    search_from = np.maximum.accumulate(np.where(has_points, last_raw, 0))
+    search_from = np.concatenate(([0], search_from[:-1]))
+
+    first = np.maximum(search_from, first_raw)
+    last = np.maximum(search_from, last_raw)
+    non_empty = has_points & (last > first)
+
+    return first, last, non_empty
+
+
+# Statistics of the intervals with at least two points (groups are the indexes of these intervals)
+# Computed once, they give the estimates for any thresholds, jumps and background filter and uncertainty type
+# by apply_statistics, without averaging again - only the zeros filter and the averaging type change them
+# value is the average before the background is subtracted, valid marks the intervals where it is defined
+# raw_min and raw_max are None if they were not computed (they are needed only for the jumps filter)
+class IntervalStatistics:
+    __slots__ = ('interval_count', 'groups', 'raw_count', 'raw_average', 'raw_min', 'raw_max',
+                 'value', 'unc_propagation', 'stdev_av', 'stdev_single', 'valid')
+
+    def __init__(self, interval_count, groups, raw_count, raw_average, raw_min, raw_max,
+                 value, unc_propagation, stdev_av, stdev_single, valid):
+        self.interval_count = interval_count
+        self.groups = groups
+        self.raw_count = raw_count
+        self.raw_average = raw_average
+        self.raw_min = raw_min
+        self.raw_max = raw_max
+        self.value = value
+        self.unc_propagation = unc_propagation
+        self.stdev_av = stdev_av
+        self.stdev_single = stdev_single
+        self.valid = valid
+
+    @classmethod
+    def empty(cls, interval_count):
+        nothing = np.empty(0)
+        return cls(interval_count, np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), nothing, nothing,
+                   nothing, nothing, nothing, nothing, nothing, np.empty(0, dtype=bool))
+
+
+# Batched version of services.estimate_value for all intervals at once
+# times, values and uncertainties are the sorted data, first and last are the point offsets from bin_intervals
+# units_per_minute converts the time unit to minutes - 60 for epoch seconds
+# Returns the estimated value, its uncertainty and a mask of the intervals that were not cleared
+# Intervals with no values left after the filters are cleared, as by estimate_value
+def estimate_values(times, values, uncertainties, starts, ends, first, last, settings, units_per_minute=60):
+    statistics = interval_statistics(times, values, uncertainties, starts, ends, first, last,
+                                     'zeros' in settings['clearing'], settings['averaging'],
+                                     settings['interval_len'], units_per_minute)
+    return apply_statistics(statistics, settings)
+
+
+# Computes the IntervalStatistics of all intervals, skip_zeros is the zeros filter of clear_data
+def interval_statistics(times, values, uncertainties, starts, ends, first, last, skip_zeros, averaging,
+                        interval_len, units_per_minute=60):
+    interval_count = len(starts)
+    groups = np.flatnonzero(last > first)
+    if len(groups) == 0:
+        return IntervalStatistics.empty(interval_count)
+
+    # Flat array of the points of all intervals - the closing point of an interval can start the next one
+    lengths = last[groups] - first[groups] + 1
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    closing = offsets + lengths - 1
+    total = int(lengths.sum())
+    flat_index = np.repeat(first[groups] - offsets, lengths) + np.arange(total)
+    segment = np.repeat(np.arange(len(groups)), lengths)
+    t = times[flat_index]
+    v = values[flat_index].astype(np.float64)
+    u = uncertainties[flat_index].astype(np.float64)
+
+    # Raw values for the filters - zero filter, thresholds, jumps (intervals with sharp changes in value)
+    if skip_zeros:
+        raw_mask = v > 0
+    else:
+        raw_mask = np.ones(total, dtype=bool)
+    raw_count = np.add.reduceat(raw_mask.astype(np.int64), offsets)
+    raw_max = np.maximum.reduceat(np.where(raw_mask, v, -np.inf), offsets)
+    raw_min = np.minimum.reduceat(np.where(raw_mask, v, np.inf), offsets)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        raw_average = np.add.reduceat(np.where(raw_mask, v, 0.0), offsets) / raw_count
+        if averaging == 'inside':
+            value, unc_propagation, stdev_av, stdev_single = \
+                _inside_statistics(v, u, raw_mask, raw_count, offsets, closing, segment, total)
+            valid = raw_count > 1
+        else:
+            value, unc_propagation, stdev_av, stdev_single, weight_sum = \
+                _weighted_statistics(t, v, u, starts[groups], ends[groups], offsets, closing, lengths, segment,
+                                     interval_len, units_per_minute)
+            valid = (raw_count > 0) & (weight_sum != 0)
+
+    return IntervalStatistics(interval_count, groups, raw_count, raw_average, raw_min, raw_max,
+                              value, unc_propagation, stdev_av, stdev_single, valid)
+
+
+# Applies the thresholds and the jumps filter of the settings to the statistics and selects the estimates
+# The statistics should be computed with the zeros filter and averaging type of the same settings
+def apply_statistics(statistics, settings):
+    with np.errstate(invalid='ignore'):
+        outside = (statistics.raw_average < settings['min_threshold']) \
+            | (statistics.raw_average > settings['max_threshold'])
+        instrumentation.count('intervals_dropped_thresholds', np.count_nonzero(statistics.valid & outside))
+        keep = statistics.valid & ~outside
+        if 'jumps' in settings['clearing']:
+            jumps = statistics.raw_max - statistics.raw_min > statistics.raw_average
+            instrumentation.count('intervals_dropped_jumps', np.count_nonzero(keep & jumps))
+            keep &= ~jumps
+
+    return select_estimates(statistics.value, statistics.unc_propagation, statistics.stdev_av,
+                            statistics.stdev_single, keep, statistics.groups, statistics.interval_count, settings)
+
+
+# Subtracts the background, applies the background filter and chooses the specified uncertainty
+# for the averages of the interval groups, returns the results for all intervals as estimate_values
+def select_estimates(value, unc_propagation, stdev_av, stdev_single, keep, groups, interval_count, settings):
+    value = value - settings['background']
+
+    # Removing negative values and applying background filter
+    value = np.where(value < 0, 0.0, value)
+    if 'bgn' in settings['clearing']:
+        below_background = value < 3 * settings['background_unc']
+        instrumentation.count('intervals_dropped_bgn', np.count_nonzero(keep & below_background))
+        keep &= ~below_background
+
+    # Chooses the specified uncertainty
+    background_unc = settings['background_unc']
+    uncertainty_type = settings['uncertainty_type']
+    with np.errstate(invalid='ignore'):
+        if uncertainty_type == 'stdevav':
+            value_unc = np.sqrt((stdev_av ** 2) + (background_unc ** 2))
+        elif uncertainty_type == 'stdev':
+            value_unc = np.sqrt((stdev_single ** 2) + (background_unc ** 2))
+        elif uncertainty_type == 'propagation':
+            value_unc = np.sqrt((unc_propagation ** 2) + (background_unc ** 2))
+        elif uncertainty_type == 'max':
+            value_unc = np.sqrt((np.maximum(stdev_av, unc_propagation) ** 2) + (background_unc ** 2))
+        else:
+            value_unc = np.zeros(len(groups))
+
+    estimated = np.full(interval_count, np.nan)
+    estimated_unc = np.full(interval_count, np.nan)
+    keep_all = np.zeros(interval_count, dtype=bool)
+    kept = groups[keep]
+    estimated[kept] = value[keep]
+    estimated_unc[kept] = value_unc[keep]
+    keep_all[kept] = True
+
+    return estimated, estimated_unc, keep_all
+
+
+# 'inside' average - the closing point and the last of the raw values are left out, as in estimate_value
+def _inside_statistics(v, u, raw_mask, raw_count, offsets, closing, segment, total):
+    position = np.arange(total)
+    last_raw = np.maximum.reduceat(np.where(raw_mask, position, -1), offsets)
+    in_average = raw_mask.copy()
+    in_average[last_raw[last_raw >= 0]] = False
+    not_closing = np.ones(total, dtype=bool)
+    not_closing[closing] = False
+
+    count = raw_count - 1
+    value = np.add.reduceat(np.where(in_average, v, 0.0), offsets) / count
+    unc_propagation = np.sqrt(np.add.reduceat(np.where(not_closing, u ** 2, 0.0), offsets)) / count
+    squared_deviations = np.where(in_average, (v - value[segment]) ** 2, 0.0)
+    stdev_single = np.where(count > 1, np.sqrt(np.add.reduceat(squared_deviations, offsets) / (count - 1)), 0.0)
+    stdev_av = stdev_single / np.sqrt(count)
+
+    return value, unc_propagation, stdev_av, stdev_single
+
+
+# 'weighted' average - each value is weighted by the time since the previous point (or the interval start),
+# the closing point is weighted by the time from the previous point to the interval end
+# and replaced by the previous point if it is more than interval_len minutes after the end
+def _weighted_statistics(t, v, u, starts, ends, offsets, closing, lengths, segment, interval_len, units_per_minute):
+    current = t.copy()
+    current[closing] = ends
+    previous = np.empty_like(t)
+    previous[1:] = t[:-1]
+    previous[offsets] = starts
+    weights = (current - previous) / units_per_minute
+
+    is_late = (t[closing] - ends) / units_per_minute > interval_len
+    late_closing = closing[is_late]
+    v[late_closing] = v[late_closing - 1]
+    u[late_closing] = u[late_closing - 1]
+
+    weight_sum = np.add.reduceat(weights, offsets)
+    value = np.add.reduceat(weights * v, offsets) / weight_sum
+    unc_propagation = np.sqrt(np.add.reduceat((weights * u) ** 2, offsets)) / weight_sum
+    stdev_sum = np.add.reduceat(weights * (v - value[segment]) ** 2, offsets)
+    stdev_av = np.sqrt(stdev_sum / ((lengths - 1) * weight_sum))
+    stdev_single = stdev_av * np.sqrt(lengths)
+
+    return value, unc_propagation, stdev_av, stdev_single, weight_sum
@@ -0,0 +1,201 @@
+import math
+
+import numpy as np
+
+import fit_engine
+from manage_data import array_services, interval_engine, services
+from manage_data.datetime_parser import from_epoch, to_epoch
+from manage_data.prefix_index import PrefixIndex
+
+# Interval sweep - the data is averaged, joined and fitted for several interval lengths (interval_min in the config)
+# and filter alternatives (filter_sweep_clear, filter_sweep_thresholds and filter_sweep_unc in the config)
+# A filter sweep with a single length also works with custom intervals, a sweep of lengths needs equidistant intervals
+# The files are read once, with prefix_index in the config file a PrefixIndex of each file is reused for all lengths
+# The statistics of the intervals of a length are computed once (for each zeros filter) and the thresholds,
+# the jumps and background filters and the uncertainty type of each alternative are applied as masks
+# The fit parameters for each length, filter alternative and detector couple are saved in one file
+# in output_files/fits_data
+# The data of the first length with the configured filters is saved and returned for plotting
+# as in a run with a single length
+
+def run_interval_sweep(configuration):
+    if configuration.is_custom_interval and configuration.interval_sweep:
+        raise ValueError('The sweep of interval lengths works only with equidistant intervals - '
+                         'set custom_intervals n or a single interval_min')
+    if configuration.incremental:
+        raise ValueError('The sweep cannot be used in incremental mode - set incremental n')
+
+    # For custom intervals start and end time are set as the start and end the union of all intervals
+    custom_bounds = None
+    if configuration.is_custom_interval:
+        custom_intervals = services.prepare_intervals(configuration)
+        configuration.start_time = custom_intervals[0].start_time
+        configuration.end_time = custom_intervals[len(custom_intervals) - 1].end_time
+        custom_bounds = interval_engine.interval_bounds(custom_intervals)
+
+    referent_data, referent_serials = array_services.read_files_arrays('referent', configuration)
+    if len(referent_data[0]) == 0:
+        raise Exception('Check referent detector configuration - indexes, separator or encoding')
+
+    # if not set in configuration start and end time are set as start and end of the referent_data
+    if not configuration.start_time:
+        configuration.start_time = from_epoch(referent_data[0].times[0])
+    if not configuration.end_time:
+        configuration.end_time = from_epoch(referent_data[0].times[-1])
+
+    compared_data, compared_serials = array_services.read_files_arrays('compared', configuration)
+    if len(compared_data[0]) == 0:
+        raise Exception('Check compared detector configuration - indexes, separator or encoding')
+
+    services.set_detector_serials(configuration, referent_serials, compared_serials)
+
+    ref_settings = services.get_estimate_settings(configuration, 'referent')
+    cmp_settings = services.get_estimate_settings(configuration, 'compared')
+    variants = filter_variants(configuration)
+    # The zeros filter changes the statistics, so they are computed (and an index is built) for each zeros filter
+    # of the alternatives
+    zeros_filters = sorted({'zeros' in clearing for clearing, _, _ in variants})
+    with_range = any('jumps' in clearing for clearing, _, _ in variants)
+    ref_indexes = {skip_zeros: series_index(referent_data[0], zeros_settings(ref_settings, skip_zeros), configuration)
+                   for skip_zeros in zeros_filters}
+    cmp_indexes = {skip_zeros: [series_index(data, zeros_settings(cmp_settings, skip_zeros), configuration)
+                                for data in compared_data]
+                   for skip_zeros in zeros_filters}
+
+    results = []
+    param_file_lines = [sweep_header(configuration)]
+    for interval in configuration.intervals:
+        if custom_bounds is None:
+            starts, ends = interval_bounds(configuration.start_time, configuration.end_time, interval)
+        else:
+            starts, ends = custom_bounds
+        ref_statistics = {skip_zeros: series_statistics(starts, ends, referent_data[0], index, ref_settings,
+                                                        skip_zeros, with_range)
+                          for skip_zeros, index in ref_indexes.items()}
+        cmp_statistics = {skip_zeros: [series_statistics(starts, ends, data, index, cmp_settings, skip_zeros,
+                                                         with_range)
+                                       for data, index in zip(compared_data, indexes)]
+                          for skip_zeros, indexes in cmp_indexes.items()}
+
+        for variant in variants:
+            ref_variant = variant_settings(ref_settings, variant, 0)
+            cmp_variant = variant_settings(cmp_settings, variant, 2)
+            values, uncertainties, keep = \
+                interval_engine.apply_statistics(ref_statistics['zeros' in variant[0]], ref_variant)
+            ref_av = array_services.kept_series(starts, ends, values, uncertainties, keep)
+            # The intervals are not overlapping, so the compared data is averaged over the kept referent intervals
+            # by keeping only these intervals of the compared statistics
+            cmp_av = []
+            for statistics in cmp_statistics['zeros' in variant[0]]:
+                values, uncertainties, cmp_keep = interval_engine.apply_statistics(statistics, cmp_variant)
+                cmp_av.append(array_services.kept_series(starts, ends, values, uncertainties, keep & cmp_keep))
+            det_couples = array_services.join_detector_couples_arrays(ref_av, cmp_av)
+            if not results:
+                results.append((ref_av, cmp_av, det_couples))
+
+            linear_fits = fit_engine.linear_couple_fits(det_couples)
+            york_fits = fit_engine.york_couple_fits(det_couples)
+            ratio_fits = [fit_engine.ratio_couple_fits(det_couples, detector_type, configuration.fit)
+                          for detector_type in ('referent', 'compared')]
+            for i in range(0, len(det_couples)):
+                param_file_lines.append(sweep_line(interval, variant_columns(ref_variant, cmp_variant, variant),
+                                                   configuration.compared_det_serials[i], len(det_couples[i]),
+                                                   (linear_fits[i], york_fits[i], ratio_fits[0][i],
+                                                    ratio_fits[1][i])))
+
+    services.save_sweep_file(param_file_lines)
+
+    ref_av, cmp_av, det_couples = results[0]
+    if configuration.save_files:
+        for i in range(0, len(det_couples)):
+            services.save_datacouples_file(det_couples[i], configuration.compared_det_serials[i],
+                                           configuration.compared_value, configuration.unit)
+
+    return referent_data[0], compared_data, ref_av, cmp_av, det_couples
+
+
+# Filter alternatives as (clearing, thresholds, uncertainty type) - the configured filters are the first,
+# uncertainty type None is the configured type of each detector
+def filter_variants(configuration):
+    clearings = configuration.filter_sweep_clear or [configuration.clear_data]
+    thresholds = configuration.filter_sweep_thresholds or [configuration.value_thresholds]
+    unc_types = configuration.filter_sweep_unc or [None]
+
+    variants = [(list(configuration.clear_data), list(configuration.value_thresholds), None)]
+    for clearing in clearings:
+        for value_thresholds in thresholds:
+            for unc_type in unc_types:
+                variant = (list(clearing), list(value_thresholds), unc_type)
+                if variant not in variants:
+                    variants.append(variant)
+    return variants
+
+
+def zeros_settings(settings, skip_zeros):
+    return dict(settings, clearing=['zeros'] if skip_zeros else [])
+
+
+# Estimate settings of a detector with the filters of the alternative, threshold_index is the index of the
+# minimum threshold of the detector in value_thresholds
+def variant_settings(settings, variant, threshold_index):
+    clearing, thresholds, unc_type = variant
+    return dict(settings, clearing=clearing, min_threshold=thresholds[threshold_index],
+                max_threshold=thresholds[threshold_index + 1],
+                uncertainty_type=unc_type or settings['uncertainty_type'])
+
+
+# PrefixIndex of the series with prefix_index in the config file, else None
+def series_index(series, settings, configuration):
+    return PrefixIndex.from_series(series, settings) if configuration.prefix_index else None
+
+
+# IntervalStatistics of the series from its index or, without an index, summed over the points of each interval
+# as by the batched averaging
+def series_statistics(starts, ends, series, index, settings, skip_zeros, with_range):
+    first, last, _ = interval_engine.bin_intervals(series.times, starts, ends)
+    if index is None:
+        return interval_engine.interval_statistics(series.times, series.values, series.uncertainties, starts, ends,
+                                                   first, last, skip_zeros, settings['averaging'],
+                                                   settings['interval_len'])
+    return index.statistics(starts, ends, first, last, settings['averaging'], settings['interval_len'], with_range)
+
+
+def variant_columns(ref_settings, cmp_settings, variant):
+    clearing, thresholds, _ = variant
+    return f'{" ".join(clearing) or "none"}, {" ".join(str(thr) for thr in thresholds)}, ' \
+           f'{ref_settings["uncertainty_type"]} {cmp_settings["uncertainty_type"]}'
+
+
+# Start and end epoch seconds of the equidistant intervals from start to end time, as in prepare_intervals
+def interval_bounds(start_time, end_time, interval):
+    start = to_epoch(start_time)
+    interval_len = interval * 60
+    count = max(math.ceil((to_epoch(end_time) - start) / interval_len), 0)
+    starts = start + (np.arange(count) * interval_len).astype(np.int64)
+    return starts, starts + int(interval_len)
+
+
+def sweep_header(configuration):
+    value = configuration.compared_value
+    unit = configuration.unit
+    ratio_columns = 'a, a uncertainty, b, b uncertainty, chi-squared, degrees of freedom, p-value, iterations, ' \
+                    'converged'
+    return f'Interval (min), Clear data, Thresholds, Uncertainty type, Referent detector, Compared detector, ' \
+           f'Couples, ' \
+           f'Linear a, Linear a uncertainty, Linear b ({unit}), Linear b uncertainty ({unit}), ' \
+           f'Linear chi-squared, Linear degrees of freedom, Linear p-value, ' \
+           f'York a, York a uncertainty, York b ({unit}), York b uncertainty ({unit}), ' \
+           f'York chi-squared, York degrees of freedom, York p-value, York iterations, ' \
+           + ', '.join(f'Ratio versus {detector} {value} {configuration.fit} {column}'
+                       for detector in ('referent', 'compared') for column in ratio_columns.split(', ')) + '\n'
+
+
+# Fit parameters of one detector couple, fits which fail (e.g. too few couples) are written as -
+# fits are the results of the batched linear, York and ratio (versus referent and compared) fits of the couple
+def sweep_line(interval, filters, detector_couple, couple_count, fits):
+    linear_fit, york_fit, ratio_ref_fit, ratio_cmp_fit = fits
+    line = f'{interval:g}, {filters}, {detector_couple[0]}, {detector_couple[1]}, {couple_count}'
+    line += ', ' + fit_engine.fit_columns(linear_fit) + ', ' + fit_engine.fit_columns(york_fit, 8)
+    line += ', ' + fit_engine.fit_columns(ratio_ref_fit, 9) + ', ' + fit_engine.fit_columns(ratio_cmp_fit, 9)
+
+    return line + '\n'
@@ -0,0 +1,111 @@
+import datetime
+
+from manage_data import services
+from manage_data.accumulators import IntervalAccumulator
+from manage_data.data_classes import Interval
+
+# Live averaging of readings which arrive one at a time (e.g. from detector gateways, see live_service.py)
+# The intervals are equidistant from start_datetime of the config file, as in services.prepare_intervals
+# The readings of each detector are added to an IntervalAccumulator of the interval they fall in, the interval is
+# completed by the first reading at or after its end (the closing point, as in services.ref_average_intervals)
+# and is estimated with the settings of the referent or compared detector as by services.estimate_value
+# Only the statistics of the interval being filled are kept, not its readings
+# The datapoints of the referent and a compared detector for the same interval are joined to a Datacouple
+# as in services.join_detector_couple
+# The readings of a detector are expected in time order, earlier readings are rejected
+
+# Completed datapoints waiting for the other detector of the couple are kept for this many intervals
+PENDING_INTERVALS = 1000
+
+
+class LiveAverager:
+    def __init__(self, configuration, referent):
+        self.configuration = configuration
+        self.referent = referent
+        self.start_time = configuration.start_time or datetime.datetime(1970, 1, 1)
+        self.interval_len = datetime.timedelta(minutes=configuration.interval)
+        self.settings = {det_type: services.get_read_settings(det_type, configuration)
+                         for det_type in ('referent', 'compared')}
+        self.estimate_settings = {det_type: services.get_estimate_settings(configuration, det_type)
+                                  for det_type in ('referent', 'compared')}
+        # detector: index and accumulator of the interval being filled
+        self.readings = {}
+        # completed datapoints by interval index, the compared ones until the referent datapoint is completed
+        self.referent_points = {}
+        self.compared_points = {}
+        self.pruned_before = 0
+
+    # Adds a reading, the values are multiplied and the time shifted as the values read from the detector files
+    # Returns the events of the intervals completed by the reading - ('datapoint', detector, Datapoint)
+    # and ('datacouple', (referent, compared detector), Datacouple)
+    # Raises ValueError for a reading before start_datetime or before the last reading of the detector
+    def add_reading(self, detector, meas_time, value, value_unc=None):
+        det_type = 'referent' if detector == self.referent else 'compared'
+        settings = self.settings[det_type]
+        meas_time += datetime.timedelta(hours=settings['shift'])
+        if meas_time < self.start_time:
+            raise ValueError(f'Reading before start time {self.start_time}')
+
+        value *= settings['multiplier']
+        value_unc = value_unc * settings['unc_multiplier'] if value_unc else 0.0
+        index = (meas_time - self.start_time) // self.interval_len
+
+        events = []
+        if detector in self.readings:
+            current_index, accumulator = self.readings[detector]
+            if meas_time < accumulator.last[0]:
+                raise ValueError(f'Reading before the last reading of {detector}')
+            accumulator.add(meas_time, value, value_unc)
+            if index == current_index:
+                return events
+            # The reading closes the interval and is the first reading of its own interval
+            events = self.complete_interval(detector, det_type, current_index, accumulator)
+
+        start_time = self.start_time + index * self.interval_len
+        accumulator = IntervalAccumulator(Interval(start_time, start_time + self.interval_len),
+                                          self.estimate_settings[det_type])
+        accumulator.add(meas_time, value, value_unc)
+        self.readings[detector] = (index, accumulator)
+        return events
+
+    # Completes the interval being filled when the detector stops sending readings, its last reading is used as
+    # the closing point as at the end of a detector file, returns the events
+    def close_detector(self, detector):
+        if detector not in self.readings:
+            return []
+        index, accumulator = self.readings.pop(detector)
+        det_type = 'referent' if detector == self.referent else 'compared'
+        return self.complete_interval(detector, det_type, index, accumulator)
+
+    # Estimates the completed interval, returns the events
+    def complete_interval(self, detector, det_type, index, accumulator):
+        datapoint = accumulator.estimate()
+        if datapoint is None:
+            return []
+
+        events = [('datapoint', detector, datapoint)]
+        if det_type == 'referent':
+            self.referent_points[index] = datapoint
+            for compared, points in self.compared_points.items():
+                if index in points:
+                    events.append(self.couple_event(compared, datapoint, points.pop(index)))
+        elif index in self.referent_points:
+            events.append(self.couple_event(detector, self.referent_points[index], datapoint))
+        else:
+            self.compared_points.setdefault(detector, {})[index] = datapoint
+        self.prune(index - PENDING_INTERVALS)
+        return events
+
+    def couple_event(self, compared, ref_datapoint, cmp_datapoint):
+        return 'datacouple', (self.referent, compared), \
+            services.join_detector_couple([ref_datapoint], [cmp_datapoint])[0]
+
+    # Removes the completed datapoints of the intervals before the oldest kept interval
+    # The datapoints are checked once for each new oldest interval, not for each completed interval
+    def prune(self, oldest):
+        if oldest <= self.pruned_before:
+            return
+        self.pruned_before = oldest
+        for points in [self.referent_points] + list(self.compared_points.values()):
+            for index in [index for index in points if index < oldest]:
+                del points[index]
@@ -0,0 +1,300 @@
+import numpy as np
+
+from manage_data import interval_engine
+
+# Cumulative (prefix) sums over a sorted raw series, so the estimate of any interval is found in constant time
+# after the points of the interval are found by binary search
+# The index is built once per series and detector settings, and can be used for any set of intervals,
+# e.g. custom intervals or several interval lengths
+# The sums restart in each block of BLOCK_POINTS points and the blocks are summed again, so the sum over an interval
+# is not a difference of two large sums over the whole series, which loses precision on long series
+# For the squared deviations each block is centred on its own mean and the blocks covered by an interval are
+# combined with the parallel variance formula, an interval whose round-off error bound is above RELATIVE_PRECISION
+# of its squared deviations (e.g. in a block with very different levels) is summed directly by interval_engine
+# The sums of squared uncertainties can differ from the direct sums by round-off of the sums in their blocks
+# (below 1e-7 relative on a year of one minute readings with very different daily levels, see
+# benchmarks/prefix_precision.py)
+#
+# For the 'weighted' average the weight of a point inside an interval is the time since the previous point,
+# only the first point (time since the interval start) and the closing point (time from the previous point
+# to the interval end) have interval-specific weights, so the inner part of each sum is a difference of prefix sums
+
+# Points in a block of the centred sums
+BLOCK_POINTS = 256
+# Intervals whose squared deviations may have a larger relative round-off error (e.g. a block with very different
+# levels) are summed directly over their points by interval_engine
+RELATIVE_PRECISION = 1e-8
+EPSILON = np.finfo(np.float64).eps
+
+
+class PrefixIndex:
+    def __init__(self, times, values, uncertainties, settings, units_per_minute=60):
+        self.times = np.asarray(times)
+        self.values = np.asarray(values, dtype=np.float64)
+        self.uncertainties = np.asarray(uncertainties, dtype=np.float64)
+        self.units_per_minute = units_per_minute
+        self.skip_zeros = 'zeros' in settings['clearing']
+        self._range_tables = None
+
+        self.raw_mask = self.values > 0 if self.skip_zeros else np.ones(len(self.values), dtype=bool)
+
+        # Sums of the raw values (zeros are left out with the zeros filter) for the filters and 'inside' average
+        self.raw_count = _prefix(self.raw_mask.astype(np.int64))
+        self.raw_sum = _prefix(np.where(self.raw_mask, self.values, 0.0))
+        self.raw_moments = _BlockMoments(self.values, self.raw_mask.astype(np.float64))
+        self.unc_squares = _BlockSums(self.uncertainties ** 2)
+        positions = np.arange(len(self.values))
+        self.last_raw = np.maximum.accumulate(np.where(self.raw_mask, positions, -1)) if len(positions) \
+            else positions
+
+        # Sums weighted by the time since the previous point for the 'weighted' average
+        gaps = np.zeros(len(self.values))
+        gaps[1:] = np.diff(self.times) / units_per_minute
+        self.weighted_moments = _BlockMoments(self.values, gaps)
+        self.weighted_unc = _BlockSums((gaps * self.uncertainties) ** 2)
+
+    @classmethod
+    def from_series(cls, series, settings):
+        return cls(series.times, series.values, series.uncertainties, settings)
+
+    # Same result as interval_engine.estimate_values for the intervals with the point offsets from bin_intervals
+    def estimate(self, starts, ends, first, last, settings):
+        statistics = self.statistics(starts, ends, first, last, settings['averaging'], settings['interval_len'],
+                                     'jumps' in settings['clearing'])
+        return interval_engine.apply_statistics(statistics, settings)
+
+    # interval_engine.IntervalStatistics of the intervals, for the zeros filter of the index
+    # The minimum and maximum of the raw values are found only with with_range (for the jumps filter)
+    def statistics(self, starts, ends, first, last, averaging, interval_len, with_range=True):
+        interval_count = len(starts)
+        groups = np.flatnonzero(last > first)
+        if len(groups) == 0:
+            return interval_engine.IntervalStatistics.empty(interval_count)
+
+        first = first[groups]
+        last = last[groups]
+        raw_count = self.raw_count[last + 1] - self.raw_count[first]
+        raw_sum = self.raw_sum[last + 1] - self.raw_sum[first]
+        raw_max, raw_min = self.range_max_min(first, last) if with_range else (None, None)
+        starts = np.asarray(starts)[groups]
+        ends = np.asarray(ends)[groups]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            raw_average = raw_sum / raw_count
+            if averaging == 'inside':
+                value, unc_propagation, stdev_av, stdev_single, imprecise = \
+                    self._inside_statistics(first, last, raw_count)
+                valid = raw_count > 1
+            else:
+                value, unc_propagation, stdev_av, stdev_single, imprecise = \
+                    self._weighted_statistics(starts, ends, first, last, interval_len)
+                valid = (raw_count > 0) & (ends != starts)
+
+        # The intervals where the sums may have lost precision are summed directly
+        imprecise = np.flatnonzero(imprecise & valid)
+        if len(imprecise):
+            direct = interval_engine.interval_statistics(
+                self.times, self.values, self.uncertainties, starts[imprecise], ends[imprecise], first[imprecise],
+                last[imprecise], self.skip_zeros, averaging, interval_len, self.units_per_minute)
+            value[imprecise] = direct.value
+            unc_propagation[imprecise] = direct.unc_propagation
+            stdev_av[imprecise] = direct.stdev_av
+            stdev_single[imprecise] = direct.stdev_single
+
+        return interval_engine.IntervalStatistics(interval_count, groups, raw_count, raw_average, raw_min, raw_max,
+                                                  value, unc_propagation, stdev_av, stdev_single, valid)
+
+    # 'inside' average - the closing point and the last of the raw values are left out, as in estimate_value
+    # so the averaged values are the raw values from the first point to the last raw value (excluded)
+    def _inside_statistics(self, first, last, raw_count):
+        last_raw = self.last_raw[last]
+        count = raw_count - 1
+        _, value, squared_deviations, error = self.raw_moments.moments(first, np.maximum(last_raw, first))
+        unc_propagation = np.sqrt(self.unc_squares.sum(first, last)) / count
+        stdev_single = np.where(count > 1, np.sqrt(squared_deviations / (count - 1)), 0.0)
+        stdev_av = stdev_single / np.sqrt(count)
+
+        return value, unc_propagation, stdev_av, stdev_single, error > RELATIVE_PRECISION * squared_deviations
+
+    # 'weighted' average - the closing point is replaced by the previous point
+    # if it is more than interval_len minutes after the interval end
+    def _weighted_statistics(self, starts, ends, first, last, interval_len):
+        first_weight = (self.times[first] - starts) / self.units_per_minute
+        closing_weight = (ends - self.times[last - 1]) / self.units_per_minute
+        is_late = (self.times[last] - ends) / self.units_per_minute > interval_len
+        closing = np.where(is_late, last - 1, last)
+        # the inner points are the points after the first and before the closing point
+        inner_first = first + 1
+        inner_end = np.maximum(last, inner_first)
+
+        no_deviations = np.zeros(len(first))
+        moments = _combine((first_weight, self.values[first], no_deviations, no_deviations),
+                           self.weighted_moments.moments(inner_first, inner_end))
+        weight_sum, value, stdev_sum, error = _combine(moments, (closing_weight, self.values[closing], no_deviations,
+                                                                 no_deviations))
+        unc_sum = (first_weight * self.uncertainties[first]) ** 2 \
+            + (closing_weight * self.uncertainties[closing]) ** 2 \
+            + self.weighted_unc.sum(inner_first, inner_end)
+
+        lengths = last - first + 1
+        unc_propagation = np.sqrt(unc_sum) / weight_sum
+        stdev_av = np.sqrt(stdev_sum / ((lengths - 1) * weight_sum))
+        stdev_single = stdev_av * np.sqrt(lengths)
+
+        return value, unc_propagation, stdev_av, stdev_single, error > RELATIVE_PRECISION * stdev_sum
+
+    # Maximum and minimum of the raw values between first and last (included) from sparse tables
+    # The tables are built at the first use, only the jumps filter needs them
+    def range_max_min(self, first, last):
+        if self._range_tables is None:
+            self._range_tables = (_sparse_table(np.where(self.raw_mask, self.values, -np.inf), np.maximum),
+                                  _sparse_table(np.where(self.raw_mask, self.values, np.inf), np.minimum))
+        max_table, min_table = self._range_tables
+
+        level = np.log2(last - first + 1).astype(np.int64)
+        raw_max = np.empty(len(first))
+        raw_min = np.empty(len(first))
+        for current in np.unique(level):
+            selected = level == current
+            start = first[selected]
+            end = last[selected] - (1 << current) + 1
+            raw_max[selected] = np.maximum(max_table[current][start], max_table[current][end])
+            raw_min[selected] = np.minimum(min_table[current][start], min_table[current][end])
+
+        return raw_max, raw_min
+
+
+# Prefix sums with a leading zero - the sum of the items from first to last (included) is p[last + 1] - p[first]
+def _prefix(items):
+    return np.concatenate(([0], np.cumsum(items)))
+
+
+# Level k of the table has the reduction of the 2^k items from each position
+def _sparse_table(items, reduce):
+    table = [items]
+    width = 1
+    while 2 * width <= len(items):
+        previous = table[-1]
+        table.append(reduce(previous[:-width], previous[width:]))
+        width *= 2
+    return table
+
+
+# Sums of the items in blocks of BLOCK_POINTS points, the sums restart in each block and the blocks are summed
+# again, so the sum over a range is not the difference of two sums over the whole series
+class _BlockSums:
+    def __init__(self, items):
+        block_count = max(-(-len(items) // BLOCK_POINTS), 1)
+        block_items = np.zeros(block_count * BLOCK_POINTS)
+        block_items[:len(items)] = items
+        self.sums = _block_prefix(block_items.reshape(block_count, BLOCK_POINTS))
+        self.block_sums = _prefix(self.sums[:, -1])
+
+    # Sum of the items from first to end (excluded)
+    def sum(self, first, end):
+        head_block, head_start, head_end, middle_first, middle_end, tail_block, tail_end = \
+            _split_blocks(first, end, len(self.sums))
+        return self.sums[head_block, head_end] - self.sums[head_block, head_start] \
+            + self.block_sums[middle_end] - self.block_sums[middle_first] + self.sums[tail_block, tail_end]
+
+
+# Weighted sums of the values in blocks of BLOCK_POINTS points, centred on the mean of each block
+# The sums restart in each block, so they stay small, and the blocks are summed again with the overall mean
+class _BlockMoments:
+    def __init__(self, values, weights):
+        count = len(values)
+        block_count = max(-(-count // BLOCK_POINTS), 1)
+        block_values = np.zeros(block_count * BLOCK_POINTS)
+        block_values[:count] = values
+        block_values = block_values.reshape(block_count, BLOCK_POINTS)
+        block_weights = np.zeros(block_count * BLOCK_POINTS)
+        block_weights[:count] = weights
+        block_weights = block_weights.reshape(block_count, BLOCK_POINTS)
+
+        sizes = np.clip(count - np.arange(block_count) * BLOCK_POINTS, 1, BLOCK_POINTS)
+        self.references = block_values.sum(axis=1) / sizes
+        centred = block_values - self.references[:, None]
+        self.weights = _block_prefix(block_weights)
+        self.centred = _block_prefix(block_weights * centred)
+        self.squares = _block_prefix(block_weights * centred ** 2)
+
+        # Weight, mean and squared deviations of each block, summed over the blocks with the overall mean
+        totals = self._piece(np.arange(block_count), np.zeros(block_count, dtype=np.int64),
+                             np.full(block_count, BLOCK_POINTS))
+        self.reference = float(np.mean(values)) if count else 0.0
+        offsets = totals[1] - self.reference
+        self.block_weights = _prefix(totals[0])
+        self.block_centred = _prefix(totals[0] * offsets)
+        self.block_squares = _prefix(totals[2] + totals[0] * offsets ** 2)
+
+    # Weight, weighted mean, weighted sum of squared deviations from the mean of the points from first
+    # to end (excluded) and its round-off error bound, the mean is nan for ranges with no weight
+    def moments(self, first, end):
+        block_count = len(self.references)
+        head_block, head_start, head_end, middle_first, middle_end, tail_block, tail_end = \
+            _split_blocks(first, end, block_count)
+
+        head = self._piece(head_block, head_start, head_end)
+        weight = self.block_weights[middle_end] - self.block_weights[middle_first]
+        centred = self.block_centred[middle_end] - self.block_centred[middle_first]
+        squares = self.block_squares[middle_end] - self.block_squares[middle_first]
+        middle = _centred_moments(weight, centred, squares, self.reference,
+                                  np.abs(self.block_centred[middle_end]) + np.abs(self.block_centred[middle_first]),
+                                  self.block_squares[middle_end] + self.block_squares[middle_first], block_count)
+        tail = self._piece(tail_block, 0, tail_end)
+
+        return _combine(_combine(head, middle), tail)
+
+    # Moments of the points of the blocks between the positions in the blocks (end excluded)
+    def _piece(self, block, start, end):
+        weight = self.weights[block, end] - self.weights[block, start]
+        centred = self.centred[block, end] - self.centred[block, start]
+        squares = self.squares[block, end] - self.squares[block, start]
+        return _centred_moments(weight, centred, squares, self.references[block],
+                                np.abs(self.centred[block, end]) + np.abs(self.centred[block, start]),
+                                self.squares[block, end] + self.squares[block, start], BLOCK_POINTS)
+
+
+# Splits the ranges of points from first to end (excluded) into the points in the block of the first point
+# (block, start and end in the block), the whole blocks (first and end block) and the points in the block of the
+# end (block and end in the block, from its start)
+def _split_blocks(first, end, block_count):
+    first = np.asarray(first)
+    end = np.asarray(end)
+    head_block = np.minimum(first // BLOCK_POINTS, block_count - 1)
+    end_block = end // BLOCK_POINTS
+    block_start = head_block * BLOCK_POINTS
+    head_end = np.minimum(end, block_start + BLOCK_POINTS) - block_start
+    middle_first = np.minimum(head_block + 1, block_count)
+    middle_end = np.clip(end_block, middle_first, block_count)
+    tail_block = np.minimum(end_block, block_count - 1)
+    tail_end = np.where(end_block > head_block, end - end_block * BLOCK_POINTS, 0)
+    return head_block, first - block_start, head_end, middle_first, middle_end, tail_block, tail_end
+
+
+# Weight, mean and squared deviations from the weighted sums of values and squares centred on the reference
+# and the bound of the round-off error of the squared deviations, from the sums the differences were taken of
+# (items are the number of items summed for each sum)
+def _centred_moments(weight, centred, squares, reference, centred_sums, squares_sums, items):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        offset = np.where(weight != 0, centred / weight, np.nan)
+        deviations = np.where(weight != 0, np.maximum(squares - centred * offset, 0.0), 0.0)
+        error = np.where(weight != 0, EPSILON * items * (squares_sums + 2 * np.abs(offset) * centred_sums), 0.0)
+    return weight, reference + offset, deviations, error
+
+
+# Moments of two sets of points (parallel variance formula), a set with no weight leaves the other unchanged
+def _combine(moments, other):
+    weight, mean, deviations, error = moments
+    other_weight, other_mean, other_deviations, other_error = other
+    total = weight + other_weight
+    with np.errstate(invalid='ignore', divide='ignore'):
+        delta = other_mean - mean
+        combined_mean = np.where(weight == 0, other_mean,
+                                 np.where(other_weight == 0, mean, mean + delta * other_weight / total))
+        between = np.where((weight == 0) | (other_weight == 0), 0.0, delta ** 2 * weight * other_weight / total)
+    return total, combined_mean, deviations + other_deviations + between, error + other_error
+
+
+# Prefix sums within each row of a table of blocks, with a leading zero in each row
+def _block_prefix(items):
+    return np.concatenate((np.zeros((len(items), 1)), np.cumsum(items, axis=1)), axis=1)
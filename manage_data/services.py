@@ -2,10 +2,18 @@ import os
 import datetime
 import re
 
+from concurrent.futures import ProcessPoolExecutor
+
 from math import sqrt
-from statistics import stdev
 
+import numpy as np
+
+from manage_data import instrumentation, interval_engine
+from manage_data.accumulators import IntervalAccumulator
 from manage_data.data_classes import Datapoint, Datacouple, Interval
+from manage_data.detector_serials import HEADER_LINES, SerialScanner, file_serials
+from manage_data.prefix_index import PrefixIndex
+from manage_data.datetime_parser import get_parser, to_epoch
 
 # file directories
 main_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -17,16 +25,15 @@ PARAMSAVE_DIRECTORY = os.path.join(main_directory, 'output_files/fits_data')
 
 CUSTOM_INTERVALS_PATH = os.path.join(main_directory, 'input_files/intervals.txt')
 
+# datetime format of the saved coupled data and the custom intervals
+COUPLES_DATETIME_FORMAT = '%m/%d/%Y %H:%M'
+
+# lines of a detector file parsed at a time by the streaming reader
+READ_CHUNK_LINES = 10000
+
 # value with or without decimal point and units regex
 RE_VALUE = r'[0-9]+\.*[0-9]*'
 
-# detector serial number format for regex
-RADONEYE_SERIAL = r'PE[0-9]{11}'
-RADONEYE_DATA = r'manual|auto'
-ALPHAGUARD_SERIAL = r'AG[0-9]{4}'
-ALPHAE_SERIAL = r'AE[0-9]{4}'
-RAD7_SERIAL = r'RAD7'
-
 
 # Calls the ref_average_intervals that:
 # Prepares the intervals based on the configuration
@@ -47,103 +54,38 @@ def average_over_intervals(intervals, referent_data, compared_data, configuratio
     return ref_av_intervals, cmp_av_intervals
 
 
-# Estimates the average value and uncertainty in an interval, based on configurations
-# called in ref_average_intervals
-# returns a Datapoint instance with datetime at the middle of the interval
-def estimate_value(interval, values_in_interval, configuration, det_type):
-
-    clearing = configuration.clear_data
-
+# Collects the settings of the referent or compared detector used to estimate the values in the intervals
+def get_estimate_settings(configuration, det_type):
     if det_type == 'referent':
-        background = configuration.referent_detector_bgn
-        background_unc = configuration.referent_detector_bgn_unc
-        uncertainty_type = configuration.referent_value_unc
-        averaging = configuration.referent_interval_type
-        min_threshold = configuration.value_thresholds[0]
-        max_threshold = configuration.value_thresholds[1]
-        interval_len = configuration.referent_meas_duration
-    else:
-        background = configuration.compared_detector_bgn
-        background_unc = configuration.compared_detector_bgn_unc
-        uncertainty_type = configuration.compared_value_unc
-        averaging = configuration.compared_interval_type
-        min_threshold = configuration.value_thresholds[2]
-        max_threshold = configuration.value_thresholds[3]
-        interval_len = configuration.compared_meas_duration
-
-    # Applying filters - zero filter, thresholds, jumps (intervals with sharp changes in value)
-    if 'zeros' in clearing:
-        raw_values = [val.value for val in values_in_interval if val.value > 0]
-    else:
-        raw_values = [val.value for val in values_in_interval]
-
-    raw_average = sum(raw_values) / len(raw_values)
-
-    if raw_average < min_threshold or raw_average > max_threshold:
-        return None
-
-    if 'jumps' in clearing and max(raw_values) - min(raw_values) > raw_average:
-        return None
-
-    # Estimates the average value and the two types of uncertainty stdev and propagation
-    if averaging == 'inside':
-        values_in_interval.pop()
-        raw_values.pop()
-        value = (sum(raw_values) / len(raw_values)) - background
-        unc_squared = [val.value_unc ** 2 for val in values_in_interval]
-        unc_propagation = sqrt(sum(unc_squared)) / len(raw_values)
-        stdev_single = stdev(raw_values) if len(raw_values) > 1 else 0
-        stdev_av = stdev_single / sqrt(len(raw_values))
-
-    # Estimates the 'weighted' average and its standard deviation and uncertainty by propagation
-    else:
-        start = interval.start_time
-        end = interval.end_time
-        weights = [(values_in_interval[0].meas_time - start).total_seconds()/60]
-        for i in range(1, len(values_in_interval)-1):
-            weight = (values_in_interval[i].meas_time - values_in_interval[i-1].meas_time).total_seconds() / 60
-            weights.append(weight)
-        weights.append((end - values_in_interval[len(values_in_interval) - 2].meas_time).total_seconds() / 60)
-        if (values_in_interval[len(values_in_interval)-1].meas_time - end).total_seconds() / 60 \
-                > interval_len:
-            values_in_interval[len(values_in_interval) - 1] = values_in_interval[len(values_in_interval) - 2]
-        value_sum = 0
-        unc_squared = 0
-        for i in range(len(weights)):
-            value_sum += weights[i]*values_in_interval[i].value
-            unc_squared += (weights[i]*values_in_interval[i].value_unc) ** 2
-        value = (value_sum / sum(weights))
-        unc_propagation = sqrt(unc_squared) / sum(weights)
-
-        stdev_sum = 0
-        for i in range(len(weights)):
-            stdev_sum += weights[i]*((values_in_interval[i].value - value) ** 2)
-        stdev_av = sqrt(stdev_sum / ((len(weights) - 1)*sum(weights)))
-        stdev_single = stdev_av * sqrt(len(weights))
-
-        value -= background
-
-    # Removing negative values and applying background filter
-    if value < 0:
-        value = 0.0
-
-    if 'bgn' in clearing and value < 3 * background_unc:
-        return None
-
-    # Generates an object with the estimated value, its measurement time and uncertainty
-    estimated_value = Datapoint(interval.meas_time, value)
+        return {'clearing': configuration.clear_data,
+                'background': configuration.referent_detector_bgn,
+                'background_unc': configuration.referent_detector_bgn_unc,
+                'uncertainty_type': configuration.referent_value_unc,
+                'averaging': configuration.referent_interval_type,
+                'min_threshold': configuration.value_thresholds[0],
+                'max_threshold': configuration.value_thresholds[1],
+                'interval_len': configuration.referent_meas_duration}
+
+    return {'clearing': configuration.clear_data,
+            'background': configuration.compared_detector_bgn,
+            'background_unc': configuration.compared_detector_bgn_unc,
+            'uncertainty_type': configuration.compared_value_unc,
+            'averaging': configuration.compared_interval_type,
+            'min_threshold': configuration.value_thresholds[2],
+            'max_threshold': configuration.value_thresholds[3],
+            'interval_len': configuration.compared_meas_duration}
 
-    # Chooses the specified uncertainty
-    if uncertainty_type == 'stdevav':
-        estimated_value.value_unc = sqrt((stdev_av ** 2) + (background_unc ** 2))
-    elif uncertainty_type == 'stdev':
-        estimated_value.value_unc = sqrt((stdev_single ** 2) + (background_unc ** 2))
-    elif uncertainty_type == 'propagation':
-        estimated_value.value_unc = sqrt((unc_propagation ** 2) + (background_unc ** 2))
-    elif uncertainty_type == 'max':
-        estimated_value.value_unc = sqrt((max(stdev_av, unc_propagation) ** 2) + (background_unc ** 2))
 
-    return estimated_value
+# Estimates the average value and uncertainty in an interval, based on configurations
+# called in ref_average_intervals, values_in_interval are sorted by datetime and end with the closing point
+# The values are averaged in a single pass by an IntervalAccumulator, values_in_interval is not changed
+# returns a Datapoint instance with datetime at the middle of the interval, None if the interval is cleared
+# or has no values to average
+def estimate_value(interval, values_in_interval, configuration, det_type):
+    accumulator = IntervalAccumulator(interval, get_estimate_settings(configuration, det_type))
+    for datapoint in values_in_interval:
+        accumulator.add(datapoint.meas_time, datapoint.value, datapoint.value_unc)
+    return accumulator.estimate()
 
 
 # The lists of both detectors should be sorted by the property datetime which is done in the readfile function
@@ -206,14 +148,14 @@ def read_detector_couple_data():
     for file_name in [name for name in os.listdir(directory)
                       if os.path.isfile(os.path.join(directory, name))]:
         file_path = os.path.join(directory, file_name)
+        parser = get_parser(COUPLES_DATETIME_FORMAT)
         with open(file_path, 'r') as current_file:
             detector_couples = []
-            lines = current_file.readlines()
-            for line in lines:
+            for line in current_file:
                 info = line.split(',')
                 if len(info) == 7:
                     try:
-                        datetime_value = datetime.datetime.strptime(info[0], '%m/%d/%Y %H:%M')
+                        datetime_value = parser.parse(info[0])
                         ref_value = float(info[1])
                         cmp_value = float(info[3])
                         data_couple = Datacouple(datetime_value, ref_value, cmp_value)
@@ -246,14 +188,14 @@ def read_detector_couple_names():
 
 def read_intervals():
     intervals = []
+    parser = get_parser(COUPLES_DATETIME_FORMAT)
     with open(CUSTOM_INTERVALS_PATH, 'r') as intervals_file:
-        lines = intervals_file.readlines()
-        for line in lines:
+        for line in intervals_file:
             tokens = line.split('-')
             if len(tokens) == 2:
                 try:
-                    start = datetime.datetime.strptime(tokens[0].strip(), '%m/%d/%Y %H:%M')
-                    end = datetime.datetime.strptime(tokens[1].strip(), '%m/%d/%Y %H:%M')
+                    start = parser.parse(tokens[0].strip())
+                    end = parser.parse(tokens[1].strip())
                     interval = Interval(start, end)
                     intervals.append(interval)
                 except ValueError:
@@ -263,109 +205,240 @@ def read_intervals():
     return intervals
 
 
-# reads the detector files and creates datapoints with datetime, compared value and compared value uncertainty
-# datetime is between start and end if specified by the config file
-def read_files(file_type, configuration):
-    all_files_data = []
-
+# Collects the file settings of the referent or compared detector used by the file readers
+def get_read_settings(file_type, configuration):
     if file_type == 'referent':
-        directory = REFERENT_DIRECTORY
-        separator = configuration.referent_file_separator
-        multiplier, unc_multiplier = configuration.value_multipliers[0], configuration.value_multipliers[1]
-        shift = configuration.time_shift[0]
-        datetime_format = configuration.referent_file_datetime_format
-        datetime_index = configuration.referent_datetime_index
-        value_index = configuration.referent_value_index
-        encoding = configuration.referent_file_encoding
+        return {'directory': REFERENT_DIRECTORY,
+                'separator': configuration.referent_file_separator,
+                'multiplier': configuration.value_multipliers[0],
+                'unc_multiplier': configuration.value_multipliers[1],
+                'shift': configuration.time_shift[0],
+                'datetime_format': configuration.referent_file_datetime_format,
+                'datetime_index': configuration.referent_datetime_index,
+                'value_index': configuration.referent_value_index,
+                'encoding': configuration.referent_file_encoding,
+                'detector': configuration.referent_detector}
+
+    return {'directory': COMPARE_DIRECTORY,
+            'separator': configuration.compared_file_separator,
+            'multiplier': configuration.value_multipliers[2],
+            'unc_multiplier': configuration.value_multipliers[3],
+            'shift': configuration.time_shift[1],
+            'datetime_format': configuration.compared_file_datetime_format,
+            'datetime_index': configuration.compared_datetime_index,
+            'value_index': configuration.compared_value_index,
+            'encoding': configuration.compared_file_encoding,
+            'detector': configuration.compared_detector}
+
+
+# Lists the paths of the detector files in the directory in the order of os.listdir
+def list_data_files(directory):
+    return [os.path.join(directory, name) for name in os.listdir(directory)
+            if os.path.isfile(os.path.join(directory, name))]
+
+
+# Splits a detector file line into datetime string, value string and uncertainty string (None if not provided)
+# Returns None if the line has not enough columns or no value is found
+def split_line(line, separator, datetime_index, value_index):
+    line = line.strip("\n")
+    line = line.strip('\"')
+    line = line.strip(separator)
+    info = line.split(separator)
+    if len(info) - 1 < max(datetime_index) or len(info)-1 < max(value_index):
+        return None
+    date_info = info[datetime_index[0]].strip()
+    if len(datetime_index) > 1:
+        for next_index in range(1, len(datetime_index)):
+            date_info += ' ' + info[datetime_index[next_index]]
+
+    value_info = info[value_index[0]]
+    value_info = value_info.replace(',', '')
+    value_match = re.search(RE_VALUE, value_info)
+    if not value_match:
+        return None
+    unc_value = None
+    if len(value_index) > 1:
+        uncertainty_info = info[value_index[1]]
+        uncertainty_info = uncertainty_info.replace(',', '')
+        unc_match = re.search(RE_VALUE, uncertainty_info)
+        if unc_match:
+            unc_value = unc_match.group(0)
+
+    return date_info, value_match.group(0), unc_value
+
+
+# Yields the parsed lines of a detector file in chunks of (datetime, value, value uncertainty) records
+# Lines are read one at a time, so the memory used depends on the chunk size and not on the file size
+# Only records between start and end time are yielded, if the file is sorted reading stops after end time
+# With epoch=True the datetime is given as int seconds since the epoch
+# A SerialScanner is fed the header lines and the lines which are not data, to find the detector serial
+def iter_file_records(file_path, settings, start_time=None, end_time=None, is_sorted=False,
+                      chunk_size=READ_CHUNK_LINES, epoch=False, scanner=None):
+    with open(file_path, 'r', encoding=settings['encoding'], errors='ignore') as current_file:
+        yield from iter_line_records(current_file, settings, start_time, end_time, is_sorted, chunk_size, epoch,
+                                     scanner)
+
+
+# Parses an iterable of detector file lines, as described in iter_file_records
+def iter_line_records(lines, settings, start_time=None, end_time=None, is_sorted=False,
+                      chunk_size=READ_CHUNK_LINES, epoch=False, scanner=None):
+    separator = settings['separator']
+    multiplier, unc_multiplier = settings['multiplier'], settings['unc_multiplier']
+    datetime_index = settings['datetime_index']
+    value_index = settings['value_index']
+    parser = get_parser(settings['datetime_format'])
+
+    if epoch:
+        parse = parser.parse_epoch
+        shift = int(settings['shift'] * 3600)
+        start_time = to_epoch(start_time) if start_time else None
+        end_time = to_epoch(end_time) if end_time else None
     else:
-        directory = COMPARE_DIRECTORY
-        separator = configuration.compared_file_separator
-        multiplier, unc_multiplier = configuration.value_multipliers[2], configuration.value_multipliers[3]
-        shift = configuration.time_shift[1]
-        datetime_format = configuration.compared_file_datetime_format
-        datetime_index = configuration.compared_datetime_index
-        value_index = configuration.compared_value_index
-        encoding = configuration.compared_file_encoding
-
-    for file_name in [name for name in os.listdir(directory) if os.path.isfile(os.path.join(directory, name))]:
-        data_points = []
-        file_path = os.path.join(directory, file_name)
-        with open(file_path, 'r', encoding=encoding, errors='ignore') as current_file:
-            lines = current_file.readlines()
-            for line in lines:
-                line = line.strip("\n")
-                line = line.strip('\"')
-                line = line.strip(separator)
-                info = line.split(separator)
-                if len(info) - 1 < max(datetime_index) or len(info)-1 < max(value_index):
-                    continue
-                date_info = info[datetime_index[0]].strip()
-                if len(datetime_index) > 1:
-                    for next_index in range(1, len(datetime_index)):
-                        date_info += ' ' + info[datetime_index[next_index]]
-
-                value_info = info[value_index[0]]
-                value_info = value_info.replace(',', '')
-                value_match = re.search(RE_VALUE, value_info)
-                if not value_match:
-                    continue
-                num_value = value_match.group(0)
-                unc_match = None
-                if len(value_index) > 1:
-                    uncertainty_info = info[value_index[1]]
-                    uncertainty_info = uncertainty_info.replace(',', '')
-                    unc_match = re.search(RE_VALUE, uncertainty_info)
+        parse = parser.parse
+        shift = datetime.timedelta(hours=settings['shift'])
+
+    chunk = []
+    # Line counts for the instrumentation - lines not matching the columns and values, lines with datetime or value
+    # which cannot be parsed and lines outside the start and end time
+    line_count = rejected_format = rejected_parse = outside = 0
+    for line_number, line in enumerate(lines):
+        line_count += 1
+        if scanner and line_number < HEADER_LINES:
+            scanner.feed(line)
+        tokens = split_line(line, separator, datetime_index, value_index)
+        if not tokens:
+            rejected_format += 1
+            if scanner:
+                scanner.feed(line)
+            continue
+        date_info, num_value, unc_value = tokens
 
-                try:
-                    datetime_value \
-                        = datetime.datetime.strptime(date_info, datetime_format) + datetime.timedelta(hours=shift)
-                    if configuration.start_time and (datetime_value < configuration.start_time):
-                        continue
-                    if configuration.end_time and (datetime_value > configuration.end_time):
-                        continue
-                    value = float(num_value)
-                    value = value * multiplier
-                    data_point = Datapoint(datetime_value, value)
-                    if unc_match:
-                        value_unc = float(unc_match.group(0))
-                        data_point.value_unc = value_unc * unc_multiplier
-                except ValueError:
-                    continue
+        try:
+            time_value = parse(date_info) + shift
+            if start_time and time_value < start_time:
+                outside += 1
+                continue
+            if end_time and time_value > end_time:
+                outside += 1
+                if is_sorted:
+                    break
+                continue
+            value = float(num_value) * multiplier
+            value_unc = float(unc_value) * unc_multiplier if unc_value else 0.0
+        except ValueError:
+            rejected_parse += 1
+            if scanner:
+                scanner.feed(line)
+            continue
+
+        chunk.append((time_value, value, value_unc))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+
+    instrumentation.count('lines_read', line_count)
+    instrumentation.count('lines_rejected_format', rejected_format)
+    instrumentation.count('lines_rejected_datetime_or_value', rejected_parse)
+    instrumentation.count('lines_outside_start_end', outside)
+    if chunk:
+        yield chunk
+
+
+# Applies the file reader to each file with the same extra arguments
+# With more than one worker each file is read in a separate process, the results keep the order of the paths
+# With the instrumentation the counters of the workers are added to the counters of the run
+def map_files(file_reader, file_paths, workers, *args):
+    if workers > 1 and len(file_paths) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(file_paths))) as executor:
+            if instrumentation.is_enabled():
+                results = []
+                for result, counters in executor.map(instrumentation.counted_call, [file_reader] * len(file_paths),
+                                                     file_paths, *[[arg] * len(file_paths) for arg in args]):
+                    instrumentation.add_counters(counters)
+                    results.append(result)
+                return results
+            return list(executor.map(file_reader, file_paths, *[[arg] * len(file_paths) for arg in args]))
+
+    return [file_reader(file_path, *args) for file_path in file_paths]
+
+
+# reads a detector file and creates datapoints sorted by datetime
+# returns the datapoints and the detector serial found in the file
+def read_file(file_path, settings, start_time=None, end_time=None, is_sorted=False):
+    scanner = SerialScanner(settings['detector'], file_path)
+    data_points = []
+    for chunk in iter_file_records(file_path, settings, start_time, end_time, is_sorted, scanner=scanner):
+        for datetime_value, value, value_unc in chunk:
+            data_point = Datapoint(datetime_value, value)
+            data_point.value_unc = value_unc
+            data_points.append(data_point)
+
+    data_points.sort(key=lambda x: x.meas_time)
+    return data_points, scanner.serial
+
+
+# reads the detector files and creates datapoints with datetime, compared value and compared value uncertainty
+# datetime is between start and end if specified by the config file
+# files are read in parallel if read_workers in the config file is more than 1
+# returns the data of each file and the serials found in the files (empty for detectors without serial patterns)
+def read_files(file_type, configuration):
+    settings = get_read_settings(file_type, configuration)
 
-                data_points.append(data_point)
+    return split_serials(map_files(read_file, list_data_files(settings['directory']), configuration.read_workers,
+                                   settings, configuration.start_time, configuration.end_time,
+                                   configuration.sorted_files))
 
-            data_points.sort(key=lambda x: x.meas_time)
-            all_files_data.append(data_points)
 
-    return all_files_data
+# Splits the (data, serial) results of the file readers into the list of data and the list of serials
+def split_serials(results):
+    return [data for data, _ in results], file_serials([serial for _, serial in results])
 
 
+# Averages the data in each interval, the points of the intervals are found by binary search
+# With batched_averaging in the config file all intervals are estimated at once by interval_engine.estimate_values
+# With prefix_index the estimates are found from the cumulative sums of a PrefixIndex
+# Returns the datapoints of the averaged intervals and the intervals which were not cleared
 def ref_average_intervals(intervals, data_list, configuration, det_type):
     datapoints = []
     non_empty_intervals = []
-    next_data_index = 0
-    for i in range(len(intervals)):
-        start = intervals[i].start_time
-        end = intervals[i].end_time
-        values_in_interval = []
-        for j in range(next_data_index, len(data_list)):
-            if data_list[j].meas_time < start:
-                continue
-            elif data_list[j].meas_time >= end or j == len(data_list) - 1:
-                if values_in_interval:
-                    values_in_interval.append(data_list[j])
-                    datapoint = estimate_value(intervals[i], values_in_interval, configuration, det_type)
-                    if datapoint:
-                        datapoints.append(datapoint)
-                        non_empty_intervals.append(intervals[i])
-                next_data_index = j
-                break
-            else:
-                values_in_interval.append(data_list[j])
+
+    times = interval_engine.to_microseconds(dp.meas_time for dp in data_list)
+    starts = interval_engine.to_microseconds(interval.start_time for interval in intervals)
+    ends = interval_engine.to_microseconds(interval.end_time for interval in intervals)
+    first, last, non_empty = interval_engine.bin_intervals(times, starts, ends)
+    instrumentation.count('intervals_empty', len(intervals) - np.count_nonzero(non_empty))
+    settings = get_estimate_settings(configuration, det_type)
+
+    if configuration.batched_averaging or configuration.prefix_index:
+        values = np.array([dp.value for dp in data_list], dtype=np.float64)
+        uncertainties = np.array([dp.value_unc for dp in data_list], dtype=np.float64)
+        if configuration.prefix_index:
+            index = PrefixIndex(times, values, uncertainties, settings, units_per_minute=60 * 1000000)
+            estimated, estimated_unc, keep = index.estimate(starts, ends, first, last, settings)
+        else:
+            estimated, estimated_unc, keep = interval_engine.estimate_values(
+                times, values, uncertainties, starts, ends, first, last, settings, units_per_minute=60 * 1000000)
+        for i in np.flatnonzero(keep):
+            datapoint = Datapoint(intervals[i].meas_time, float(estimated[i]))
+            datapoint.value_unc = float(estimated_unc[i])
+            datapoints.append(datapoint)
+            non_empty_intervals.append(intervals[i])
+        return datapoints, non_empty_intervals
+
+    # The points of each interval are added to an IntervalAccumulator, as in estimate_value
+    for i in np.flatnonzero(non_empty):
+        accumulator = IntervalAccumulator(intervals[i], settings)
+        for j in range(first[i], last[i] + 1):
+            accumulator.add(data_list[j].meas_time, data_list[j].value, data_list[j].value_unc)
+        datapoint = accumulator.estimate()
+        if datapoint:
+            datapoints.append(datapoint)
+            non_empty_intervals.append(intervals[i])
 
     return datapoints, non_empty_intervals
 
 
+# Saves the detector couple data in output_files/coupled_data and returns the path of the file
 def save_datacouples_file(datacouples, detector_names, value, unit):
 
     file_name = f'{detector_names[0]}_{detector_names[1]}_' \
@@ -385,15 +458,29 @@ def save_datacouples_file(datacouples, detector_names, value, unit):
     f.write(column_names)
 
     for entry in datacouples:
-        line = f'{entry.meas_time}, {entry.ref_value}, {entry.ref_value_unc}'
-        line += f', {entry.cmp_value}, {entry.cmp_value_unc}'
-        line += f', {entry.ratio_ref_cmp}' if entry.ratio_ref_cmp else ', -'
-        line += f', {entry.ratio_unc}' if entry.ratio_unc else ', 0'
-        f.write(line)
+        f.write(datacouple_line(entry))
         f.write("\n")
 
     f.close()
 
+    return path
+
+
+# Appends detector couple data to a file written by save_datacouples_file
+def append_datacouples_file(datacouples, path):
+    with open(path, 'a') as current_file:
+        for entry in datacouples:
+            current_file.write(datacouple_line(entry))
+            current_file.write("\n")
+
+
+def datacouple_line(entry):
+    line = f'{entry.meas_time}, {entry.ref_value}, {entry.ref_value_unc}'
+    line += f', {entry.cmp_value}, {entry.cmp_value_unc}'
+    line += f', {entry.ratio_ref_cmp}' if entry.ratio_ref_cmp else ', -'
+    line += f', {entry.ratio_unc}' if entry.ratio_unc else ', 0'
+    return line
+
 
 def save_param_file(lines, func_type, y_axis, x_axis):
     file_name = f'{func_type}_fit_params_{y_axis}_versus_{x_axis}_' \
@@ -405,59 +492,24 @@ def save_param_file(lines, func_type, y_axis, x_axis):
         current_file.writelines(lines)
 
 
-def search_detector_serial(detector, detector_type):
-    data_gen_match = ''
-    if detector.lower() == 'alphaguard':
-        reg_serial = ALPHAGUARD_SERIAL
-    elif detector.lower() == 'radoneye':
-        reg_serial = RADONEYE_SERIAL
-        data_gen_match = RADONEYE_DATA
-    elif detector.lower() == 'alphae':
-        reg_serial = ALPHAE_SERIAL
-    elif detector.lower() == 'rad7':
-        reg_serial = RAD7_SERIAL
-    else:
-        reg_serial = ''
-
-    detector_serials = []
-    if reg_serial:
-        detector_serials = search_serial(detector_type, reg_serial)
-
-    if data_gen_match:
-        gen_type = search_serial(detector_type, data_gen_match)
-        for i in range(0, len(gen_type)):
-            detector_serials[i] += gen_type[i]
-
-    return detector_serials
-
-
-def search_serial(file_type, searched_regex):
-
-    if file_type == 'referent':
-        directory = REFERENT_DIRECTORY
-    else:
-        directory = COMPARE_DIRECTORY
-
-    detector_serials = []
-
-    for file_name in [name for name in os.listdir(directory)
-                      if os.path.isfile(os.path.join(directory, name))]:
-
-        detector_serials.append('')
-
-        serial_match = re.search(searched_regex, file_name)
-        if serial_match:
-            detector_serials[len(detector_serials) - 1] = serial_match.group(0)
-            continue
+# Saves the fit parameters of the interval sweep in output_files/fits_data
+def save_sweep_file(lines):
+    file_name = f'interval_sweep_fit_params_{datetime.datetime.now().strftime("%y%m%d%H%M%S")}.csv'
+    path = os.path.join(PARAMSAVE_DIRECTORY, file_name)
 
-        file_path = os.path.join(directory, file_name)
-        with open(file_path, 'r') as current_file:
-            lines = current_file.readlines()
+    with open(path, 'w') as current_file:
+        current_file.writelines(lines)
 
-            for line in lines:
-                serial_match = re.search(searched_regex, line)
-                if serial_match:
-                    detector_serials[len(detector_serials) - 1] = serial_match.group(0)
-                    break
 
-    return detector_serials
+# Sets the referent detector name and the names of the detector couples in the configuration
+# Uses the serials found in the referent and compared files while reading
+# Currently works for AlphaGuard, RadonEYE, AlphaE and RAD7, see detector_serials.DETECTOR_PATTERNS
+def set_detector_serials(configuration, referent_serials, compared_det_serials):
+    if referent_serials:
+        configuration.referent_detector += referent_serials[0]
+    if compared_det_serials:
+        configuration.compared_det_serials = \
+            [(configuration.referent_detector, cmp)
+             if cmp
+             else (configuration.referent_detector, configuration.compared_detector)
+             for cmp in compared_det_serials]
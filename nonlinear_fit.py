@@ -0,0 +1,252 @@
+import numpy as np
+
+# Batched Levenberg-Marquardt least squares fits of the nonlinear models
+# Many data sets (e.g. the series of all detectors) are fitted in one call, the sums over the points of each
+# data set are done together, so the steps of all data sets are one vectorised computation
+# The models have analytic Jacobians and their initial parameters come from linearised fits of the data
+#
+# Each fit returns the parameters, their uncertainties, chi-squared, degrees of freedom, p-value,
+# the iterations and whether the fit converged (diagnostics for the parameter files)
+
+MAX_ITERATIONS = 200
+# The fit has converged when the relative decrease of chi-squared or the relative step is below the tolerance
+CHI_SQUARED_TOLERANCE = 1e-12
+STEP_TOLERANCE = 1e-10
+INITIAL_DAMPING = 1e-3
+MAX_DAMPING = 1e16
+# Profile of the exponential_offset chi-squared - rates b*(x range) on a logarithmic grid from 1e-2 to 1e2
+# (falling and rising), refined by golden section search
+PROFILE_RATES = 41
+PROFILE_SECTION_STEPS = 40
+
+
+def linear(x, params):
+    return params[:, 0] * x + params[:, 1]
+
+
+def linear_jacobian(x, params):
+    return np.stack((x, np.ones_like(x)), axis=1)
+
+
+def parabolic(x, params):
+    return params[:, 0] * x ** 2 + params[:, 1]
+
+
+def parabolic_jacobian(x, params):
+    return np.stack((x ** 2, np.ones_like(x)), axis=1)
+
+
+def exponential(x, params):
+    return params[:, 0] * np.exp(params[:, 1] * x)
+
+
+def exponential_jacobian(x, params):
+    exp = np.exp(params[:, 1] * x)
+    return np.stack((exp, params[:, 0] * x * exp), axis=1)
+
+
+def exponential_offset(x, params):
+    return params[:, 0] * np.exp(params[:, 1] * x) + params[:, 2]
+
+
+def exponential_offset_jacobian(x, params):
+    exp = np.exp(params[:, 1] * x)
+    return np.stack((exp, params[:, 0] * x * exp, np.ones_like(x)), axis=1)
+
+
+# The weighted line is the solution, the fit only adds the covariance and diagnostics
+def linear_guess(x, y, sigma, segment, count):
+    slope, intercept = weighted_line(x, y, 1 / sigma ** 2, segment, count)
+    return np.stack((slope, intercept), axis=1)
+
+
+# a*x^2 + b is linear in a and b, the weighted line of y versus x^2 is the solution
+def parabolic_guess(x, y, sigma, segment, count):
+    slope, intercept = weighted_line(x ** 2, y, 1 / sigma ** 2, segment, count)
+    return np.stack((slope, intercept), axis=1)
+
+
+# a*exp(bx) from the weighted line of ln(y) versus x, points with y <= 0 are left out
+def exponential_guess(x, y, sigma, segment, count):
+    positive = y > 0
+    log_y = np.log(np.where(positive, y, 1.0))
+    slope, intercept = weighted_line(x, log_y, np.where(positive, (y / sigma) ** 2, 0.0), segment, count)
+    return np.stack((np.exp(intercept), slope), axis=1)
+
+
+# a*exp(bx) + c is linear in a and c for a fixed b, so chi-squared is profiled over b - for each b the weighted line
+# of y versus exp(bx) gives a and c, b is found on the grid of rates and refined as york_minimum in fit_engine
+# The initial parameters are the profile minimum, the linearised guess (c a little below the smallest value and
+# a*exp(bx) fitted to y - c as above) or (first y, -0.01, last y), whichever has the smallest chi-squared
+def exponential_offset_guess(x, y, sigma, segment, count):
+    def sums(items):
+        return np.bincount(segment, weights=items, minlength=count)
+
+    def chi_squared(params):
+        squares = sums(((y - exponential_offset(x, params[segment])) / sigma) ** 2)
+        return np.where(np.isfinite(squares), squares, np.inf)
+
+    y_min = np.full(count, np.inf)
+    y_max = np.full(count, -np.inf)
+    x_min = np.full(count, np.inf)
+    x_max = np.full(count, -np.inf)
+    np.minimum.at(y_min, segment, y)
+    np.maximum.at(y_max, segment, y)
+    np.minimum.at(x_min, segment, x)
+    np.maximum.at(x_max, segment, x)
+    span = np.where(x_max > x_min, x_max - x_min, 1.0)
+
+    # Parameters and chi-squared of the profile at the rates (b times the x range) of the data sets
+    def profile(rates):
+        b = rates / span
+        slope, intercept = weighted_line(np.exp(b[segment] * (x - x_min[segment])), y, 1 / sigma ** 2, segment,
+                                         count)
+        params = np.stack((slope * np.exp(-b * x_min), b, intercept), axis=1)
+        return params, chi_squared(params)
+
+    logs = np.linspace(-2, 2, PROFILE_RATES)
+    step = logs[1] - logs[0]
+    grid = np.array([profile(np.full(count, sign * 10 ** log))[1] for sign in (-1, 1) for log in logs])
+    best = np.argmin(grid, axis=0)
+    sign = np.where(best < PROFILE_RATES, -1.0, 1.0)
+    low = logs[best % PROFILE_RATES] - step
+    high = logs[best % PROFILE_RATES] + step
+    ratio = (np.sqrt(5) - 1) / 2
+    for _ in range(PROFILE_SECTION_STEPS):
+        left = high - ratio * (high - low)
+        right = low + ratio * (high - low)
+        is_left = profile(sign * 10 ** left)[1] < profile(sign * 10 ** right)[1]
+        high = np.where(is_left, right, high)
+        low = np.where(is_left, low, left)
+    profile_params, _ = profile(sign * 10 ** ((low + high) / 2))
+
+    offset = y_min - 0.01 * (y_max - y_min) - 1e-12 * np.abs(y_min)
+    exp_params = exponential_guess(x, y - offset[segment], sigma, segment, count)
+    linearised_params = np.concatenate((exp_params, offset[:, None]), axis=1)
+
+    first = np.searchsorted(segment, np.arange(count))
+    last = np.searchsorted(segment, np.arange(count), side='right') - 1
+    decrease_params = np.stack((y[first], np.full(count, -0.01), y[last]), axis=1)
+
+    candidates = np.array((profile_params, linearised_params, decrease_params))
+    best = np.argmin([chi_squared(params) for params in candidates], axis=0)
+    return candidates[best, np.arange(count)]
+
+
+# model name: number of parameters, function, Jacobian and initial guess
+MODELS = {
+    'linear': (2, linear, linear_jacobian, linear_guess),
+    'parabolic': (2, parabolic, parabolic_jacobian, parabolic_guess),
+    'exponential': (2, exponential, exponential_jacobian, exponential_guess),
+    'exponential_offset': (3, exponential_offset, exponential_offset_jacobian, exponential_offset_guess),
+}
+
+
+# Chi-squared p-values - scipy is imported on the first fit, so runs without fits start without it
+def p_values(chi_squared, dof):
+    from scipy.stats import chi2
+    return chi2.sf(chi_squared, dof)
+
+
+# Slope and intercept of the weighted least-squares line of each data set
+def weighted_line(x, y, weights, segment, count):
+    def sums(items):
+        return np.bincount(segment, weights=items, minlength=count)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        weight_sum = sums(weights)
+        x_mean = sums(weights * x) / weight_sum
+        y_mean = sums(weights * y) / weight_sum
+        x_diff = x - x_mean[segment]
+        slope = sums(weights * x_diff * (y - y_mean[segment])) / sums(weights * x_diff ** 2)
+    return slope, y_mean - slope * x_mean
+
+
+# Fits the model to each data set, the arguments are lists with the x, y and uncertainty arrays of each data set
+# y_uncs None fits without weights, the covariance is scaled by chi-squared / dof unless absolute_sigma
+# (as in curve_fit), fallback_guess is used for data sets where the linearised guess is not finite
+# Returns the fit of each data set, None for data sets with less points than parameters
+def fit_batch(model, xs, ys, y_uncs=None, absolute_sigma=False, fallback_guess=None):
+    param_count, function, jacobian, guess = MODELS[model]
+    fits = [None] * len(xs)
+    fitted = np.array([i for i in range(len(xs)) if len(xs[i]) >= param_count], dtype=np.int64)
+    if len(fitted) == 0:
+        return fits
+
+    count = len(fitted)
+    lengths = np.array([len(xs[i]) for i in fitted], dtype=np.int64)
+    segment = np.repeat(np.arange(count), lengths)
+    x = np.concatenate([np.asarray(xs[i], dtype=np.float64) for i in fitted])
+    y = np.concatenate([np.asarray(ys[i], dtype=np.float64) for i in fitted])
+    if y_uncs is None:
+        sigma = np.ones(len(x))
+    else:
+        sigma = np.concatenate([np.asarray(y_uncs[i], dtype=np.float64) for i in fitted])
+
+    def sums(items):
+        return np.bincount(segment, weights=items, minlength=count)
+
+    def chi_squared(params):
+        return sums(((y - function(x, params[segment])) / sigma) ** 2)
+
+    # Normal equations of each data set - J^T J and J^T r of the weighted residuals
+    def normal_equations(params):
+        weighted_jacobian = jacobian(x, params[segment]) / sigma[:, None]
+        residuals = (y - function(x, params[segment])) / sigma
+        curvature = np.empty((count, param_count, param_count))
+        for i in range(param_count):
+            for j in range(i, param_count):
+                curvature[:, i, j] = curvature[:, j, i] = sums(weighted_jacobian[:, i] * weighted_jacobian[:, j])
+        gradient = np.stack([sums(weighted_jacobian[:, i] * residuals) for i in range(param_count)], axis=1)
+        return curvature, gradient
+
+    with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+        params = guess(x, y, sigma, segment, count)
+        if fallback_guess is not None:
+            params = np.where(np.isfinite(params).all(axis=1)[:, None], params, np.asarray(fallback_guess))
+        current = chi_squared(params)
+        damping = np.full(count, INITIAL_DAMPING)
+        iterations = np.zeros(count, dtype=np.int64)
+        converged = np.zeros(count, dtype=bool)
+        active = np.isfinite(current)
+
+        while active.any() and iterations.max() < MAX_ITERATIONS:
+            curvature, gradient = normal_equations(params)
+            damped = curvature.copy()
+            diagonal = np.arange(param_count)
+            damped[:, diagonal, diagonal] *= 1 + damping[:, None]
+            step = np.einsum('mij,mj->mi', np.linalg.pinv(damped), gradient)
+            step = np.where(active[:, None], step, 0.0)
+
+            trial = params + step
+            trial_chi_squared = chi_squared(trial)
+            better = active & (trial_chi_squared <= current)
+            small_decrease = current - trial_chi_squared <= CHI_SQUARED_TOLERANCE * trial_chi_squared
+            small_step = (np.abs(step) <= STEP_TOLERANCE * (np.abs(params) + STEP_TOLERANCE)).all(axis=1)
+
+            params = np.where(better[:, None], trial, params)
+            current = np.where(better, trial_chi_squared, current)
+            damping = np.where(better, damping / 10, damping * 10)
+            iterations += active
+            converged |= active & ((better & small_decrease) | small_step)
+            active &= ~converged & (damping < MAX_DAMPING)
+
+        curvature, _ = normal_equations(params)
+        covariance = np.linalg.pinv(curvature)
+        dof = lengths - param_count
+        if not absolute_sigma:
+            covariance *= np.where(dof > 0, current / dof, np.inf)[:, None, None]
+        uncertainties = np.sqrt(np.diagonal(covariance, axis1=1, axis2=2))
+        p_val = p_values(current, dof)
+
+    for i, fit_index in enumerate(fitted):
+        fits[fit_index] = (tuple(float(param) for param in params[i]),
+                           tuple(float(unc) for unc in uncertainties[i]),
+                           float(current[i]), int(dof[i]), float(p_val[i]), int(iterations[i]), bool(converged[i]))
+    return fits
+
+
+# Values of the model with the parameters of one fit, e.g. for plotting
+def model_values(model, x, params):
+    x = np.asarray(x, dtype=np.float64)
+    return MODELS[model][1](x, np.tile(np.asarray(params, dtype=np.float64), (len(x), 1)))
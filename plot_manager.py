@@ -1,14 +1,31 @@
 import logging
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 
-import plot_services
+from manage_data import instrumentation
 from manage_data.services import save_param_file
 
+# Plot types with fits, the fit parameters are saved in output_files/fits_data
+FIT_PLOTS = ('value_value', 'ratio_ref_activity', 'ratio_cmp_activity')
+RATIO_PLOTS = (('ratio_ref_activity', 'referent'), ('ratio_cmp_activity', 'compared'))
+
 
 # All plots are either saved or shown,depending on the configuration.save_plots True = saved, False = shown
+# Saved plots are rendered in parallel processes if plot_workers in the config file is more than 1
+# The fit parameter lines are saved in the order of the detector couples
+# With fit_tables in the config file the fit parameters of the fit plot types which are not plotted are saved too
+# matplotlib and scipy are imported only when there are plots or fits, runs without them start faster
+# With the instrumentation the fits and the plots of each plot type are recorded as stages
 def manage_plots(configuration, referent_raw_data, compared_raw_data,
                  referent_avrg_data, compared_avrg_data, detector_couples_data):
-    if configuration.plots:
+    plots = configuration.plots or []
+    fit_types = [plot_type for plot_type in FIT_PLOTS if plot_type in plots or configuration.fit_tables]
+    if plots or fit_types:
+        import fit_engine
+        import plot_services
+
         detector_couple_names = configuration.compared_det_serials
         value = configuration.compared_value
         unit = configuration.unit
@@ -16,77 +33,135 @@ def manage_plots(configuration, referent_raw_data, compared_raw_data,
 
         logging.basicConfig(filename='output_files/plots/exception.log', level=logging.ERROR)
 
-        if 'original' in configuration.plots:
+        # Each plot is a task of plot type, short title, detector couple, plot function and its arguments
+        tasks = []
+        if 'original' in plots:
             title = 'Raw no background corrected'
             short_title = 'raw'
             for i in range(0, len(compared_raw_data)):
-                plot_services.double_time_plot(referent_raw_data, compared_raw_data[i], detector_couple_names[i],
-                                               value, unit, title, short_title, save_plots)
+                tasks.append(('original', short_title, detector_couple_names[i], plot_services.double_time_plot,
+                              (referent_raw_data, compared_raw_data[i], detector_couple_names[i],
+                               value, unit, title, short_title, save_plots)))
 
-        if 'averaged_time' in configuration.plots:
+        if 'averaged_time' in plots:
             title = 'Averaged over intervals'
             short_title = 'averaged'
             for i in range(0, len(compared_avrg_data)):
-                plot_services.double_time_unc_plot(referent_avrg_data, compared_avrg_data[i], detector_couple_names[i],
-                                                   value, unit, title, short_title, save_plots)
+                tasks.append(('averaged_time', short_title, detector_couple_names[i],
+                              plot_services.double_time_unc_plot,
+                              (referent_avrg_data, compared_avrg_data[i], detector_couple_names[i],
+                               value, unit, title, short_title, save_plots)))
 
-        if 'value_value' in configuration.plots:
+        # The linear and York fits of all detector couples are done at once, couples with too few points
+        # are not fitted and the plot is skipped
+        linear_fits = []
+        york_fits = []
+        if 'value_value' in fit_types:
+            with instrumentation.stage('fit_value_value', len(detector_couples_data)):
+                linear_fits = fit_engine.linear_couple_fits(detector_couples_data)
+                york_fits = fit_engine.york_couple_fits(detector_couples_data)
+        if 'value_value' in plots:
             short_title = f'{value}'
-            param_file_lines = [f'Referent {value} as a function of compared {value}\n',
-                                'Linear fit of type ax+ b\n',
-                                f'Referent detector, Compared detector, a, a uncertainty, '
-                                f'b ({unit}), b uncertainty ({unit}), '
-                                f'chi-squared, degrees of freedom, p-value \n']
             for i in range(0, len(detector_couples_data)):
-                try:
-                    param_line = plot_services.compare_plot_fit(detector_couples_data[i], value, unit, detector_couple_names[i],
-                                                   short_title, save_plots)
-                    param_file_lines.append(param_line)
-                except TypeError as e:
-                    logging.error(msg=f'{datetime.now()} Plot skipped {short_title} {detector_couple_names[i][1]}'
-                                      f'Check coupled data - points might be insufficient',
-                                  exc_info=True)
-                    continue
-            save_param_file(param_file_lines, 'linear', 'referent', 'compared')
-
-        if 'ratio_ref_activity' in configuration.plots:
-            short_title = 'ratio_referent'
-            param_file_lines = [f'Ratio of ref to compared {value} as a function of ref {value}\n',
-                                f'{configuration.fit} fit \n',
-                                f'Referent detector, Compared detector, a, a uncertainty, '
-                                f'b, b uncertainty, '
-                                f'chi-squared, degrees of freedom, p-value \n']
-            for i in range(0, len(detector_couples_data)):
-                try:
-                    param_line = plot_services.ratio_value_plot(detector_couples_data[i], value, unit, 'referent',
-                                                                detector_couple_names[i], short_title, save_plots,
-                                                                configuration.fit)
-                    param_file_lines.append(param_line)
-                except TypeError as e:
-                    logging.error(msg=f'{datetime.now()} Plot skipped {short_title} {detector_couple_names[i][1]}'
-                                      f'Check coupled data - points might be insufficient',
-                                  exc_info=True)
-                    continue
-
-            save_param_file(param_file_lines, configuration.fit, 'ratio', 'referent')
-
-        if 'ratio_cmp_activity' in configuration.plots:
-            short_title = 'ratio_compared'
-            param_file_lines = [f'Ratio of ref to compared {value} as a function of compared {value}\n',
-                                f'{configuration.fit} fit \n',
-                                f'Referent detector, Compared detector, a, a uncertainty, '
-                                f'b, b uncertainty, '
-                                f'chi-squared, degrees of freedom, p-value \n']
+                tasks.append(('value_value', short_title, detector_couple_names[i], plot_services.compare_plot_fit,
+                              (detector_couples_data[i], value, unit, detector_couple_names[i],
+                               short_title, save_plots, linear_fits[i], york_fits[i])))
+
+        # The ratio fits of all detector couples are done at once for each detector type
+        ratio_fits = {}
+        for plot_type, detector_type in RATIO_PLOTS:
+            if plot_type in fit_types:
+                with instrumentation.stage(f'fit_{plot_type}', len(detector_couples_data)):
+                    ratio_fits[plot_type] = fit_engine.ratio_couple_fits(detector_couples_data, detector_type,
+                                                                         configuration.fit)
+        for plot_type, detector_type in RATIO_PLOTS:
+            if plot_type in plots:
+                short_title = f'ratio_{detector_type}'
+                for i in range(0, len(detector_couples_data)):
+                    tasks.append((plot_type, short_title, detector_couple_names[i], plot_services.ratio_value_plot,
+                                  (detector_couples_data[i], value, unit, detector_type, detector_couple_names[i],
+                                   short_title, save_plots, configuration.fit, ratio_fits[plot_type][i])))
+
+        # Shown plots need the pyplot window, so they are rendered one by one
+        workers = configuration.plot_workers if save_plots else 1
+        with instrumentation.stage('render_plots', len(tasks)):
+            results = render_plots([(task[3], task[4]) for task in tasks], workers)
+        # Wall and CPU time of the plots of each type, summed over the plots rendered in all processes
+        for plot_type in dict.fromkeys(task[0] for task in tasks):
+            timings = [result[2:] for task, result in zip(tasks, results) if task[0] == plot_type]
+            instrumentation.add_stage(f'plot_{plot_type}', sum(timing[0] for timing in timings),
+                                      sum(timing[1] for timing in timings), len(timings))
+
+        param_file_lines = {'value_value': [f'Referent {value} as a function of compared {value}\n',
+                                            'Linear fit of type ax+ b\n',
+                                            f'Referent detector, Compared detector, a, a uncertainty, '
+                                            f'b ({unit}), b uncertainty ({unit}), '
+                                            f'chi-squared, degrees of freedom, p-value, '
+                                            f'York a, York a uncertainty, York b ({unit}), '
+                                            f'York b uncertainty ({unit}), York chi-squared, '
+                                            f'York degrees of freedom, York p-value, York iterations \n'],
+                            'ratio_ref_activity': [f'Ratio of ref to compared {value} as a function of ref {value}\n',
+                                                   f'{configuration.fit} fit \n',
+                                                   f'Referent detector, Compared detector, a, a uncertainty, '
+                                                   f'b, b uncertainty, '
+                                                   f'chi-squared, degrees of freedom, p-value, '
+                                                   f'iterations, converged \n'],
+                            'ratio_cmp_activity': [f'Ratio of ref to compared {value} as a function of compared '
+                                                   f'{value}\n',
+                                                   f'{configuration.fit} fit \n',
+                                                   f'Referent detector, Compared detector, a, a uncertainty, '
+                                                   f'b, b uncertainty, '
+                                                   f'chi-squared, degrees of freedom, p-value, '
+                                                   f'iterations, converged \n']}
+        for (plot_type, short_title, detector_couple, _, _), (param_line, error, _, _) in zip(tasks, results):
+            if error:
+                logging.error(msg=f'{datetime.now()} Plot skipped {short_title} {detector_couple[1]}'
+                                  f'Check coupled data - points might be insufficient\n{error}')
+            elif plot_type in param_file_lines:
+                param_file_lines[plot_type].append(param_line)
+
+        # Fit parameters without plots
+        if 'value_value' in fit_types and 'value_value' not in plots:
             for i in range(0, len(detector_couples_data)):
-                try:
-                    param_line = plot_services.ratio_value_plot(detector_couples_data[i], value, unit, 'compared',
-                                                                detector_couple_names[i], short_title, save_plots,
-                                                                configuration.fit)
-                    param_file_lines.append(param_line)
-                except TypeError as e:
-                    logging.error(msg=f'{datetime.now()} Plot skipped {short_title} {detector_couple_names[i][1]}'
-                                      f'Check coupled data - points might be insufficient',
-                                  exc_info=True)
-                    continue
-
-            save_param_file(param_file_lines, configuration.fit, 'ratio', 'compared')
+                if linear_fits[i]:
+                    param_file_lines['value_value'].append(
+                        fit_engine.fit_param_line(detector_couple_names[i], linear_fits[i], (8, york_fits[i])))
+        for plot_type, _ in RATIO_PLOTS:
+            if plot_type in fit_types and plot_type not in plots:
+                for i in range(0, len(detector_couples_data)):
+                    fit = ratio_fits[plot_type][i]
+                    if fit:
+                        param_file_lines[plot_type].append(
+                            fit_engine.fit_param_line(detector_couple_names[i], fit, (2, fit[7:])))
+
+        if 'value_value' in fit_types:
+            save_param_file(param_file_lines['value_value'], 'linear', 'referent', 'compared')
+        if 'ratio_ref_activity' in fit_types:
+            save_param_file(param_file_lines['ratio_ref_activity'], configuration.fit, 'ratio', 'referent')
+        if 'ratio_cmp_activity' in fit_types:
+            save_param_file(param_file_lines['ratio_cmp_activity'], configuration.fit, 'ratio', 'compared')
+
+
+# Renders the plots (plot function and arguments) in worker processes if workers is more than 1
+# Returns the result of each plot in the order of the plots
+def render_plots(plots, workers):
+    if workers > 1 and len(plots) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(plots))) as executor:
+            futures = [executor.submit(render_plot, plot_function, *args) for plot_function, args in plots]
+            return [future.result() for future in futures]
+
+    return [render_plot(plot_function, *args) for plot_function, args in plots]
+
+
+# Returns the result of the plot function (fit parameter line or None) and None,
+# or None and the traceback text if the plot is skipped because the points are insufficient
+# (the text and not the exception info is returned, so it can be passed from a worker process)
+# followed by the wall and CPU time of the plot
+def render_plot(plot_function, *args):
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        result = plot_function(*args), None
+    except TypeError:
+        result = None, traceback.format_exc()
+    return result + (time.perf_counter() - start, time.process_time() - cpu_start)
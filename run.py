@@ -1,15 +1,25 @@
 import os
 
 from config import Configuration
+from manage_data import instrumentation
 from manage_data.data_manager import manage_data
 from plot_manager import manage_plots
 
-# Reads the config file and makes a configuration object
 CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.txt')
-configuration = Configuration(CONFIG_PATH)
 
-referent_raw_data, compared_raw_data, referent_avrg_data, compared_avrg_data, detector_couples_data = \
-    manage_data(configuration)
+# The main guard is needed for the worker processes used when reading files in parallel
+if __name__ == '__main__':
+    # Reads the config file and makes a configuration object
+    configuration = Configuration(CONFIG_PATH)
+    # Records the stages of the run if set in the config file or by the environment variable
+    instrumentation.enable(configuration.instrumentation)
 
-manage_plots(configuration, referent_raw_data, compared_raw_data, referent_avrg_data,
-             compared_avrg_data, detector_couples_data)
+    with instrumentation.stage('manage_data'):
+        referent_raw_data, compared_raw_data, referent_avrg_data, compared_avrg_data, detector_couples_data = \
+            manage_data(configuration)
+
+    with instrumentation.stage('manage_plots'):
+        manage_plots(configuration, referent_raw_data, compared_raw_data, referent_avrg_data,
+                     compared_avrg_data, detector_couples_data)
+
+    instrumentation.save_report()
@@ -0,0 +1,185 @@
+import logging
+import os
+import time
+import traceback
+
+from datetime import datetime
+
+from config import Configuration
+from manage_data import array_services, interval_engine, services
+from plot_manager import manage_plots
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.txt')
+
+# Watch mode - a long running analysis which is refreshed when the detector files change
+# The referent and compared directories are polled, a change is processed when the files did not change for
+# DEBOUNCE_SECONDS (the detector software may write an export in several steps)
+# The parsed data of each file is kept in memory, only the changed files are read again
+# A changed referent file is averaged again with all compared files, a changed compared file only with the
+# referent averages kept in memory, the couples of the changed files are joined and saved again
+# The plots and fit parameters are refreshed for all couples
+# Runs with the data of separate files, until stopped with Ctrl+C
+POLL_SECONDS = 2.0
+DEBOUNCE_SECONDS = 5.0
+
+
+# Size and modification time of each file in the referent and compared directories
+def file_signatures():
+    signatures = {}
+    for directory in (services.REFERENT_DIRECTORY, services.COMPARE_DIRECTORY):
+        for path in services.list_data_files(directory):
+            file_stat = os.stat(path)
+            signatures[path] = (file_stat.st_size, file_stat.st_mtime_ns)
+    return signatures
+
+
+# Data kept in memory between the updates
+# files - signature, parsed data and serial of each file, read with the start and end time in window
+# ref_av and intervals - referent averages and their intervals, cmp_av, couples and saved - averages,
+# detector couples and saved coupled data file of each compared file
+def new_state():
+    return {'files': {}, 'window': None, 'ref_path': None, 'ref_av': None, 'intervals': None,
+            'cmp_av': {}, 'couples': {}, 'saved': {}}
+
+
+# Reads the files with a changed signature (in parallel with read_workers), returns the paths which were read
+def read_changed_files(state, signatures, configuration):
+    reader = array_services.read_file_arrays if configuration.data_engine == 'arrays' else services.read_file
+    window = (configuration.start_time, configuration.end_time)
+    # Data read for another start and end time is read again
+    if window != state['window']:
+        state['files'] = {}
+        state['window'] = window
+
+    for path in [path for path in state['files'] if path not in signatures]:
+        del state['files'][path]
+
+    changed = []
+    for file_type in ('referent', 'compared'):
+        settings = services.get_read_settings(file_type, configuration)
+        paths = [path for path in services.list_data_files(settings['directory'])
+                 if path in signatures and state['files'].get(path, (None,))[0] != signatures[path]]
+        results = services.map_files(reader, paths, configuration.read_workers, settings,
+                                     configuration.start_time, configuration.end_time, configuration.sorted_files)
+        for path, (data, serial) in zip(paths, results):
+            state['files'][path] = (signatures[path], data, serial)
+        changed += paths
+    return changed
+
+
+# Averages the referent file over the intervals, returns the averages and the averaged intervals
+def average_referent(intervals, data, configuration):
+    if configuration.data_engine == 'arrays':
+        starts, ends = interval_engine.interval_bounds(intervals)
+        ref_av = array_services.average_series(starts, ends, data, configuration, 'referent')
+        return ref_av, ref_av
+    return services.ref_average_intervals(intervals, data, configuration, 'referent')
+
+
+# Averages a compared file over the referent intervals and joins it with the referent averages
+def average_compared(ref_av, ref_intervals, data, configuration):
+    if configuration.data_engine == 'arrays':
+        cmp_av = array_services.average_series(ref_intervals.starts, ref_intervals.ends, data, configuration,
+                                               'compared')
+        return cmp_av, array_services.join_detector_couples_arrays(ref_av, [cmp_av])[0]
+    cmp_av = services.ref_average_intervals(ref_intervals, data, configuration, 'compared')[0]
+    return cmp_av, services.join_detector_couple(ref_av, cmp_av)
+
+
+# Reads and processes the changed files and refreshes the saved coupled data and the plots
+# configured is the start time, end time and referent detector of the config file, which are changed by the run
+# Returns the number of files read and of compared files averaged again
+def update(state, configuration, configured, signatures):
+    configuration.start_time, configuration.end_time, configuration.referent_detector = configured
+    changed = read_changed_files(state, signatures, configuration)
+    read_count = len(changed)
+
+    ref_settings = services.get_read_settings('referent', configuration)
+    cmp_settings = services.get_read_settings('compared', configuration)
+    # as in get_data_separate_files only the first referent file is used
+    ref_path = services.list_data_files(ref_settings['directory'])[0]
+    cmp_paths = services.list_data_files(cmp_settings['directory'])
+    ref_data = state['files'][ref_path][1]
+    if len(ref_data) == 0:
+        raise Exception('Check referent detector configuration - indexes, separator or encoding')
+
+    # The intervals are prepared again when the referent file changes
+    if ref_path in changed or ref_path != state['ref_path']:
+        # if not set in configuration start and end time are set as start and end of the referent data
+        if not configuration.start_time:
+            configuration.start_time = ref_data[0].meas_time
+        if not configuration.end_time:
+            configuration.end_time = ref_data[len(ref_data) - 1].meas_time
+        intervals = services.prepare_intervals(configuration)
+        state['ref_path'] = ref_path
+        state['ref_av'], state['intervals'] = average_referent(intervals, ref_data, configuration)
+        changed = list(cmp_paths)
+
+    for path in list(state['cmp_av']):
+        if path not in cmp_paths:
+            del state['cmp_av'][path]
+            del state['couples'][path]
+    for path in cmp_paths:
+        if path in changed or path not in state['cmp_av']:
+            state['cmp_av'][path], state['couples'][path] = \
+                average_compared(state['ref_av'], state['intervals'], state['files'][path][1], configuration)
+
+    compared_data, compared_serials = services.split_serials([state['files'][path][1:] for path in cmp_paths])
+    services.set_detector_serials(configuration, services.file_serials([state['files'][ref_path][2]]),
+                                  compared_serials)
+
+    # The coupled data file of a changed compared file replaces the file saved by the last update
+    det_couples = [state['couples'][path] for path in cmp_paths]
+    if configuration.save_files:
+        for i, path in enumerate(cmp_paths):
+            if path in changed:
+                if state['saved'].get(path) and os.path.exists(state['saved'][path]):
+                    os.remove(state['saved'][path])
+                state['saved'][path] = services.save_datacouples_file(
+                    det_couples[i], configuration.compared_det_serials[i], configuration.compared_value,
+                    configuration.unit)
+
+    manage_plots(configuration, ref_data, compared_data, state['ref_av'],
+                 [state['cmp_av'][path] for path in cmp_paths], det_couples)
+    return read_count, len(changed)
+
+
+if __name__ == '__main__':
+    configuration = Configuration(CONFIG_PATH)
+    if configuration.input_data != 'separate' or configuration.interval_sweep or configuration.filter_sweep \
+            or configuration.incremental:
+        raise ValueError('Watch mode works with separate files, without interval or filter sweeps '
+                         'and incremental mode')
+    # For custom intervals start and end time are set as the start and end the union of all intervals
+    if configuration.is_custom_interval:
+        custom_intervals = services.prepare_intervals(configuration)
+        configuration.start_time = custom_intervals[0].start_time
+        configuration.end_time = custom_intervals[len(custom_intervals) - 1].end_time
+    configured = (configuration.start_time, configuration.end_time, configuration.referent_detector)
+    logging.basicConfig(filename='output_files/plots/exception.log', level=logging.ERROR)
+
+    state = new_state()
+    processed = None
+    seen = None
+    changed_at = 0.0
+    print(f'{datetime.now()} Watching {services.REFERENT_DIRECTORY} and {services.COMPARE_DIRECTORY}', flush=True)
+    try:
+        while True:
+            signatures = file_signatures()
+            if signatures != seen:
+                seen = signatures
+                changed_at = time.monotonic()
+            elif signatures != processed and time.monotonic() - changed_at >= DEBOUNCE_SECONDS:
+                start = time.perf_counter()
+                try:
+                    read_count, updated = update(state, configuration, configured, signatures)
+                    print(f'{datetime.now()} Updated - {read_count} files read, {updated} detector couples '
+                          f'averaged again in {time.perf_counter() - start:.2f} s', flush=True)
+                except Exception:
+                    # e.g. a file which is being written, the files are processed again when they change
+                    logging.error(msg=f'{datetime.now()} Watch update failed\n{traceback.format_exc()}')
+                    print(f'{datetime.now()} Update failed, see output_files/plots/exception.log', flush=True)
+                processed = signatures
+            time.sleep(POLL_SECONDS)
+    except KeyboardInterrupt:
+        print(f'{datetime.now()} Stopped watching')